@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import math
+import threading
+import time
+
+class Overloaded(Exception):
+    # Raised when a request can't be admitted or a user is over their rate.
+    # retry_after is whole seconds, for the Retry-After header.
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class ConcurrencyLimit:
+    # At most limit requests of one class run at once; up to max_queue more
+    # wait, each for at most queue_timeout seconds. Past that requests are
+    # turned away straight away rather than piling up behind the ones
+    # already waiting.
+    def __init__(self, name, limit, max_queue, queue_timeout, retry_after):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        # Green under monkey patching, so waiting only parks the request
+        self._slots = threading.Semaphore(limit)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._active = 0
+        self._admitted = 0
+        self._rejected = 0
+
+    def acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self.max_queue:
+                    self._rejected += 1
+                    raise Overloaded(f"Too many {self.name} requests", self.retry_after)
+                self._waiting += 1
+            try:
+                admitted = self._slots.acquire(timeout=self.queue_timeout)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not admitted:
+                with self._lock:
+                    self._rejected += 1
+                raise Overloaded(f"Too many {self.name} requests", self.retry_after)
+        with self._lock:
+            self._active += 1
+            self._admitted += 1
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+    @contextmanager
+    def admit(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self._active,
+                'waiting': self._waiting,
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+            }
+
+class RateLimiter:
+    # Token bucket per key (a user id): rate tokens a second up to burst,
+    # one taken per action. Buckets of the max_keys least recently seen keys
+    # are kept; a forgotten key starts again with a full bucket. Counts are
+    # per process, so with several workers a user gets this rate on each.
+    def __init__(self, name, rate, burst, max_keys=100000):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> (tokens, updated_at)
+        self._buckets = OrderedDict()
+        self._limited = 0
+
+    def hit(self, key):
+        # Take a token for key or raise Overloaded
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self._limited += 1
+                raise Overloaded(f"Too many {self.name}, slow down",
+                                 math.ceil((1 - tokens) / self.rate))
+            self._buckets[key] = (tokens - 1, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._buckets), 'limited': self._limited}
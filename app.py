@@ -1,35 +1,416 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+import eventlet
+from eventlet import tpool
+# Patch before anything else imports socket/threading so the DB driver and
+# the connection pool cooperate with the hub
+eventlet.monkey_patch()
+
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, send_from_directory, g
 import mysql.connector
 from mysql.connector import Error
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 import os
+import posixpath
+import atexit
+import base64
+import hashlib
+import json
+import time
+import mimetypes
+from contextlib import nullcontext
 from datetime import datetime
 from database import Database
+from like_buffer import LikeBuffer
+from presence import PresenceManager
+from chat_members import ChatMembershipCache
+from user_cache import UserProfileCache
+from feed_cache import FeedCache
+from liked_index import LikedIndex
+from image_pipeline import ImagePipeline, parse_variants
+from media_store import MediaStore
+from password_hasher import PasswordHasher
+import queries
+from resumable_uploads import ResumableUploads, UploadError
+from message_bus import create_bus, BusClientManager
+from admission import ConcurrencyLimit, RateLimiter, Overloaded
+from metrics import Metrics
+from hub_monitor import HubMonitor
+from sampling_profiler import SamplingProfiler, ProfilerError
 from config import Config
 from flask_socketio import SocketIO, emit, join_room, leave_room
-import eventlet
-eventlet.monkey_patch()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = Config.SECRET_KEY
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
 
-# File upload configuration
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-app.config['PROFILE_PICTURE_FOLDER'] = 'static/uploads/profile_pictures'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# With a message bus, emits and presence reach clients of every worker
+bus = create_bus(Config.MESSAGE_BUS_URL)
+socketio_options = {'client_manager': BusClientManager(bus)} if bus else {}
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', **socketio_options)
+
+# File upload configuration (files are stored by media_store.py). Larger
+# files go through the resumable upload routes in UPLOAD_CHUNK_SIZE pieces.
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max request size
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mov', 'avi'}
+MESSAGE_PREVIEW_LENGTH = 255  # chat_sessions.last_message_preview column size
+# Paths under these never change content: uploads are named by their hash and
+# variants by their (hashed) source
+IMMUTABLE_MEDIA_PREFIXES = ('uploads/media/', 'uploads/variants/')
+# Where temp files and unfinished uploads were kept before UPLOAD_WORK_DIR;
+# never served, in case an old deploy left files behind
+PRIVATE_MEDIA_PREFIXES = ('uploads/media/tmp/', 'uploads/media/incoming/')
+# Hand file transfers to the fronting web server (see README)
+app.config['USE_X_SENDFILE'] = Config.MEDIA_X_SENDFILE
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Initialize database
-db = Database()
+def encode_cursor(row):
+    # Opaque keyset cursor: the (created_at, id) of the last row on a page
+    raw = f"{row['created_at'].strftime('%Y-%m-%d %H:%M:%S')}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(value):
+    try:
+        raw = base64.urlsafe_b64decode(value.encode()).decode()
+        created_at, post_id = raw.split('|')
+        return datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S'), int(post_id)
+    except ValueError:
+        return None
+
+def page_size(default, maximum):
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum))
+
+def serialize_comment(comment):
+    return dict(comment, created_at=comment['created_at'].strftime('%Y-%m-%d %H:%M'))
+
+def serialize_post(post):
+    data = dict(post)
+    data['created_at'] = post['created_at'].strftime('%Y-%m-%d %H:%M')
+    data['comments'] = [serialize_comment(comment) for comment in post.get('comments', [])]
+    return data
+
+@app.template_global()
+def media_url(path):
+    # URL of an uploaded file or variant, served by the media route
+    return url_for('media', filename=path)
+
+@app.template_global()
+def srcset(variants, fmt):
+    # "url 320w, url 640w, ..." for one format of an image's variants
+    return ", ".join(f"{media_url(path)} {width}w"
+                     for width, path in sorted(variants[fmt].items()))
+
+@app.template_global()
+def largest_variant(variants, fmt='jpeg'):
+    return media_url(variants[fmt][max(variants[fmt])])
+
+def feed_etag(posts, next_cursor):
+    # Covers everything a feed response shows, including the viewer's own
+    # name and likes, so an unchanged page can be answered with a 304
+    content = json.dumps([session['user_id'], session['username'], session.get('profile_picture'),
+                          [serialize_post(post) for post in posts], next_cursor],
+                         sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+def not_modified(etag):
+    # Flashed messages are rendered into the page, so always send those
+    if '_flashes' in session or not request.if_none_match.contains(etag):
+        return None
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def with_etag(response, etag):
+    response = app.make_response(response)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# Per-route query counts, DB time and latency for /metrics
+metrics = Metrics(Config.SLOW_QUERY_TIME)
+
+# Event loop lag, and green threads that hog the loop (blamed on the route
+# or event they were serving)
+hub_monitor = HubMonitor(Config.HUB_BLOCK_THRESHOLD, Config.HUB_LAG_INTERVAL,
+                         label_of=lambda gr: metrics.scope_of(id(gr)))
+
+# Flame graphs of live requests, switched on by an admin for a short window
+profiler = SamplingProfiler(os.path.join(app.root_path, Config.PROFILER_DIR), Config.PROFILER_INTERVAL,
+                            Config.PROFILER_MAX_DURATION, user_of=lambda: session.get('user_id'))
+metrics.add_listener(profiler)
+
+# Initialize database; every statement is reported to metrics
+db = Database(on_query=metrics.record_query)
+
+# Password hashes are computed on native threads, never on the event loop
+passwords = PasswordHasher(Config.PASSWORD_HASH_METHOD, Config.PASSWORD_HASH_WORKERS, offload=tpool.execute)
+
+# Shared part of feed pages; user_liked and authors are layered on per request
+feed_cache = FeedCache(Config.FEED_CACHE_SIZE, Config.FEED_CACHE_TTL, bus,
+                       settle=Config.DB_REPLICA_MAX_LAG if db.replicas else 0.0)
+
+# Opt-in write-behind mode for likes (see like_buffer.py). Cached feed pages
+# are refreshed once the buffered likes reach MySQL.
+like_buffer = LikeBuffer(db, Config.LIKE_BUFFER_FLUSH_INTERVAL, Config.LIKE_BUFFER_MAX_PENDING,
+                         feed_cache.invalidate_posts) if Config.LIKE_BUFFER_ENABLED else None
+
+# Which posts each active viewer liked, for the user_liked flags
+liked_index = LikedIndex(db, Config.LIKED_INDEX_MAX_ENTRIES, Config.LIKED_INDEX_MAX_PER_USER,
+                         Config.LIKED_INDEX_IDLE_TIMEOUT, bus, ttl=Config.LIKED_INDEX_TTL,
+                         pending_of=like_buffer.pending_for if like_buffer else None)
+
+# Online users: sids per user with a grace period and batched DB writes
+presence = PresenceManager(db, Config.PRESENCE_GRACE_PERIOD, Config.PRESENCE_HEARTBEAT_TIMEOUT,
+                           bus, Config.PRESENCE_SNAPSHOT_INTERVAL)
+
+# Participants of each chat session, so sending a message needs no lookup
+chat_members = ChatMembershipCache(db, Config.CHAT_MEMBERSHIP_CACHE_SIZE)
+
+# Usernames and avatars for hydrating posts, comments and messages
+users_cache = UserProfileCache(db, Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL, bus,
+                               settle=Config.DB_REPLICA_MAX_LAG if db.replicas else 0.0)
+
+def image_processed(kind, object_id):
+    # Pages and profiles cached before the variants existed still point at
+    # the original upload
+    if kind == 'post':
+        feed_cache.invalidate_posts([object_id])
+    else:
+        users_cache.invalidate(object_id)
+
+# Uploads are stored by content hash (see media_store.py); hashing and
+# fsync run on native threads
+media_store = MediaStore(app.static_folder, os.path.join(app.root_path, Config.UPLOAD_WORK_DIR),
+                         offload=tpool.execute)
 
-# Store online users (in production, use Redis)
-online_users = {}
+# Chunked uploads that can resume after a dropped connection, for files
+# larger than one request may be
+uploads = ResumableUploads(media_store, Config.UPLOAD_MAX_SIZE)
+
+# Resized, metadata-free copies of uploads, made on native threads so the
+# event loop keeps serving requests meanwhile
+image_pipeline = ImagePipeline(db, app.static_folder, offload=tpool.execute, on_done=image_processed)
+
+@app.before_request
+def start_request_metrics():
+    # First hook, so requests turned away by admission control count too
+    metrics.begin('route', request.endpoint or 'unmatched')
+
+@app.after_request
+def remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exception):
+    metrics.end(request.method, g.get('response_status', 500))
+
+# Admission control: each class of route gets its own concurrency limit and
+# wait queue, so a burst of feed renders or logins can't take every green
+# thread and DB connection and starve chat. Endpoints not listed (static
+# files, media, metrics) use no connection and are never held back.
+admission = {
+    name: ConcurrencyLimit(name, limit, queue, Config.ADMISSION_QUEUE_TIMEOUT, Config.ADMISSION_RETRY_AFTER)
+    for name, limit, queue in (
+        ('heavy_read', Config.ADMISSION_HEAVY_READ_LIMIT, Config.ADMISSION_HEAVY_READ_QUEUE),
+        ('auth', Config.ADMISSION_AUTH_LIMIT, Config.ADMISSION_AUTH_QUEUE),
+        ('write', Config.ADMISSION_WRITE_LIMIT, Config.ADMISSION_WRITE_QUEUE),
+        ('upload', Config.ADMISSION_UPLOAD_LIMIT, Config.ADMISSION_UPLOAD_QUEUE),
+        ('chat', Config.ADMISSION_CHAT_LIMIT, Config.ADMISSION_CHAT_QUEUE),
+    )
+}
+# Classes that hold a pooled connection while admitted, and the background
+# jobs that take one from the primary pool alongside them (replica checks use
+# the replica pools); see the rule in config.py
+DB_ROUTE_CLASSES = ('heavy_read', 'auth', 'write', 'chat')
+db_admitted = sum(admission[name].limit for name in DB_ROUTE_CLASSES)
+db_background = (Config.IMAGE_WORKERS + 1 + (1 if like_buffer else 0)
+                 + (1 if Config.COUNTER_RECONCILE_INTERVAL > 0 else 0))
+if db_admitted + db_background >= Config.DB_POOL_MAX_SIZE:
+    print(f"Warning: admission limits for {', '.join(DB_ROUTE_CLASSES)} ({db_admitted}) plus background "
+          f"jobs ({db_background}) are not below DB_POOL_MAX_SIZE={Config.DB_POOL_MAX_SIZE}; feed "
+          f"traffic can take every connection and stall chat")
+ROUTE_CLASSES = {
+    'feed': 'heavy_read', 'feed_page': 'heavy_read', 'post_comments': 'heavy_read',
+    'profile': 'heavy_read', 'chat': 'heavy_read', 'get_messages': 'heavy_read',
+    'login': 'auth', 'signup': 'auth', 'logout': 'auth',
+    'create_post': 'write', 'like_post': 'write', 'comment_post': 'write',
+    'edit_profile': 'write', 'start_chat': 'write',
+    'create_upload': 'upload', 'upload_status': 'upload', 'upload_chunk': 'upload', 'finalize_upload': 'upload',
+}
+
+# Per-user token buckets on the actions a client can repeat in a loop
+like_limiter = RateLimiter('likes', Config.LIKE_RATE, Config.LIKE_BURST)
+comment_limiter = RateLimiter('comments', Config.COMMENT_RATE, Config.COMMENT_BURST)
+message_limiter = RateLimiter('messages', Config.MESSAGE_RATE, Config.MESSAGE_BURST)
+
+def too_busy(error, status=503):
+    # 503 (overloaded) or 429 (rate limited) with Retry-After; pages get a
+    # short text body, fetch() callers JSON
+    if request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'text/html':
+        response = app.response_class(f"{error}. Please try again in a moment.", status=status, mimetype='text/plain')
+    else:
+        response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+        response.status_code = status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.before_request
+def admit_request():
+    limit = admission.get(ROUTE_CLASSES.get(request.endpoint))
+    if limit is None:
+        return None
+    try:
+        limit.acquire()
+    except Overloaded as e:
+        return degraded_feed() or too_busy(e)
+    g.admission_limit = limit
+    return None
+
+@app.teardown_request
+def release_request(exception):
+    limit = g.pop('admission_limit', None)
+    if limit is not None:
+        limit.release()
+
+# Gauges exported on /metrics next to the per-route numbers
+metrics.add_collector('db_pool', db.pool_stats)
+metrics.add_collector('db_replica', db.replica_stats)
+metrics.add_collector('presence', presence.stats)
+metrics.add_collector('feed_cache', feed_cache.stats)
+metrics.add_collector('user_cache', users_cache.stats)
+metrics.add_collector('liked_index', liked_index.stats)
+metrics.add_collector('chat_members', chat_members.stats)
+metrics.add_collector('image_pipeline', image_pipeline.stats)
+metrics.add_collector('password_hashing', passwords.stats)
+metrics.add_collector('admission', lambda: [dict(limit.stats(), name=name) for name, limit in admission.items()])
+metrics.add_collector('rate_limit', lambda: [dict(limiter.stats(), name=limiter.name)
+                                             for limiter in (like_limiter, comment_limiter, message_limiter)])
+if like_buffer:
+    metrics.add_collector('like_buffer', like_buffer.stats)
+if Config.HUB_MONITOR_ENABLED:
+    metrics.add_collector('hub', hub_monitor.stats)
+    metrics.add_collector('hub_blocked', hub_monitor.block_stats)
+metrics.add_collector('profiler', profiler.stats)
+if bus:
+    metrics.add_collector('bus', lambda: [dict(channel.stats(), name=channel.channel) for channel in (
+        presence.channel, users_cache.channel, feed_cache.channel, liked_index.channel,
+        socketio_options['client_manager'].bus_channel)])
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Prometheus scrape endpoint for this worker. The scraper must send
+    # METRICS_TOKEN as a bearer token; until one is configured the path
+    # doesn't exist, so a deploy that forgot it leaks nothing.
+    if not Config.METRICS_TOKEN or request.headers.get('Authorization') != f"Bearer {Config.METRICS_TOKEN}":
+        abort(404)
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def is_admin():
+    return session.get('user_id') in Config.ADMIN_USER_IDS
+
+@app.route('/admin/profiler', methods=['GET'])
+def profiler_status():
+    if not is_admin():
+        abort(404)
+    return jsonify(profiler.status())
+
+@app.route('/admin/profiler', methods=['POST'])
+def start_profiler():
+    # Profile this worker for {seconds}: a {fraction} of all requests, or
+    # every request to one {route} (endpoint or Socket.IO event name) or
+    # from one {user_id}. The profile is written when the window ends.
+    if not is_admin():
+        abort(404)
+    
+    data = request.get_json(silent=True) or request.form
+    try:
+        seconds = float(data.get('seconds', 30))
+        route = data.get('route') or None
+        user_id = int(data['user_id']) if data.get('user_id') else None
+        fraction = float(data.get('fraction', 1.0 if route or user_id else 0.1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'seconds, fraction and user_id must be numbers'}), 400
+    
+    try:
+        status = profiler.start(seconds, fraction, route, user_id)
+    except ProfilerError as e:
+        return jsonify({'error': str(e)}), e.status
+    print(f"Profiler started by user {session['user_id']} for {seconds:g}s")
+    return jsonify(status), 201
+
+@app.route('/admin/profiler/stop', methods=['POST'])
+def stop_profiler():
+    if not is_admin():
+        abort(404)
+    try:
+        path = profiler.stop()
+    except ProfilerError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({'file': path})
+
+def pin_session():
+    # Send this user's reads to the primary for DB_READ_YOUR_WRITES_WINDOW
+    # seconds. Kept in the session cookie, so it holds whichever worker
+    # serves their next request.
+    if db.replicas:
+        session['pinned_until'] = time.time() + Config.DB_READ_YOUR_WRITES_WINDOW
+
+def reads_pinned():
+    return session.get('pinned_until', 0) > time.time() or db.is_pinned(session['user_id'])
+
+@app.after_request
+def pin_writers(response):
+    # Anything but a GET may have written; keep this user on the primary
+    # for a moment so their next page shows the change
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and 'user_id' in session:
+        pin_session()
+    return response
+
+def degraded_feed():
+    # A feed request turned away under load still gets whatever page is in
+    # the feed cache, even if expired, built without touching the database:
+    # authors and likes not in memory are left blank
+    if request.endpoint not in ('feed', 'feed_page') or 'user_id' not in session:
+        return None
+    before = None
+    if request.endpoint == 'feed_page' and request.args.get('cursor'):
+        before = decode_cursor(request.args['cursor'])
+        if before is None:
+            return None
+    page = feed_cache.get(before, page_size(Config.FEED_PAGE_SIZE, Config.FEED_MAX_PAGE_SIZE), allow_expired=True)
+    if page is None:
+        return None
+    posts, next_cursor = page
+    
+    liked = liked_index.liked(session['user_id'], [post['id'] for post in posts], cached_only=True)
+    for post in posts:
+        post['user_liked'] = int(post['id'] in liked)
+    comments = [comment for post in posts for comment in post['comments']]
+    users_cache.hydrate(posts + comments, cached_only=True)
+    
+    if request.endpoint == 'feed':
+        response = app.make_response(render_template('feed.html', posts=posts, next_cursor=next_cursor,
+                                                     username=session['username']))
+    else:
+        response = jsonify({
+            'posts': [serialize_post(post) for post in posts],
+            'html': render_template('_post_cards.html', posts=posts),
+            'next_cursor': next_cursor
+        })
+    # Never let the degraded copy be revalidated as the real page
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def user_room(user_id):
+    # Every socket of a user joins this room, so emitting to it reaches
+    # all of their open tabs
+    return f"user_{user_id}"
 
 @app.route('/')
 def index():
@@ -54,32 +435,26 @@ def signup():
             flash('Password must be at least 6 characters long!', 'error')
             return render_template('signup.html')
         
-        password_hash = generate_password_hash(password)
+        password_hash = passwords.hash(password)
         
-        connection = db.get_connection()
-        if connection:
-            try:
+        try:
+            with db.connection() as connection:
                 cursor = connection.cursor()
                 insert_query = "INSERT INTO users (username, email, password_hash, bio) VALUES (%s, %s, %s, %s)"
                 cursor.execute(insert_query, (username, email, password_hash, bio))
                 connection.commit()
                 user_id = cursor.lastrowid
                 
-                session['user_id'] = user_id
-                session['username'] = username
-                session['profile_picture'] = None
-                flash('Account created successfully!', 'success')
-                return redirect(url_for('feed'))
-            except Error as e:
-                if 'Duplicate entry' in str(e):
-                    flash('Username or email already exists!', 'error')
-                else:
-                    flash('An error occurred during registration!', 'error')
-            finally:
-                cursor.close()
-                connection.close()
-        else:
-            flash('Database connection failed!', 'error')
+            session['user_id'] = user_id
+            session['username'] = username
+            session['profile_picture'] = None
+            flash('Account created successfully!', 'success')
+            return redirect(url_for('feed'))
+        except Error as e:
+            if 'Duplicate entry' in str(e):
+                flash('Username or email already exists!', 'error')
+            else:
+                flash('An error occurred during registration!', 'error')
     
     return render_template('signup.html')
 
@@ -89,34 +464,44 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        connection = db.get_connection()
-        if connection:
-            try:
+        try:
+            with db.connection() as connection:
                 cursor = connection.cursor(dictionary=True)
-                select_query = "SELECT * FROM users WHERE username = %s OR email = %s"
-                cursor.execute(select_query, (username, username))
-                user = cursor.fetchone()
+                # One unique-index lookup per column rather than an OR, which
+                # MySQL may answer with a scan. Names with an @ are most
+                # likely emails, so that column is tried first.
+                columns = ('email', 'username') if '@' in username else ('username', 'email')
+                user = None
+                for column in columns:
+                    cursor.execute(queries.LOGIN_BY[column], (username,))
+                    user = cursor.fetchone()
+                    if user:
+                        break
+            
+            # Checked with no pooled connection held; this takes a while
+            if user and passwords.verify(user['password_hash'], password):
+                # Upgrade hashes made with an older method or work factor
+                new_hash = passwords.hash(password) if passwords.needs_rehash(user['password_hash']) else None
                 
-                if user and check_password_hash(user['password_hash'], password):
-                    session['user_id'] = user['id']
-                    session['username'] = user['username']
-                    session['profile_picture'] = user['profile_picture']
-                    
+                with db.connection() as connection:
+                    cursor = connection.cursor()
                     # Update user online status
-                    cursor.execute("UPDATE users SET is_online = TRUE WHERE id = %s", (user['id'],))
+                    if new_hash:
+                        cursor.execute("UPDATE users SET is_online = TRUE, password_hash = %s WHERE id = %s",
+                                       (new_hash, user['id']))
+                    else:
+                        cursor.execute("UPDATE users SET is_online = TRUE WHERE id = %s", (user['id'],))
                     connection.commit()
-                    
-                    flash('Login successful!', 'success')
-                    return redirect(url_for('feed'))
-                else:
-                    flash('Invalid username/email or password!', 'error')
-            except Error as e:
-                flash('An error occurred during login!', 'error')
-            finally:
-                cursor.close()
-                connection.close()
-        else:
-            flash('Database connection failed!', 'error')
+                
+                session['user_id'] = user['id']
+                session['username'] = user['username']
+                session['profile_picture'] = user['profile_picture']
+                flash('Login successful!', 'success')
+                return redirect(url_for('feed'))
+            else:
+                flash('Invalid username/email or password!', 'error')
+        except Error as e:
+            flash('An error occurred during login!', 'error')
     
     return render_template('login.html')
 
@@ -125,43 +510,147 @@ def feed():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    connection = db.get_connection()
-    if connection:
-        try:
+    next_cursor = None
+    try:
+        with db.read_connection(reads_pinned()) as connection:
             cursor = connection.cursor(dictionary=True)
-            # Get all posts with user information and like/comment counts
-            cursor.execute("""
-                SELECT p.*, u.username, u.profile_picture,
-                (SELECT COUNT(*) FROM likes l WHERE l.post_id = p.id) as like_count,
-                (SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id) as comment_count,
-                EXISTS(SELECT 1 FROM likes l WHERE l.post_id = p.id AND l.user_id = %s) as user_liked
-                FROM posts p
-                JOIN users u ON p.user_id = u.id
-                ORDER BY p.created_at DESC
-            """, (session['user_id'],))
-            posts = cursor.fetchall()
-            
-            # Get comments for each post
-            for post in posts:
-                cursor.execute("""
-                    SELECT c.*, u.username, u.profile_picture
-                    FROM comments c 
-                    JOIN users u ON c.user_id = u.id 
-                    WHERE c.post_id = %s 
-                    ORDER BY c.created_at ASC
-                """, (post['id'],))
-                post['comments'] = cursor.fetchall()
+            posts, next_cursor = fetch_feed_page(cursor, session['user_id'], None, page_size(Config.FEED_PAGE_SIZE, Config.FEED_MAX_PAGE_SIZE))
                 
-        except Error as e:
-            flash('An error occurred while loading the feed!', 'error')
-            posts = []
-        finally:
-            cursor.close()
-            connection.close()
-    else:
+    except Error as e:
+        flash('An error occurred while loading the feed!', 'error')
         posts = []
     
-    return render_template('feed.html', posts=posts, username=session['username'])
+    etag = feed_etag(posts, next_cursor)
+    return not_modified(etag) or with_etag(
+        render_template('feed.html', posts=posts, next_cursor=next_cursor, username=session['username']), etag)
+
+@app.route('/feed/page')
+def feed_page():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    before = None
+    if request.args.get('cursor'):
+        before = decode_cursor(request.args['cursor'])
+        if before is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    try:
+        with db.read_connection(reads_pinned()) as connection:
+            cursor = connection.cursor(dictionary=True)
+            posts, next_cursor = fetch_feed_page(cursor, session['user_id'], before, page_size(Config.FEED_PAGE_SIZE, Config.FEED_MAX_PAGE_SIZE))
+            
+    except Error as e:
+        return jsonify({'error': 'Database error'}), 500
+    
+    etag = feed_etag(posts, next_cursor)
+    return not_modified(etag) or with_etag(jsonify({
+        'posts': [serialize_post(post) for post in posts],
+        'html': render_template('_post_cards.html', posts=posts),
+        'next_cursor': next_cursor
+    }), etag)
+
+def fetch_feed_page(cursor, user_id, before, limit):
+    # The shared page comes from feed_cache when possible; only the viewer's
+    # likes and the authors are looked up per request. Someone who just
+    # wrote reads past the cache, which may hold a page read from a replica
+    # without their change.
+    page = None if reads_pinned() else feed_cache.get(before, limit)
+    if page is None:
+        generation = feed_cache.generation()
+        page = load_feed_page(cursor, before, limit)
+        feed_cache.put(before, limit, *page, generation)
+    posts, next_cursor = page
+    
+    liked = liked_index.liked(user_id, [post['id'] for post in posts], cursor)
+    for post in posts:
+        post['user_liked'] = int(post['id'] in liked)
+    
+    # Authors of the posts and their comment previews in one cache lookup
+    comments = [comment for post in posts for comment in post['comments']]
+    users_cache.hydrate(posts + comments, cursor=cursor)
+    
+    if like_buffer:
+        like_buffer.apply_pending(posts, user_id)
+    
+    return posts, next_cursor
+
+def load_feed_page(cursor, before, limit):
+    # Reads limit + 1 rows of the (created_at, id) keyset walk
+    params = []
+    if before:
+        params += [before[0], before[0], before[1]]
+    params.append(limit + 1)
+    
+    cursor.execute(queries.feed_page(before), tuple(params))
+    posts = cursor.fetchall()
+    
+    # The extra row only tells us whether another page exists
+    next_cursor = encode_cursor(posts[limit - 1]) if len(posts) > limit else None
+    posts = posts[:limit]
+    for post in posts:
+        post['image_variants'] = parse_variants(post['image_variants'])
+    
+    fetch_comment_previews(cursor, posts, Config.FEED_COMMENT_PREVIEW)
+    return posts, next_cursor
+
+def fetch_comment_previews(cursor, posts, per_post):
+    # Latest per_post comments for every post on the page in one round-trip
+    for post in posts:
+        post['comments'] = []
+        post['comments_cursor'] = None
+    if not posts or per_post <= 0:
+        return
+    
+    params = []
+    for post in posts:
+        params += [post['id'], per_post]
+    cursor.execute(queries.comment_previews(len(posts)), tuple(params))
+    
+    by_post = {post['id']: post for post in posts}
+    for comment in cursor.fetchall():
+        by_post[comment['post_id']]['comments'].append(comment)
+    
+    for post in posts:
+        # Display oldest first; the cursor points "view more" at older ones
+        post['comments'].sort(key=lambda comment: (comment['created_at'], comment['id']))
+        if post['comments'] and post['comment_count'] > len(post['comments']):
+            post['comments_cursor'] = encode_cursor(post['comments'][0])
+
+@app.route('/posts/<int:post_id>/comments')
+def post_comments(post_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    before = None
+    if request.args.get('cursor'):
+        before = decode_cursor(request.args['cursor'])
+        if before is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    limit = page_size(Config.COMMENTS_PAGE_SIZE, Config.COMMENTS_MAX_PAGE_SIZE)
+    
+    try:
+        with db.read_connection(reads_pinned()) as connection:
+            cursor = connection.cursor(dictionary=True)
+            params = [post_id]
+            if before:
+                params += [before[0], before[0], before[1]]
+            params.append(limit + 1)
+            cursor.execute(queries.comments_page(before), tuple(params))
+            comments = cursor.fetchall()
+            users_cache.hydrate(comments, cursor=cursor)
+            
+    except Error as e:
+        return jsonify({'error': 'Database error'}), 500
+    
+    next_cursor = encode_cursor(comments[limit - 1]) if len(comments) > limit else None
+    comments = comments[:limit]
+    comments.reverse()
+    
+    return jsonify({
+        'comments': [serialize_comment(comment) for comment in comments],
+        'next_cursor': next_cursor
+    })
 
 @app.route('/create_post', methods=['GET', 'POST'])
 def create_post():
@@ -170,78 +659,166 @@ def create_post():
     
     if request.method == 'POST':
         caption = request.form.get('caption', '')
-        file = request.files['media']
+        upload_id = request.form.get('upload_id')
+        file = request.files.get('media')
+        media = None
         
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            
-            # Determine if it's an image or video
-            file_extension = filename.rsplit('.', 1)[1].lower()
-            image_url = f"uploads/{filename}" if file_extension in ['png', 'jpg', 'jpeg', 'gif'] else None
-            video_url = f"uploads/{filename}" if file_extension in ['mp4', 'mov', 'avi'] else None
-            
-            connection = db.get_connection()
-            if connection:
-                try:
-                    cursor = connection.cursor()
-                    insert_query = "INSERT INTO posts (user_id, image_url, video_url, caption) VALUES (%s, %s, %s, %s)"
-                    cursor.execute(insert_query, (session['user_id'], image_url, video_url, caption))
-                    connection.commit()
-                    flash('Vibe created successfully!', 'success')
-                    return redirect(url_for('feed'))
-                except Error as e:
-                    flash('An error occurred while creating the vibe!', 'error')
-                finally:
-                    cursor.close()
-                    connection.close()
+        if upload_id:
+            # Sent through the resumable upload routes and finalized; only
+            # used up once the post is committed
+            media = uploads.claim(upload_id, session['user_id'])
+        elif file and allowed_file(file.filename):
+            file_extension = file.filename.rsplit('.', 1)[1].lower()
+            media = nullcontext((media_store.save(file, file_extension), file_extension))
+        
+        if media:
+            try:
+                with media as (media_path, file_extension):
+                    # Determine if it's an image or video
+                    image_url = media_path if file_extension in ['png', 'jpg', 'jpeg', 'gif'] else None
+                    video_url = media_path if file_extension in ['mp4', 'mov', 'avi'] else None
+                    
+                    with db.connection() as connection:
+                        cursor = connection.cursor()
+                        insert_query = "INSERT INTO posts (user_id, image_url, video_url, caption) VALUES (%s, %s, %s, %s)"
+                        cursor.execute(insert_query, (session['user_id'], image_url, video_url, caption))
+                        connection.commit()
+                        post_id = cursor.lastrowid
+                feed_cache.invalidate_all()
+                if image_url:
+                    image_pipeline.submit_post(post_id, image_url)
+                flash('Vibe created successfully!', 'success')
+                return redirect(url_for('feed'))
+            except UploadError as e:
+                flash('That upload is missing or unfinished, please try again!', 'error')
+            except Error as e:
+                flash('An error occurred while creating the vibe!', 'error')
         else:
             flash('Please select a valid image or video file!', 'error')
     
     return render_template('create_post.html')
 
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    # Start a resumable upload: {filename, size} -> {upload_id, offset,
+    # chunk_size}. Then PUT the bytes in order, each request carrying an
+    # Upload-Offset header, and POST to /uploads/<id>/finalize.
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get('filename', ''))
+    size = data.get('size')
+    if not allowed_file(filename):
+        return jsonify({'error': 'Please select a valid image or video file'}), 400
+    if not isinstance(size, int):
+        return jsonify({'error': 'size is required'}), 400
+    
+    try:
+        upload_id = uploads.create(session['user_id'], filename.rsplit('.', 1)[1].lower(), size)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({'upload_id': upload_id, 'offset': 0, 'chunk_size': Config.UPLOAD_CHUNK_SIZE}), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    # How many bytes the server has; a client resumes from this offset
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    try:
+        return jsonify(uploads.status(upload_id, session['user_id']))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    # Append the request body at Upload-Offset. The body is streamed to disk
+    # as it arrives, never buffered whole. A wrong offset answers 409 with
+    # the offset to continue from.
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Upload-Offset header is required'}), 400
+    length = request.content_length
+    if length is None:
+        return jsonify({'error': 'Content-Length is required'}), 411
+    
+    try:
+        new_offset = uploads.write(upload_id, session['user_id'], offset, request.stream, length)
+    except UploadError as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), e.status
+    return jsonify({'offset': new_offset})
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    # Move the complete file into the media store; pass the upload_id to
+    # create_post afterwards. Safe to retry.
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    try:
+        uploads.finalize(upload_id, session['user_id'])
+    except UploadError as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), e.status
+    return jsonify({'upload_id': upload_id, 'finalized': True})
+
 @app.route('/like_post/<int:post_id>', methods=['POST'])
 def like_post(post_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    connection = db.get_connection()
-    if connection:
+    try:
+        like_limiter.hit(session['user_id'])
+    except Overloaded as e:
+        return too_busy(e, 429)
+    
+    if like_buffer:
         try:
+            result = like_buffer.toggle(session['user_id'], post_id)
+        except Error as e:
+            return jsonify({'error': 'Database error'}), 500
+        if result is None:
+            return jsonify({'error': 'Post not found'}), 404
+        if like_buffer.should_flush():
+            socketio.start_background_task(flush_like_buffer)
+        action, like_count = result
+        liked_index.set(session['user_id'], post_id, action == 'liked')
+        return jsonify({'action': action, 'like_count': like_count})
+    
+    try:
+        with db.connection() as connection:
             cursor = connection.cursor()
             
-            # Check if already liked
-            cursor.execute("SELECT id FROM likes WHERE user_id = %s AND post_id = %s", 
+            # Unlike if already liked, otherwise like. The counter on posts
+            # moves in the same transaction as the likes row.
+            cursor.execute("DELETE FROM likes WHERE user_id = %s AND post_id = %s", 
                          (session['user_id'], post_id))
-            existing_like = cursor.fetchone()
             
-            if existing_like:
-                # Unlike
-                cursor.execute("DELETE FROM likes WHERE user_id = %s AND post_id = %s", 
-                             (session['user_id'], post_id))
+            if cursor.rowcount:
+                cursor.execute("UPDATE posts SET like_count = GREATEST(like_count - 1, 0) WHERE id = %s", (post_id,))
                 action = 'unliked'
             else:
-                # Like
                 cursor.execute("INSERT INTO likes (user_id, post_id) VALUES (%s, %s)", 
                              (session['user_id'], post_id))
+                cursor.execute("UPDATE posts SET like_count = like_count + 1 WHERE id = %s", (post_id,))
                 action = 'liked'
             
-            connection.commit()
-            
             # Get updated like count
-            cursor.execute("SELECT COUNT(*) as like_count FROM likes WHERE post_id = %s", (post_id,))
+            cursor.execute("SELECT like_count FROM posts WHERE id = %s", (post_id,))
             like_count = cursor.fetchone()[0]
             
+            connection.commit()
+            feed_cache.invalidate_posts([post_id])
+            liked_index.set(session['user_id'], post_id, action == 'liked')
+            
             return jsonify({'action': action, 'like_count': like_count})
             
-        except Error as e:
-            return jsonify({'error': 'Database error'}), 500
-        finally:
-            cursor.close()
-            connection.close()
-    
-    return jsonify({'error': 'Database connection failed'}), 500
+    except Error as e:
+        return jsonify({'error': 'Database error'}), 500
 
 @app.route('/comment_post/<int:post_id>', methods=['POST'])
 def comment_post(post_id):
@@ -252,74 +829,82 @@ def comment_post(post_id):
     if not comment_text:
         return jsonify({'error': 'Comment cannot be empty'}), 400
     
-    connection = db.get_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
+    try:
+        comment_limiter.hit(session['user_id'])
+    except Overloaded as e:
+        return too_busy(e, 429)
+    
+    try:
+        with db.connection() as connection:
+            cursor = connection.cursor(dictionary=True)
             insert_query = "INSERT INTO comments (user_id, post_id, comment_text) VALUES (%s, %s, %s)"
             cursor.execute(insert_query, (session['user_id'], post_id, comment_text))
+            cursor.execute("UPDATE posts SET comment_count = comment_count + 1 WHERE id = %s", (post_id,))
             connection.commit()
+            feed_cache.invalidate_posts([post_id])
             
-            # Get the new comment with username
-            cursor.execute("""
-                SELECT c.*, u.username, u.profile_picture
-                FROM comments c 
-                JOIN users u ON c.user_id = u.id 
-                WHERE c.id = LAST_INSERT_ID()
-            """)
+            # Get the new comment; the author is the current user
+            cursor.execute("SELECT comment_text, created_at FROM comments WHERE id = LAST_INSERT_ID()")
             new_comment = cursor.fetchone()
             
             return jsonify({
                 'success': True,
                 'comment': {
-                    'username': new_comment['username'],
-                    'profile_picture': new_comment['profile_picture'],
+                    'username': session['username'],
+                    'profile_picture': session.get('profile_picture'),
                     'comment_text': new_comment['comment_text'],
                     'created_at': new_comment['created_at'].strftime('%Y-%m-%d %H:%M')
                 }
             })
             
-        except Error as e:
-            return jsonify({'error': 'Database error'}), 500
-        finally:
-            cursor.close()
-            connection.close()
+    except Error as e:
+        return jsonify({'error': 'Database error'}), 500
+
+@app.route('/media/<path:filename>')
+def media(filename):
+    # Uploads with Range/206 support (so seeking in a video fetches only the
+    # bytes needed) and cache headers. Content-addressed files are cached
+    # for a year and never revalidated.
+    # Checked in canonical form, so uploads/x/../media/tmp/ can't get around
+    # the private prefixes
+    filename = posixpath.normpath(filename)
+    if (not filename.startswith('uploads/') or filename.startswith(PRIVATE_MEDIA_PREFIXES)
+            or safe_join(app.static_folder, filename) is None):
+        abort(404)
     
-    return jsonify({'error': 'Database connection failed'}), 500
+    if Config.MEDIA_ACCEL_PREFIX:
+        # nginx serves the file (and handles Range) from an internal location
+        response = app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = Config.MEDIA_ACCEL_PREFIX + filename
+    else:
+        response = send_from_directory(app.static_folder, filename, conditional=True)
+    
+    if filename.startswith(IMMUTABLE_MEDIA_PREFIXES):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
 
 @app.route('/profile')
 def profile():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    connection = db.get_connection()
-    if connection:
-        try:
+    try:
+        with db.read_connection(reads_pinned()) as connection:
             cursor = connection.cursor(dictionary=True)
             
             # Get user's posts
-            cursor.execute("""
-                SELECT p.*, 
-                (SELECT COUNT(*) FROM likes l WHERE l.post_id = p.id) as like_count,
-                (SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id) as comment_count
-                FROM posts p 
-                WHERE p.user_id = %s 
-                ORDER BY p.created_at DESC
-            """, (session['user_id'],))
+            cursor.execute(queries.PROFILE_POSTS, (session['user_id'],))
             user_posts = cursor.fetchall()
             
             # Get user info
-            cursor.execute("SELECT username, email, profile_picture, bio, created_at FROM users WHERE id = %s", (session['user_id'],))
+            cursor.execute(queries.PROFILE_USER, (session['user_id'],))
             user_info = cursor.fetchone()
+            user_info['profile_picture_variants'] = parse_variants(user_info['profile_picture_variants'])
             
-        except Error as e:
-            flash('An error occurred while loading profile!', 'error')
-            user_posts = []
-            user_info = {}
-        finally:
-            cursor.close()
-            connection.close()
-    else:
+    except Error as e:
+        flash('An error occurred while loading profile!', 'error')
         user_posts = []
         user_info = {}
     
@@ -330,9 +915,8 @@ def edit_profile():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    connection = db.get_connection()
-    if connection:
-        try:
+    try:
+        with db.connection() as connection:
             if request.method == 'POST':
                 username = request.form.get('username')
                 bio = request.form.get('bio', '')
@@ -349,14 +933,11 @@ def edit_profile():
                 
                 profile_picture_path = session.get('profile_picture')
                 
+                new_picture = False
                 if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    # Add user id to filename to make it unique
-                    name, ext = os.path.splitext(filename)
-                    filename = f"user_{session['user_id']}_{int(datetime.now().timestamp())}{ext}"
-                    file_path = os.path.join(app.config['PROFILE_PICTURE_FOLDER'], filename)
-                    file.save(file_path)
-                    profile_picture_path = f"uploads/profile_pictures/{filename}"
+                    new_picture_path = media_store.save(file, file.filename.rsplit('.', 1)[1])
+                    new_picture = new_picture_path != profile_picture_path
+                    profile_picture_path = new_picture_path
                 
                 # Update user in database
                 update_query = "UPDATE users SET username = %s, bio = %s"
@@ -365,12 +946,18 @@ def edit_profile():
                 if profile_picture_path:
                     update_query += ", profile_picture = %s"
                     params.append(profile_picture_path)
+                if new_picture:
+                    # The old picture's variants no longer apply
+                    update_query += ", profile_picture_variants = NULL"
                 
                 update_query += " WHERE id = %s"
                 params.append(session['user_id'])
                 
                 cursor.execute(update_query, tuple(params))
                 connection.commit()
+                users_cache.invalidate(session['user_id'])
+                if new_picture:
+                    image_pipeline.submit_avatar(session['user_id'], profile_picture_path)
                 
                 # Update session
                 session['username'] = username
@@ -385,14 +972,8 @@ def edit_profile():
             cursor.execute("SELECT username, email, profile_picture, bio FROM users WHERE id = %s", (session['user_id'],))
             user_info = cursor.fetchone()
             
-        except Error as e:
-            flash('An error occurred while updating profile!', 'error')
-            return redirect(url_for('profile'))
-        finally:
-            cursor.close()
-            connection.close()
-    else:
-        flash('Database connection failed!', 'error')
+    except Error as e:
+        flash('An error occurred while updating profile!', 'error')
         return redirect(url_for('profile'))
     
     return render_template('edit_profile.html', user=user_info)
@@ -402,53 +983,29 @@ def chat():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    connection = db.get_connection()
     users = []
     chat_sessions = []
     
-    if connection:
-        try:
+    try:
+        with db.read_connection(reads_pinned()) as connection:
             cursor = connection.cursor(dictionary=True)
             
-            # Get all users except current user
-            cursor.execute("""
-                SELECT id, username, profile_picture, is_online, last_seen 
-                FROM users 
-                WHERE id != %s 
-                ORDER BY username
-            """, (session['user_id'],))
+            # Get users except current user (capped)
+            cursor.execute(queries.CHAT_USERS, (session['user_id'], Config.CHAT_USER_LIST_LIMIT))
             users = cursor.fetchall()
             
             # Get chat sessions for current user
-            cursor.execute("""
-                SELECT cs.*, 
-                CASE 
-                    WHEN cs.user1_id = %s THEN u2.username
-                    ELSE u1.username
-                END as other_username,
-                CASE 
-                    WHEN cs.user1_id = %s THEN u2.profile_picture
-                    ELSE u1.profile_picture
-                END as other_profile_picture,
-                CASE 
-                    WHEN cs.user1_id = %s THEN u2.is_online
-                    ELSE u1.is_online
-                END as other_online,
-                (SELECT message_text FROM messages WHERE chat_session_id = cs.id ORDER BY created_at DESC LIMIT 1) as last_message,
-                (SELECT created_at FROM messages WHERE chat_session_id = cs.id ORDER BY created_at DESC LIMIT 1) as last_message_time
-                FROM chat_sessions cs
-                JOIN users u1 ON cs.user1_id = u1.id
-                JOIN users u2 ON cs.user2_id = u2.id
-                WHERE cs.user1_id = %s OR cs.user2_id = %s
-                ORDER BY cs.updated_at DESC
-            """, (session['user_id'], session['user_id'], session['user_id'], session['user_id'], session['user_id']))
+            cursor.execute(queries.CHAT_SESSIONS, (session['user_id'], session['user_id'], session['user_id']))
             chat_sessions = cursor.fetchall()
             
-        except Error as e:
-            flash('An error occurred while loading chat!', 'error')
-        finally:
-            cursor.close()
-            connection.close()
+            # The other participant's name and avatar from the cache, and
+            # online status from the same live view the socket events use
+            users_cache.hydrate(chat_sessions, key='other_user_id', prefix='other_', cursor=cursor)
+            for chat_session in chat_sessions:
+                chat_session['other_online'] = presence.is_online(chat_session['other_user_id'])
+            
+    except Error as e:
+        flash('An error occurred while loading chat!', 'error')
     
     return render_template('chat.html', users=users, chat_sessions=chat_sessions)
 
@@ -457,71 +1014,88 @@ def get_messages(chat_session_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    connection = db.get_connection()
-    if connection:
-        try:
+    # ?before_id=<id> pages back through history; without it we return the
+    # newest page and mark the conversation read
+    before_id = request.args.get('before_id', type=int)
+    limit = page_size(Config.MESSAGES_PAGE_SIZE, Config.MESSAGES_MAX_PAGE_SIZE)
+    
+    try:
+        with db.read_connection(reads_pinned()) as connection:
             cursor = connection.cursor(dictionary=True)
             
             # Verify user has access to this chat session
-            cursor.execute("""
-                SELECT id FROM chat_sessions 
-                WHERE id = %s AND (user1_id = %s OR user2_id = %s)
-            """, (chat_session_id, session['user_id'], session['user_id']))
+            cursor.execute(queries.CHAT_SESSION_FOR_USER, (chat_session_id, session['user_id'], session['user_id']))
             chat_session = cursor.fetchone()
             
             if not chat_session:
                 return jsonify({'error': 'Chat session not found'}), 404
+            chat_members.remember(chat_session_id, chat_session['user1_id'], chat_session['user2_id'])
             
-            # Get messages
-            cursor.execute("""
-                SELECT m.*, u.username, u.profile_picture
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE m.chat_session_id = %s
-                ORDER BY m.created_at ASC
-            """, (chat_session_id,))
-            messages = cursor.fetchall()
-            
-            # Mark messages as read
-            cursor.execute("""
-                UPDATE messages 
-                SET is_read = TRUE 
-                WHERE chat_session_id = %s AND sender_id != %s AND is_read = FALSE
-            """, (chat_session_id, session['user_id']))
-            connection.commit()
+            side, other_side = ('user1', 'user2') if chat_session['user1_id'] == session['user_id'] else ('user2', 'user1')
             
-            # Convert datetime objects to strings
-            for message in messages:
-                message['created_at'] = message['created_at'].strftime('%Y-%m-%d %H:%M')
+            # Get one page of messages, newest first
+            params = [chat_session_id]
+            if before_id:
+                params.append(before_id)
+            params.append(limit + 1)
+            cursor.execute(queries.messages_page(before_id), tuple(params))
+            messages = cursor.fetchall()
             
-            return jsonify({'messages': messages})
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            messages.reverse()
+            users_cache.hydrate(messages, key='sender_id', cursor=cursor)
+        
+        # Mark read by moving this participant's high-water mark to the
+        # newest message returned: one row write, however many were unread.
+        # The reads above may have come from a lagging replica, so only what
+        # was actually served counts as read, and the primary never moves
+        # the mark backwards. The unread counter is cleared once the mark
+        # reaches the chat's last message. A replica's mark is never ahead
+        # of the primary's, so one already past this page means nothing to do.
+        last_read_id = chat_session[f'{side}_last_read_id']
+        if not before_id and messages and (last_read_id is None or last_read_id < messages[-1]['id']):
+            newest_id = messages[-1]['id']
+            with db.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(f"""
+                    UPDATE chat_sessions
+                    SET {side}_unread = IF(last_message_id <= %s, 0, {side}_unread),
+                        {side}_last_read_id = %s, updated_at = updated_at
+                    WHERE id = %s AND ({side}_last_read_id IS NULL OR {side}_last_read_id < %s)
+                """, (newest_id, newest_id, chat_session_id, newest_id))
+                connection.commit()
+        
+        # Convert datetime objects to strings
+        for message in messages:
+            message['created_at'] = message['created_at'].strftime('%Y-%m-%d %H:%M')
+        
+        return jsonify({
+            'messages': messages,
+            'has_more': has_more,
+            'next_before_id': messages[0]['id'] if has_more else None,
+            # Everything up to here has been seen by the other participant
+            'other_last_read_id': chat_session[f'{other_side}_last_read_id']
+        })
             
-        except Error as e:
-            return jsonify({'error': 'Database error'}), 500
-        finally:
-            cursor.close()
-            connection.close()
-    
-    return jsonify({'error': 'Database connection failed'}), 500
+    except Error as e:
+        return jsonify({'error': 'Database error'}), 500
 
 @app.route('/start_chat/<int:user_id>')
 def start_chat(user_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    connection = db.get_connection()
-    if connection:
-        try:
+    try:
+        with db.connection() as connection:
             cursor = connection.cursor(dictionary=True)
             
             # Check if chat session already exists
-            cursor.execute("""
-                SELECT id FROM chat_sessions 
-                WHERE (user1_id = %s AND user2_id = %s) OR (user1_id = %s AND user2_id = %s)
-            """, (session['user_id'], user_id, user_id, session['user_id']))
+            cursor.execute(queries.CHAT_BETWEEN, (session['user_id'], user_id, user_id, session['user_id']))
             existing_chat = cursor.fetchone()
             
             if existing_chat:
+                chat_members.remember(existing_chat['id'], existing_chat['user1_id'], existing_chat['user2_id'])
                 return jsonify({'chat_session_id': existing_chat['id']})
             
             # Create new chat session
@@ -531,129 +1105,205 @@ def start_chat(user_id):
             """, (session['user_id'], user_id))
             connection.commit()
             chat_session_id = cursor.lastrowid
+            chat_members.remember(chat_session_id, session['user_id'], user_id)
+            # A GET that writes, so the after_request pin doesn't cover it
+            pin_session()
             
             return jsonify({'chat_session_id': chat_session_id})
             
+    except Error as e:
+        return jsonify({'error': 'Database error'}), 500
+
+def reconcile_counters_forever():
+    # Walk posts in id order repairing like_count/comment_count drift (e.g.
+    # from rows deleted by FK cascades), then rest until the next pass.
+    after_id = 0
+    while True:
+        try:
+            last_id, repaired = db.reconcile_post_counters(after_id, Config.COUNTER_RECONCILE_BATCH)
         except Error as e:
-            return jsonify({'error': 'Database error'}), 500
-        finally:
-            cursor.close()
-            connection.close()
-    
-    return jsonify({'error': 'Database connection failed'}), 500
+            print(f"Error reconciling post counters: {e}")
+            last_id, repaired = after_id, 0
+        
+        if repaired:
+            print(f"Repaired counters on {repaired} posts")
+            feed_cache.invalidate_all()
+        
+        if last_id is None:
+            after_id = 0
+            socketio.sleep(Config.COUNTER_RECONCILE_INTERVAL)
+        else:
+            after_id = last_id
+            socketio.sleep(Config.COUNTER_RECONCILE_PAUSE)
+
+def flush_like_buffer():
+    try:
+        like_buffer.flush()
+    except Error as e:
+        print(f"Error flushing like buffer: {e}")
+
+def flush_like_buffer_forever():
+    while True:
+        socketio.sleep(Config.LIKE_BUFFER_FLUSH_INTERVAL)
+        flush_like_buffer()
+
+def cleanup_uploads_forever():
+    # Drop resumable uploads that were abandoned part way
+    while True:
+        try:
+            removed = uploads.cleanup(Config.UPLOAD_SESSION_MAX_AGE)
+            if removed:
+                print(f"Removed {removed} abandoned uploads")
+            media_store.cleanup_temp()
+        except OSError as e:
+            print(f"Error cleaning up uploads: {e}")
+        socketio.sleep(3600)
+
+def check_replicas_forever():
+    while True:
+        db.check_replicas()
+        socketio.sleep(Config.DB_REPLICA_CHECK_INTERVAL)
+
+def start_background_jobs():
+    if Config.HUB_MONITOR_ENABLED:
+        hub_monitor.start(socketio.start_background_task)
+    if Config.COUNTER_RECONCILE_INTERVAL > 0:
+        socketio.start_background_task(reconcile_counters_forever)
+    if like_buffer:
+        socketio.start_background_task(flush_like_buffer_forever)
+        # Write out the last window on a clean shutdown
+        atexit.register(flush_like_buffer)
+    socketio.start_background_task(presence_forever)
+    socketio.start_background_task(cleanup_uploads_forever)
+    if db.replicas:
+        socketio.start_background_task(check_replicas_forever)
+    for _ in range(Config.IMAGE_WORKERS):
+        socketio.start_background_task(image_pipeline.run)
+    try:
+        image_pipeline.backfill()
+    except Error as e:
+        print(f"Error queueing image backfill: {e}")
+    if bus:
+        for component in (presence, users_cache, feed_cache, liked_index):
+            socketio.start_background_task(component.channel.listen, component.receive)
+    atexit.register(flush_presence)
+
+def flush_presence():
+    try:
+        presence.flush()
+    except Error as e:
+        print(f"Error updating online status: {e}")
+
+def presence_forever():
+    # Announce users whose grace period ran out, then batch their
+    # is_online/last_seen changes into MySQL
+    while True:
+        socketio.sleep(Config.PRESENCE_FLUSH_INTERVAL)
+        for user_id in presence.tick():
+            socketio.emit('user_offline', {'user_id': user_id})
+            print(f"User {user_id} offline")
+        flush_presence()
 
 @socketio.on('connect')
-def handle_connect():
+@metrics.event('connect')
+def handle_connect(auth=None):
     if 'user_id' in session:
         user_id = session['user_id']
-        online_users[user_id] = request.sid
+        join_room(user_room(user_id))
         
-        # Update user online status in database
-        connection = db.get_connection()
-        if connection:
-            try:
-                cursor = connection.cursor()
-                cursor.execute("UPDATE users SET is_online = TRUE WHERE id = %s", (user_id,))
-                connection.commit()
-            except Error as e:
-                print(f"Error updating online status: {e}")
-            finally:
-                cursor.close()
-                connection.close()
-        
-        emit('user_online', {'user_id': user_id}, broadcast=True)
+        if presence.connect(user_id, request.sid):
+            emit('user_online', {'user_id': user_id}, broadcast=True)
         print(f"User {user_id} connected")
 
 @socketio.on('disconnect')
+@metrics.event('disconnect')
 def handle_disconnect():
+    if 'user_id' in session:
+        # Offline is announced by presence_forever once the grace period
+        # passes without the user reconnecting
+        presence.disconnect(request.sid)
+        print(f"User {session['user_id']} disconnected")
+
+@socketio.on('heartbeat')
+@metrics.event('heartbeat')
+def handle_heartbeat():
     if 'user_id' in session:
         user_id = session['user_id']
-        online_users.pop(user_id, None)
-        
-        # Update user offline status in database
-        connection = db.get_connection()
-        if connection:
-            try:
-                cursor = connection.cursor()
-                cursor.execute("UPDATE users SET is_online = FALSE, last_seen = NOW() WHERE id = %s", (user_id,))
-                connection.commit()
-            except Error as e:
-                print(f"Error updating offline status: {e}")
-            finally:
-                cursor.close()
-                connection.close()
-        
-        emit('user_offline', {'user_id': user_id}, broadcast=True)
-        print(f"User {user_id} disconnected")
+        if presence.heartbeat(user_id, request.sid):
+            join_room(user_room(user_id))
+            emit('user_online', {'user_id': user_id}, broadcast=True)
 
 @socketio.on('send_message')
+@metrics.event('send_message')
 def handle_send_message(data):
     if 'user_id' not in session:
         return
     
+    sender_id = session['user_id']
     chat_session_id = data['chat_session_id']
     message_text = data['message_text']
     
-    connection = db.get_connection()
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Save message to database
-            cursor.execute("""
-                INSERT INTO messages (chat_session_id, sender_id, message_text) 
-                VALUES (%s, %s, %s)
-            """, (chat_session_id, session['user_id'], message_text))
-            connection.commit()
+    try:
+        # Own rate and concurrency budget, so feed and login bursts can't
+        # hold chat up
+        message_limiter.hit(sender_id)
+        with admission['chat'].admit():
+            members = chat_members.members(chat_session_id)
+            if members is None or sender_id not in members:
+                return
             
-            # Get the saved message with user info
-            cursor.execute("""
-                SELECT m.*, u.username, u.profile_picture
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE m.id = LAST_INSERT_ID()
-            """)
-            message = cursor.fetchone()
-            
-            # Get the other user in the chat session
-            cursor.execute("""
-                SELECT 
-                    CASE 
-                        WHEN user1_id = %s THEN user2_id
-                        ELSE user1_id
-                    END as other_user_id
-                FROM chat_sessions 
-                WHERE id = %s
-            """, (session['user_id'], chat_session_id))
-            other_user = cursor.fetchone()
-            
-            # Update chat session timestamp
-            cursor.execute("UPDATE chat_sessions SET updated_at = NOW() WHERE id = %s", (chat_session_id,))
-            connection.commit()
-            
-            # Prepare message data for emitting
-            message_data = {
-                'id': message['id'],
-                'chat_session_id': message['chat_session_id'],
-                'sender_id': message['sender_id'],
-                'username': message['username'],
-                'profile_picture': message['profile_picture'],
-                'message_text': message['message_text'],
-                'created_at': message['created_at'].strftime('%Y-%m-%d %H:%M')
-            }
-            
-            # Send to sender
-            emit('new_message', message_data, room=request.sid)
+            with db.connection() as connection:
+                cursor = connection.cursor()
             
-            # Send to receiver if online
-            if other_user['other_user_id'] in online_users:
-                emit('new_message', message_data, room=online_users[other_user['other_user_id']])
+                # Save the message, update the session's last message, the
+                # recipient's unread counter and the sender's read mark, and
+                # commit, all in one round-trip. @now pins the same timestamp on
+                # the message and the session.
+                results = cursor.execute("""
+                    SET @now = NOW();
+                    INSERT INTO messages (chat_session_id, sender_id, message_text, created_at)
+                    VALUES (%s, %s, %s, @now);
+                    UPDATE chat_sessions
+                    SET last_message_id = LAST_INSERT_ID(), last_message_preview = %s, last_message_at = @now,
+                        user1_unread = user1_unread + (user1_id != %s),
+                        user2_unread = user2_unread + (user2_id != %s),
+                        user1_last_read_id = IF(user1_id = %s, LAST_INSERT_ID(), user1_last_read_id),
+                        user2_last_read_id = IF(user2_id = %s, LAST_INSERT_ID(), user2_last_read_id),
+                        updated_at = @now
+                    WHERE id = %s;
+                    SELECT LAST_INSERT_ID(), CAST(@now AS DATETIME);
+                    COMMIT
+                """, (chat_session_id, sender_id, message_text, message_text[:MESSAGE_PREVIEW_LENGTH],
+                      sender_id, sender_id, sender_id, sender_id, chat_session_id), multi=True)
             
-        except Error as e:
-            print(f"Error sending message: {e}")
-        finally:
-            cursor.close()
-            connection.close()
+                # Every statement only runs as its result is consumed
+                message_id = created_at = None
+                for result in results:
+                    if result.with_rows:
+                        message_id, created_at = result.fetchone()
+            # A Socket.IO event can't update the session cookie
+            db.pin(sender_id)
+        
+        # The sender's profile comes from their session, so nothing is read back
+        message_data = {
+            'id': message_id,
+            'chat_session_id': chat_session_id,
+            'sender_id': sender_id,
+            'username': session['username'],
+            'profile_picture': session.get('profile_picture'),
+            'message_text': message_text,
+            'created_at': created_at.strftime('%Y-%m-%d %H:%M')
+        }
+        
+        # Send to every tab of both participants; an offline user's room is
+        # simply empty
+        for user_id in set(members):
+            emit('new_message', message_data, room=user_room(user_id))
+        
+    except Overloaded as e:
+        emit('message_error', {'chat_session_id': chat_session_id, 'error': str(e), 'retry_after': e.retry_after})
+    except Error as e:
+        print(f"Error sending message: {e}")
 
 @app.route('/logout')
 def logout():
@@ -661,25 +1311,21 @@ def logout():
         user_id = session['user_id']
         
         # Update user offline status
-        connection = db.get_connection()
-        if connection:
-            try:
+        try:
+            with db.connection() as connection:
                 cursor = connection.cursor()
                 cursor.execute("UPDATE users SET is_online = FALSE, last_seen = NOW() WHERE id = %s", (user_id,))
                 connection.commit()
-            except Error as e:
-                print(f"Error updating logout status: {e}")
-            finally:
-                cursor.close()
-                connection.close()
+        except Error as e:
+            print(f"Error updating logout status: {e}")
     
     session.clear()
     flash('You have been logged out!', 'success')
     return redirect(url_for('login'))
 
 if __name__ == '__main__':
-    # Create all tables and upload folders
+    # Create all tables
     db.create_tables()
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['PROFILE_PICTURE_FOLDER'], exist_ok=True)
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    db.pool.warm()
+    start_background_jobs()
+    socketio.run(app, debug=True, host='0.0.0.0', port=Config.PORT)
\ No newline at end of file
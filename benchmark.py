@@ -0,0 +1,343 @@
+# Drives the app in-process with many concurrent simulated users, HTTP
+# routes through Flask test clients and chat through Socket.IO test
+# clients, and reports throughput, latency percentiles and queries per
+# request for each operation. Results are written as JSON so two commits
+# can be compared.
+#
+# Usage: python benchmark.py [--clients 50] [--duration 60] [--warmup 10]
+#                            [--mix feed=25,feed_page=20,...] [--seed 1]
+#                            [--output results.json] [--compare baseline.json]
+#
+# Load data with generate_data.py first and point .env at that database.
+# Everything runs on one event loop like a single worker, so numbers are
+# for one worker. Rate limits and admission control apply as configured:
+# answers they turn away are counted as 'limited' (429) and 'overloaded'
+# (503), not errors; raise LIKE_RATE and friends to measure raw capacity.
+# Background jobs other than the like buffer flush are not started, so
+# reconciliation passes and backfills don't run during a measurement.
+# First, so eventlet monkey patches before anything else loads
+import app as vibesphere
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from mysql.connector import Error
+from config import Config
+
+app, socketio, db, metrics = vibesphere.app, vibesphere.socketio, vibesphere.db, vibesphere.metrics
+
+DEFAULT_MIX = 'feed=25,feed_page=20,comments=15,like=10,profile=5,messages=10,send_message=15'
+# Operation -> the metrics scope that serves it, for queries per request
+SCOPES = {
+    'feed': ('route', 'feed'),
+    'feed_page': ('route', 'feed_page'),
+    'comments': ('route', 'post_comments'),
+    'like': ('route', 'like_post'),
+    'profile': ('route', 'profile'),
+    'messages': ('route', 'get_messages'),
+    'send_message': ('event', 'send_message'),
+    'login': ('route', 'login'),
+}
+PERCENTILES = (50, 95, 99)
+
+class SimulatedUser:
+    # One logged-in user with their own cookie jar and chat socket
+    def __init__(self, user_id, chat_sessions, max_post_id, rng):
+        self.user_id = user_id
+        self.chat_sessions = chat_sessions
+        self.max_post_id = max_post_id
+        self.rng = rng
+        self.feed_cursor = None
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = user_id
+            session['username'] = f"user{user_id}"
+            session['profile_picture'] = None
+        self.socket = socketio.test_client(app, flask_test_client=self.client)
+
+    def post_id(self):
+        return self.rng.randint(1, self.max_post_id)
+
+    def feed(self):
+        return self.client.get('/feed').status_code
+
+    def feed_page(self):
+        # Scroll: continue from the last page half the time
+        url = '/feed/page'
+        if self.feed_cursor and self.rng.random() < 0.5:
+            url += f"?cursor={self.feed_cursor}"
+        response = self.client.get(url)
+        if response.status_code == 200:
+            self.feed_cursor = response.get_json().get('next_cursor')
+        return response.status_code
+
+    def comments(self):
+        return self.client.get(f"/posts/{self.post_id()}/comments").status_code
+
+    def like(self):
+        return self.client.post(f"/like_post/{self.post_id()}").status_code
+
+    def profile(self):
+        return self.client.get('/profile').status_code
+
+    def messages(self):
+        if not self.chat_sessions:
+            return None
+        return self.client.get(f"/get_messages/{self.rng.choice(self.chat_sessions)}").status_code
+
+    def send_message(self):
+        if not self.chat_sessions:
+            return None
+        self.socket.get_received()
+        self.socket.emit('send_message', {'chat_session_id': self.rng.choice(self.chat_sessions),
+                                          'message_text': f"benchmark message {self.rng.random():.6f}"})
+        events = [packet['name'] for packet in self.socket.get_received()]
+        # The handler answers with new_message on success, message_error
+        # when rate limited or overloaded, and nothing on a database error
+        if 'new_message' in events:
+            return 200
+        return 429 if 'message_error' in events else 500
+
+    def login(self):
+        # A fresh client so this user's own session is left alone
+        response = app.test_client().post('/login', data={'username': f"user{self.user_id}",
+                                                          'password': 'benchmark-password'})
+        # Success redirects to the feed; a wrong password renders the form again
+        if response.status_code == 302:
+            return 200
+        return 401 if response.status_code == 200 else response.status_code
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCOPES:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}; choose from {', '.join(SCOPES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def load_users(count, rng):
+    # Users who take part in chats, so every operation has something to do
+    with db.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT MAX(id) FROM posts")
+        max_post_id = cursor.fetchone()[0] or 0
+        cursor.execute("SELECT MAX(id) FROM chat_sessions")
+        max_chat_id = cursor.fetchone()[0] or 0
+        cursor.execute("SELECT MAX(id) FROM users")
+        max_user_id = cursor.fetchone()[0] or 0
+        if not max_post_id or not max_user_id:
+            raise SystemExit('No posts or users; load data with generate_data.py first')
+
+        users = {}
+        for _ in range(count * 20):
+            if len(users) >= count:
+                break
+            if max_chat_id:
+                cursor.execute("SELECT user1_id, user2_id FROM chat_sessions WHERE id >= %s ORDER BY id LIMIT 1",
+                               (rng.randint(1, max_chat_id),))
+                row = cursor.fetchone()
+                user_id = rng.choice(row) if row else rng.randint(1, max_user_id)
+            else:
+                user_id = rng.randint(1, max_user_id)
+            if user_id in users:
+                continue
+            cursor.execute("""
+                SELECT id FROM chat_sessions WHERE user1_id = %s
+                UNION ALL
+                SELECT id FROM chat_sessions WHERE user2_id = %s
+                LIMIT 50
+            """, (user_id, user_id))
+            users[user_id] = [chat_id for (chat_id,) in cursor.fetchall()]
+    return users, max_post_id
+
+def dataset():
+    # Approximate row counts (InnoDB estimates; exact counts of large tables
+    # take minutes)
+    with db.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT table_name, table_rows FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name IN
+                ('users', 'posts', 'likes', 'comments', 'chat_sessions', 'messages')
+        """)
+        return {name: int(rows or 0) for name, rows in cursor.fetchall()}
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+def run(users, mix, args):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    # operation -> {'latencies': [...], status bucket -> count}
+    results = {name: {'latencies': [], 'ok': 0, 'limited': 0, 'overloaded': 0, 'errors': 0} for name in names}
+    state = {'measuring': False, 'stop': False}
+
+    def simulate(user):
+        while not state['stop']:
+            name = user.rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = getattr(user, name)()
+            except Exception as e:
+                print(f"Error in {name}: {e}")
+                status = 500
+            elapsed = time.perf_counter() - started
+            if status is not None and state['measuring']:
+                result = results[name]
+                if status < 400 or status == 404:
+                    # 404: a random post or chat that was deleted or never existed
+                    result['ok'] += 1
+                    result['latencies'].append(elapsed)
+                elif status == 429:
+                    result['limited'] += 1
+                elif status == 503:
+                    result['overloaded'] += 1
+                else:
+                    result['errors'] += 1
+            if args.think:
+                socketio.sleep(user.rng.expovariate(1 / args.think))
+            else:
+                socketio.sleep(0)
+
+    threads = [socketio.start_background_task(simulate, user) for user in users]
+    print(f"Warming up for {args.warmup}s with {len(users)} clients")
+    socketio.sleep(args.warmup)
+    before = metrics.summary()
+    state['measuring'] = True
+    started = time.monotonic()
+    print(f"Measuring for {args.duration}s")
+    socketio.sleep(args.duration)
+    state['measuring'] = False
+    elapsed = time.monotonic() - started
+    after = metrics.summary()
+    state['stop'] = True
+    for thread in threads:
+        thread.join()
+
+    operations = {}
+    for name, result in results.items():
+        latencies = sorted(result.pop('latencies'))
+        done = after.get(SCOPES[name], {'count': 0, 'queries': 0, 'db_seconds': 0.0})
+        start = before.get(SCOPES[name], {'count': 0, 'queries': 0, 'db_seconds': 0.0})
+        scopes = done['count'] - start['count']
+        operations[name] = dict(
+            result,
+            throughput=round(result['ok'] / elapsed, 2),
+            **{f"p{p}_ms": round(percentile(latencies, p) * 1000, 2) if latencies else None for p in PERCENTILES},
+            max_ms=round(latencies[-1] * 1000, 2) if latencies else None,
+            queries_per_request=round((done['queries'] - start['queries']) / scopes, 2) if scopes else None,
+            db_ms_per_request=round(1000 * (done['db_seconds'] - start['db_seconds']) / scopes, 2) if scopes else None,
+        )
+    total = sum(operation['ok'] for operation in operations.values())
+    return operations, {'requests': total, 'throughput': round(total / elapsed, 2), 'seconds': round(elapsed, 1)}
+
+def settings():
+    # Config in effect, minus credentials
+    return {name: sorted(value) if isinstance(value, set) else value
+            for name, value in vars(Config).items()
+            if name.isupper() and not any(secret in name for secret in ('PASSWORD', 'SECRET', 'TOKEN'))}
+
+def print_report(report, baseline=None):
+    print(f"{'operation':<14}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+          f"{'limited':>9}{'503':>6}{'errors':>8}")
+    for name, operation in report['operations'].items():
+        line = (f"{name:<14}{operation['throughput']:>9}{_cell(operation['p50_ms'])}{_cell(operation['p95_ms'])}"
+                f"{_cell(operation['p99_ms'])}{_cell(operation['queries_per_request'])}"
+                f"{operation['limited']:>9}{operation['overloaded']:>6}{operation['errors']:>8}")
+        old = (baseline or {}).get('operations', {}).get(name)
+        if old:
+            line += (f"   vs baseline: req/s {_change(old['throughput'], operation['throughput'])}"
+                     f", p95 {_change(old['p95_ms'], operation['p95_ms'])}"
+                     f", queries {_change(old['queries_per_request'], operation['queries_per_request'])}")
+        print(line)
+    print(f"total: {report['total']['requests']} requests, {report['total']['throughput']} req/s")
+
+def _cell(value):
+    return f"{'-' if value is None else value:>9}"
+
+def _change(old, new):
+    if old is None or new is None:
+        return '-'
+    if not old:
+        return 'same' if not new else 'new'
+    return f"{100 * (new - old) / old:+.1f}%"
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the app against a database loaded by generate_data.py')
+    parser.add_argument('--clients', type=int, default=50, help='simulated users running at once')
+    parser.add_argument('--duration', type=float, default=60, help='seconds measured')
+    parser.add_argument('--warmup', type=float, default=10, help='seconds run before measuring, to fill caches and pools')
+    parser.add_argument('--think', type=float, default=0, help='mean seconds a user waits between operations')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"operation=weight,... ({DEFAULT_MIX})")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON results file (default benchmarks/<commit>-<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    rng = random.Random(args.seed)
+    try:
+        db.migrate()
+        db.pool.warm()
+        users, max_post_id = load_users(args.clients, rng)
+        rows = dataset()
+    except Error as e:
+        print(f"Error preparing benchmark: {e}")
+        return 1
+    if vibesphere.like_buffer:
+        socketio.start_background_task(vibesphere.flush_like_buffer_forever)
+    simulated = [SimulatedUser(user_id, chat_sessions, max_post_id, random.Random(rng.random()))
+                 for user_id, chat_sessions in users.items()]
+
+    started_at = datetime.now()
+    operations, total = run(simulated, args.mix, args)
+    for user in simulated:
+        user.socket.disconnect()
+
+    commit, dirty = git_revision()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'seed': args.seed,
+        'clients': len(simulated),
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'think': args.think,
+        'mix': args.mix,
+        'dataset': rows,
+        'config': settings(),
+        'operations': operations,
+        'total': total,
+    }
+    output = args.output or os.path.join(
+        'benchmarks', f"{(commit or 'unknown')[:10]}-{started_at.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print_report(report, baseline)
+    print(f"Results written to {output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+from collections import OrderedDict
+import threading
+
+class ChatMembershipCache:
+    # chat_session_id -> (user1_id, user2_id). The participants of a session
+    # never change, so entries can't go stale and only need an LRU bound.
+    # Misses are not cached since another worker may create the session.
+    def __init__(self, db, max_size=10000):
+        self.db = db
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._members = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def members(self, chat_session_id):
+        # Returns (user1_id, user2_id), or None if the session doesn't exist.
+        # Raises mysql.connector.Error if the lookup fails.
+        with self._lock:
+            members = self._members.get(chat_session_id)
+            if members is not None:
+                self._members.move_to_end(chat_session_id)
+                self._hits += 1
+                return members
+            self._misses += 1
+
+        with self.db.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT user1_id, user2_id FROM chat_sessions WHERE id = %s", (chat_session_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        self.remember(chat_session_id, row[0], row[1])
+        return (row[0], row[1])
+
+    def remember(self, chat_session_id, user1_id, user2_id):
+        with self._lock:
+            self._members[chat_session_id] = (user1_id, user2_id)
+            self._members.move_to_end(chat_session_id)
+            while len(self._members) > self.max_size:
+                self._members.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._members),
+                'hits': self._hits,
+                'misses': self._misses,
+            }
@@ -0,0 +1,81 @@
+# Runs EXPLAIN on the hot read queries and exits non-zero if any of them
+# needs a full table scan. The statements come from queries.py, the same
+# ones app.py and the caches run.
+#
+# Usage: python check_query_plans.py
+#
+# Run it against a database with realistic data and all migrations applied
+# (see generate_data.py); on near-empty tables MySQL will often pick a scan
+# no matter which indexes exist.
+import sys
+from datetime import datetime
+from mysql.connector import Error
+from config import Config
+from database import Database
+from user_cache import UserProfileCache
+import queries
+
+SAMPLE_USER_ID = 1
+SAMPLE_POST_ID = 1
+SAMPLE_CHAT_SESSION_ID = 1
+SAMPLE_CURSOR = (datetime.now(), 1000000)
+SAMPLE_POST_IDS = (SAMPLE_POST_ID, 2, 3)
+PAGE = 21
+
+HOT_QUERIES = [
+    ('login: by username', queries.LOGIN_BY['username'], ('someone',)),
+    ('login: by email', queries.LOGIN_BY['email'], ('someone@example.com',)),
+    ('feed: first page', queries.feed_page(None), (PAGE,)),
+    ('feed: next page', queries.feed_page(SAMPLE_CURSOR),
+     (SAMPLE_CURSOR[0], SAMPLE_CURSOR[0], SAMPLE_CURSOR[1], PAGE)),
+    ('feed: load viewer likes', queries.LIKED_POSTS, (SAMPLE_USER_ID, 50001)),
+    ('feed: viewer likes (heavy likers)', queries.liked_among(len(SAMPLE_POST_IDS)),
+     (SAMPLE_USER_ID, *SAMPLE_POST_IDS)),
+    ('feed: comment previews', queries.comment_previews(len(SAMPLE_POST_IDS)),
+     tuple(value for post_id in SAMPLE_POST_IDS for value in (post_id, Config.FEED_COMMENT_PREVIEW))),
+    ('post comments: first page', queries.comments_page(None), (SAMPLE_POST_ID, PAGE)),
+    ('post comments: next page', queries.comments_page(SAMPLE_CURSOR),
+     (SAMPLE_POST_ID, SAMPLE_CURSOR[0], SAMPLE_CURSOR[0], SAMPLE_CURSOR[1], PAGE)),
+    ('profile: posts', queries.PROFILE_POSTS, (SAMPLE_USER_ID,)),
+    ('profile: user', queries.PROFILE_USER, (SAMPLE_USER_ID,)),
+    ('chat: users', queries.CHAT_USERS, (SAMPLE_USER_ID, Config.CHAT_USER_LIST_LIMIT)),
+    ('chat: sessions', queries.CHAT_SESSIONS, (SAMPLE_USER_ID, SAMPLE_USER_ID, SAMPLE_USER_ID)),
+    ('get_messages: access check', queries.CHAT_SESSION_FOR_USER,
+     (SAMPLE_CHAT_SESSION_ID, SAMPLE_USER_ID, SAMPLE_USER_ID)),
+    ('get_messages: newest page', queries.messages_page(None),
+     (SAMPLE_CHAT_SESSION_ID, Config.MESSAGES_PAGE_SIZE + 1)),
+    ('get_messages: older page', queries.messages_page(1000000),
+     (SAMPLE_CHAT_SESSION_ID, 1000000, Config.MESSAGES_PAGE_SIZE + 1)),
+    ('user cache: load', queries.user_profiles(UserProfileCache.FIELDS, 3), (SAMPLE_USER_ID, 2, 3)),
+    ('start_chat: lookup', queries.CHAT_BETWEEN, (SAMPLE_USER_ID, 2, 2, SAMPLE_USER_ID)),
+]
+
+def full_scans(plan):
+    # type ALL is a full table scan. A full index scan ("index") is allowed
+    # since the paginated queries walk an index and stop at their LIMIT.
+    return [row for row in plan if row.get('type') == 'ALL']
+
+def main():
+    db = Database()
+    failures = 0
+    for name, query, params in HOT_QUERIES:
+        try:
+            plan = db.explain(query, params)
+        except Error as e:
+            print(f"ERROR {name}: {e}")
+            failures += 1
+            continue
+
+        scans = full_scans(plan)
+        if scans:
+            failures += 1
+            tables = ", ".join(str(row.get('table')) for row in scans)
+            print(f"FAIL  {name}: full scan on {tables}")
+        else:
+            print(f"ok    {name}")
+
+    db.pool.close_all()
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,5 +11,123 @@ class Config:
     DB_NAME = os.getenv('DB_NAME', 'auth_database')
     DB_PORT = os.getenv('DB_PORT', '3306')
     
+    # Connection pool
+    DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '15'))  # see the admission rule below
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))  # seconds to wait for a free connection
+    DB_POOL_MAX_LIFETIME = int(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))  # recycle connections older than this
+    DB_POOL_PING_INTERVAL = int(os.getenv('DB_POOL_PING_INTERVAL', '30'))  # ping on checkout if idle this long
+    
+    # Read replicas (optional): comma-separated host[:port], same credentials
+    DB_REPLICA_HOSTS = os.getenv('DB_REPLICA_HOSTS', '')
+    DB_REPLICA_POOL_MAX_SIZE = int(os.getenv('DB_REPLICA_POOL_MAX_SIZE', '10'))  # per replica
+    DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '2'))  # seconds; replicas further behind are skipped
+    DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', '5'))  # seconds between lag checks
+    DB_REPLICA_EJECT_TIME = float(os.getenv('DB_REPLICA_EJECT_TIME', '30'))  # seconds an unreachable replica is skipped
+    # Seconds a user reads from the primary after writing. The mark rides in
+    # the session cookie, so it holds on any worker; after a chat message
+    # (sent over Socket.IO) it is kept per worker, which relies on the sticky
+    # routing Socket.IO already needs.
+    DB_READ_YOUR_WRITES_WINDOW = float(os.getenv('DB_READ_YOUR_WRITES_WINDOW', '5'))
+    
     # Flask Configuration
-    SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
\ No newline at end of file
+    SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
+    
+    # Password hashing (runs on native threads, see password_hasher.py)
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')  # werkzeug method with work factor; older hashes are upgraded at login
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '4'))  # hashes computed at once; keep below EVENTLET_THREADPOOL_SIZE (default 20)
+    
+    # Feed
+    FEED_PAGE_SIZE = int(os.getenv('FEED_PAGE_SIZE', '20'))
+    FEED_MAX_PAGE_SIZE = int(os.getenv('FEED_MAX_PAGE_SIZE', '50'))
+    FEED_COMMENT_PREVIEW = int(os.getenv('FEED_COMMENT_PREVIEW', '3'))  # latest comments shown per post
+    FEED_CACHE_SIZE = int(os.getenv('FEED_CACHE_SIZE', '200'))  # cached feed pages per worker
+    FEED_CACHE_TTL = float(os.getenv('FEED_CACHE_TTL', '30'))  # seconds; bounds staleness on workers without a message bus
+    LIKED_INDEX_MAX_ENTRIES = int(os.getenv('LIKED_INDEX_MAX_ENTRIES', '2000000'))  # liked post ids held in memory across all viewers (4 bytes each)
+    LIKED_INDEX_MAX_PER_USER = int(os.getenv('LIKED_INDEX_MAX_PER_USER', '50000'))  # viewers with more likes are queried instead
+    LIKED_INDEX_IDLE_TIMEOUT = float(os.getenv('LIKED_INDEX_IDLE_TIMEOUT', '900'))  # drop viewers inactive this long
+    LIKED_INDEX_TTL = float(os.getenv('LIKED_INDEX_TTL', '300'))  # seconds; reload viewers this often, bounding staleness on workers without a message bus
+    COMMENTS_PAGE_SIZE = int(os.getenv('COMMENTS_PAGE_SIZE', '20'))
+    COMMENTS_MAX_PAGE_SIZE = int(os.getenv('COMMENTS_MAX_PAGE_SIZE', '100'))
+    
+    # Like/comment counter reconciliation (interval 0 disables the job)
+    COUNTER_RECONCILE_INTERVAL = int(os.getenv('COUNTER_RECONCILE_INTERVAL', '3600'))  # seconds between full passes
+    COUNTER_RECONCILE_BATCH = int(os.getenv('COUNTER_RECONCILE_BATCH', '500'))  # posts per transaction
+    COUNTER_RECONCILE_PAUSE = float(os.getenv('COUNTER_RECONCILE_PAUSE', '0.5'))  # seconds between batches
+    
+    # Write-behind like buffer (off by default)
+    LIKE_BUFFER_ENABLED = os.getenv('LIKE_BUFFER_ENABLED', 'false').lower() == 'true'
+    LIKE_BUFFER_FLUSH_INTERVAL = float(os.getenv('LIKE_BUFFER_FLUSH_INTERVAL', '1.0'))  # seconds; bounds what a crash can lose
+    LIKE_BUFFER_MAX_PENDING = int(os.getenv('LIKE_BUFFER_MAX_PENDING', '500'))  # flush early once this many pairs are pending
+    
+    # Chat
+    CHAT_USER_LIST_LIMIT = int(os.getenv('CHAT_USER_LIST_LIMIT', '100'))
+    MESSAGES_PAGE_SIZE = int(os.getenv('MESSAGES_PAGE_SIZE', '50'))
+    MESSAGES_MAX_PAGE_SIZE = int(os.getenv('MESSAGES_MAX_PAGE_SIZE', '200'))
+    CHAT_MEMBERSHIP_CACHE_SIZE = int(os.getenv('CHAT_MEMBERSHIP_CACHE_SIZE', '10000'))  # chat sessions whose participants are kept in memory
+    
+    # User profile cache
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))  # seconds; bounds staleness on workers without a message bus
+    
+    # Presence
+    PRESENCE_GRACE_PERIOD = float(os.getenv('PRESENCE_GRACE_PERIOD', '5'))  # seconds before a disconnected user counts as offline
+    PRESENCE_HEARTBEAT_TIMEOUT = float(os.getenv('PRESENCE_HEARTBEAT_TIMEOUT', '90'))  # drop sids silent for this long
+    PRESENCE_FLUSH_INTERVAL = float(os.getenv('PRESENCE_FLUSH_INTERVAL', '2'))  # seconds between batched is_online writes
+    PRESENCE_SNAPSHOT_INTERVAL = float(os.getenv('PRESENCE_SNAPSHOT_INTERVAL', '10'))  # seconds between full presence snapshots on the bus
+    
+    # Multiple workers
+    MESSAGE_BUS_URL = os.getenv('MESSAGE_BUS_URL', '')  # '', memory://, unix:///path/to/dir or redis://host:6379/0
+    PORT = int(os.getenv('PORT', '5000'))
+    
+    # Admission control: requests of each route class run at once (LIMIT)
+    # and may wait for a slot (QUEUE); the rest get 503 with Retry-After.
+    # Rule: HEAVY_READ + AUTH + WRITE + CHAT limits (uploads use no
+    # connection) plus the background jobs on the primary pool (IMAGE_WORKERS,
+    # the presence flush, and the like buffer flush and counter reconcile
+    # when enabled) must stay below DB_POOL_MAX_SIZE. Then everything that
+    # can hold a connection at once fits in the pool with one to spare, and
+    # chat always finds one. Raise the pool with the limits; app.py warns at
+    # startup when the rule is broken.
+    ADMISSION_HEAVY_READ_LIMIT = int(os.getenv('ADMISSION_HEAVY_READ_LIMIT', '3'))  # feed, profile, chat pages, comment pages
+    ADMISSION_HEAVY_READ_QUEUE = int(os.getenv('ADMISSION_HEAVY_READ_QUEUE', '50'))
+    ADMISSION_AUTH_LIMIT = int(os.getenv('ADMISSION_AUTH_LIMIT', '2'))  # login, signup, logout
+    ADMISSION_AUTH_QUEUE = int(os.getenv('ADMISSION_AUTH_QUEUE', '20'))
+    ADMISSION_WRITE_LIMIT = int(os.getenv('ADMISSION_WRITE_LIMIT', '2'))  # likes, comments, posts, profile edits
+    ADMISSION_WRITE_QUEUE = int(os.getenv('ADMISSION_WRITE_QUEUE', '50'))
+    ADMISSION_UPLOAD_LIMIT = int(os.getenv('ADMISSION_UPLOAD_LIMIT', '16'))  # resumable upload requests; no DB connection
+    ADMISSION_UPLOAD_QUEUE = int(os.getenv('ADMISSION_UPLOAD_QUEUE', '16'))
+    ADMISSION_CHAT_LIMIT = int(os.getenv('ADMISSION_CHAT_LIMIT', '2'))  # chat messages being saved
+    ADMISSION_CHAT_QUEUE = int(os.getenv('ADMISSION_CHAT_QUEUE', '200'))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '2'))  # seconds a request may wait for a slot
+    ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '2'))  # seconds, sent in Retry-After
+    
+    # Per-user rate limits: actions a second sustained, and burst
+    LIKE_RATE = float(os.getenv('LIKE_RATE', '2'))
+    LIKE_BURST = int(os.getenv('LIKE_BURST', '20'))
+    COMMENT_RATE = float(os.getenv('COMMENT_RATE', '0.2'))
+    COMMENT_BURST = int(os.getenv('COMMENT_BURST', '5'))
+    MESSAGE_RATE = float(os.getenv('MESSAGE_RATE', '1'))
+    MESSAGE_BURST = int(os.getenv('MESSAGE_BURST', '15'))
+    
+    # Metrics
+    SLOW_QUERY_TIME = float(os.getenv('SLOW_QUERY_TIME', '0.2'))  # seconds; slower statements are logged
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # bearer token required on /metrics; unset answers 404
+    HUB_MONITOR_ENABLED = os.getenv('HUB_MONITOR_ENABLED', 'true').lower() == 'true'  # watch the event loop for lag and blocking
+    HUB_BLOCK_THRESHOLD = float(os.getenv('HUB_BLOCK_THRESHOLD', '0.1'))  # seconds a green thread may run without yielding
+    HUB_LAG_INTERVAL = float(os.getenv('HUB_LAG_INTERVAL', '0.5'))  # seconds between loop lag samples
+    
+    # On-demand profiling (switched on per worker through /admin/profiler)
+    ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()}  # users allowed to use /admin routes
+    PROFILER_DIR = os.getenv('PROFILER_DIR', 'profiles')  # where collapsed-stack profiles are written
+    PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.01'))  # seconds between samples
+    PROFILER_MAX_DURATION = int(os.getenv('PROFILER_MAX_DURATION', '300'))  # longest window an admin may ask for
+    
+    # Uploads
+    IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))  # uploads resized at the same time
+    MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '')  # e.g. /_media/ to let nginx send uploads via X-Accel-Redirect
+    MEDIA_X_SENDFILE = os.getenv('MEDIA_X_SENDFILE', 'false').lower() == 'true'  # send uploads via X-Sendfile (Apache, lighttpd)
+    UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))  # bytes per resumable upload PUT, below MAX_CONTENT_LENGTH
+    UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', str(512 * 1024 * 1024)))  # largest file a resumable upload accepts
+    UPLOAD_SESSION_MAX_AGE = int(os.getenv('UPLOAD_SESSION_MAX_AGE', '86400'))  # seconds an unfinished upload is kept
+    UPLOAD_WORK_DIR = os.getenv('UPLOAD_WORK_DIR', 'upload_work')  # temp files and unfinished uploads; must be on the same filesystem as static/
@@ -1,184 +1,805 @@
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, errorcode
 from config import Config
+from contextlib import contextmanager
+import collections
+import threading
+import time
 import os
 
+class PoolTimeout(Error):
+    pass
+
+class _PoolEntry:
+    __slots__ = ('raw', 'created_at', 'last_used')
+
+    def __init__(self, raw):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+
+class TimedCursor:
+    # Cursor proxy that reports each statement to on_query(sql, seconds,
+    # rows) once it is finished: at the next execute or when the cursor
+    # closes. seconds covers execute() and the fetches of its rows, which
+    # is where the pure-Python driver waits on the network.
+    def __init__(self, cursor, on_query):
+        self._cursor = cursor
+        self._on_query = on_query
+        self._statement = None
+
+    def _finish(self):
+        if self._statement is not None:
+            statement, self._statement = self._statement, None
+            self._on_query(*statement)
+
+    def _timed(self, function, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if self._statement is not None:
+                self._statement[1] += time.perf_counter() - started
+
+    def execute(self, operation, params=None, multi=False):
+        self._finish()
+        self._statement = [operation, 0.0, 0]
+        if not multi:
+            return self._timed(self._cursor.execute, operation, params)
+        # Each statement of a multi-statement call runs as its result is
+        # consumed, so the generator is timed as it is walked
+        return self._multi(self._timed(self._cursor.execute, operation, params, multi=True))
+
+    def _multi(self, results):
+        while True:
+            try:
+                result = self._timed(next, results)
+            except StopIteration:
+                return
+            yield _TimedResult(self, result)
+
+    def executemany(self, operation, seq_params):
+        self._finish()
+        self._statement = [operation, 0.0, 0]
+        return self._timed(self._cursor.executemany, operation, seq_params)
+
+    def fetchone(self):
+        return self._fetchone(self._cursor)
+
+    def _fetchone(self, cursor):
+        row = self._timed(cursor.fetchone)
+        if row is not None and self._statement is not None:
+            self._statement[2] += 1
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._timed(self._cursor.fetchmany, size)
+        if self._statement is not None:
+            self._statement[2] += len(rows)
+        return rows
+
+    def fetchall(self):
+        return self._fetchall(self._cursor)
+
+    def _fetchall(self, cursor):
+        rows = self._timed(cursor.fetchall)
+        if self._statement is not None:
+            self._statement[2] += len(rows)
+        return rows
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class _TimedResult:
+    # One result of a multi-statement execute; its rows count towards the
+    # statement of the TimedCursor that ran it
+    def __init__(self, timed_cursor, result):
+        self._timed_cursor = timed_cursor
+        self._result = result
+
+    def fetchone(self):
+        return self._timed_cursor._fetchone(self._result)
+
+    def fetchall(self):
+        return self._timed_cursor._fetchall(self._result)
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+class PooledConnection:
+    # Thin proxy around a checked-out connection. close() hands the
+    # connection back to the pool instead of tearing down the socket, so
+    # existing callers keep working unchanged.
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+        self._cursors = []
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._entry.raw.cursor(*args, **kwargs)
+        if self._pool.on_query is not None:
+            cursor = TimedCursor(cursor, self._pool.on_query)
+        self._cursors.append(cursor)
+        return cursor
+
+    def close(self):
+        if self._entry is not None:
+            entry, self._entry = self._entry, None
+            self._pool.release(entry, self._cursors)
+            self._cursors = []
+
+    def __getattr__(self, name):
+        entry = self.__dict__.get('_entry')
+        if entry is None:
+            raise AttributeError(f"Connection already returned to pool: {name}")
+        return getattr(entry.raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+class ConnectionPool:
+    # Bounded pool of MySQL connections. It only uses threading/socket
+    # primitives looked up at call time, so once eventlet.monkey_patch() has
+    # run the waits below yield to the hub instead of blocking it.
+    def __init__(self, config, min_size=1, max_size=10, timeout=5.0,
+                 max_lifetime=1800, ping_interval=30, on_query=None):
+        self.config = config
+        # Called with (sql, seconds, rows) after every statement, if set
+        self.on_query = on_query
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._condition = threading.Condition()
+        # LIFO so the most recently used (warm) connection is reused first
+        self._idle = collections.deque()
+        self._size = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._created = 0
+        self._recycled = 0
+        self._health_check_failures = 0
+        self._timeouts = 0
+
+    def _connect(self):
+        entry = _PoolEntry(mysql.connector.connect(**self.config))
+        with self._condition:
+            self._created += 1
+        return entry
+
+    def _close_raw(self, entry):
+        try:
+            entry.raw.close()
+        except Error:
+            pass
+
+    def _expired(self, entry, now):
+        return self.max_lifetime and now - entry.created_at > self.max_lifetime
+
+    def _is_healthy(self, entry):
+        now = time.monotonic()
+        if self._expired(entry, now):
+            with self._condition:
+                self._recycled += 1
+            return False
+        # Only ping connections that sat idle long enough for RDS or a NAT
+        # to have dropped them; hot connections skip the extra round-trip.
+        if now - entry.last_used >= self.ping_interval:
+            try:
+                entry.raw.ping(reconnect=False)
+            except Error:
+                with self._condition:
+                    self._health_check_failures += 1
+                return False
+        return True
+
+    def _forget(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def acquire(self):
+        start = time.monotonic()
+        waited = False
+        with self._condition:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve the slot now, connect outside the lock
+                    self._size += 1
+                    entry = None
+                    break
+                if not waited:
+                    waited = True
+                    self._waits += 1
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    self._wait_time += time.monotonic() - start
+                    raise PoolTimeout(msg=f"Timed out after {self.timeout}s waiting for a database connection")
+                self._condition.wait(remaining)
+            self._checkouts += 1
+            if waited:
+                self._wait_time += time.monotonic() - start
+
+        try:
+            if entry is None:
+                entry = self._connect()
+            elif not self._is_healthy(entry):
+                self._close_raw(entry)
+                entry = self._connect()
+        except Error:
+            self._forget()
+            raise
+
+        return PooledConnection(self, entry)
+
+    def release(self, entry, cursors=()):
+        for cursor in cursors:
+            try:
+                cursor.close()
+            except Error:
+                pass
+
+        try:
+            # Never hand out a connection with an open transaction; under
+            # REPEATABLE READ it would also pin a stale snapshot.
+            if entry.raw.in_transaction:
+                entry.raw.rollback()
+        except Error:
+            self._close_raw(entry)
+            self._forget()
+            return
+
+        now = time.monotonic()
+        if self._expired(entry, now):
+            self._close_raw(entry)
+            with self._condition:
+                self._recycled += 1
+            self._forget()
+            return
+
+        entry.last_used = now
+        with self._condition:
+            self._idle.append(entry)
+            self._condition.notify()
+
+    def warm(self):
+        # Open connections up to min_size so the first requests after a
+        # deploy don't pay for the handshake.
+        connections = []
+        try:
+            while len(connections) < self.min_size:
+                connections.append(self.acquire())
+        except Error as e:
+            print(f"Error warming connection pool: {e}")
+        finally:
+            for connection in connections:
+                connection.close()
+
+    def close_all(self):
+        with self._condition:
+            idle, self._idle = list(self._idle), collections.deque()
+            self._size -= len(idle)
+        for entry in idle:
+            self._close_raw(entry)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max_size': self.max_size,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time': self._wait_time,
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'recycled': self._recycled,
+                'health_check_failures': self._health_check_failures,
+            }
+
+class _Replica:
+    __slots__ = ('name', 'pool', 'ejected_until', 'reason', 'lag')
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.ejected_until = 0.0
+        self.reason = None
+        self.lag = None
+
+# Errors meaning the server itself is gone, not that the query was wrong
+CONNECTION_LOST_ERRORS = (errorcode.CR_SERVER_GONE_ERROR, errorcode.CR_SERVER_LOST,
+                          errorcode.CR_SERVER_LOST_EXTENDED, errorcode.CR_CONN_HOST_ERROR,
+                          errorcode.CR_CONNECTION_ERROR)
+
+def _replica_endpoints(value, default_port):
+    # 'host1,host2:3307' -> [('host1', default_port), ('host2', '3307')]
+    endpoints = []
+    for item in value.split(','):
+        item = item.strip()
+        if item:
+            host, _, port = item.partition(':')
+            endpoints.append((host, port or default_port))
+    return endpoints
+
+def _column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+def _index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+def _add_index(cursor, table, index, columns):
+    if not _index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {index} ({columns})")
+
+def _add_post_counters(cursor):
+    # Tables created before the counters existed get the columns added
+    # and backfilled once
+    if _column_exists(cursor, 'posts', 'like_count'):
+        return
+    cursor.execute("""
+        ALTER TABLE posts
+        ADD COLUMN like_count INT NOT NULL DEFAULT 0,
+        ADD COLUMN comment_count INT NOT NULL DEFAULT 0
+    """)
+    cursor.execute("""
+        UPDATE posts p
+        SET p.like_count = (SELECT COUNT(*) FROM likes l WHERE l.post_id = p.id),
+            p.comment_count = (SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id)
+    """)
+
+def _add_hot_query_indexes(cursor):
+    # Composite indexes matching the ORDER BY of the feed, profile, comment
+    # and chat queries so they read in index order instead of filesorting
+    _add_index(cursor, 'posts', 'idx_posts_created_at', 'created_at, id')
+    _add_index(cursor, 'posts', 'idx_posts_user_created_at', 'user_id, created_at, id')
+    _add_index(cursor, 'comments', 'idx_comments_post_created_at', 'post_id, created_at, id')
+    _add_index(cursor, 'messages', 'idx_messages_session_created_at', 'chat_session_id, created_at, id')
+    _add_index(cursor, 'chat_sessions', 'idx_chat_sessions_updated_at', 'updated_at')
+
+def _add_chat_session_summary(cursor):
+    # Last message and per-participant unread counters on the session row,
+    # backfilled from the existing messages
+    if _column_exists(cursor, 'chat_sessions', 'last_message_id'):
+        return
+    cursor.execute("""
+        ALTER TABLE chat_sessions
+        ADD COLUMN last_message_id INT NULL DEFAULT NULL,
+        ADD COLUMN last_message_preview VARCHAR(255) NULL DEFAULT NULL,
+        ADD COLUMN last_message_at TIMESTAMP NULL DEFAULT NULL,
+        ADD COLUMN user1_unread INT NOT NULL DEFAULT 0,
+        ADD COLUMN user2_unread INT NOT NULL DEFAULT 0
+    """)
+    # updated_at = updated_at stops ON UPDATE CURRENT_TIMESTAMP from firing
+    cursor.execute("""
+        UPDATE chat_sessions cs
+        JOIN (
+            SELECT chat_session_id, MAX(id) AS last_id FROM messages GROUP BY chat_session_id
+        ) last ON last.chat_session_id = cs.id
+        JOIN messages m ON m.id = last.last_id
+        SET cs.last_message_id = m.id,
+            cs.last_message_preview = LEFT(m.message_text, 255),
+            cs.last_message_at = m.created_at,
+            cs.updated_at = cs.updated_at
+    """)
+    cursor.execute("""
+        UPDATE chat_sessions cs
+        SET cs.user1_unread = (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.chat_session_id = cs.id AND m.sender_id != cs.user1_id AND m.is_read = FALSE),
+            cs.user2_unread = (
+                SELECT COUNT(*) FROM messages m
+                WHERE m.chat_session_id = cs.id AND m.sender_id != cs.user2_id AND m.is_read = FALSE),
+            cs.updated_at = cs.updated_at
+    """)
+
+def _add_chat_read_marks(cursor):
+    # Per-participant high-water mark replacing messages.is_read. The old
+    # column is left in place (no longer written) so a rollback still works.
+    if _column_exists(cursor, 'chat_sessions', 'user1_last_read_id'):
+        return
+    cursor.execute("""
+        ALTER TABLE chat_sessions
+        ADD COLUMN user1_last_read_id INT NULL DEFAULT NULL,
+        ADD COLUMN user2_last_read_id INT NULL DEFAULT NULL
+    """)
+    # A participant has read up to the newest message the other side sent
+    # that is flagged read, or their own latest message, whichever is later
+    cursor.execute("""
+        UPDATE chat_sessions cs
+        SET cs.user1_last_read_id = (
+                SELECT MAX(m.id) FROM messages m
+                WHERE m.chat_session_id = cs.id AND (m.sender_id = cs.user1_id OR m.is_read = TRUE)),
+            cs.user2_last_read_id = (
+                SELECT MAX(m.id) FROM messages m
+                WHERE m.chat_session_id = cs.id AND (m.sender_id = cs.user2_id OR m.is_read = TRUE)),
+            cs.updated_at = cs.updated_at
+    """)
+
+def _add_image_variants(cursor):
+    # JSON maps of resized copies written by image_pipeline.py; NULL until
+    # the pipeline has processed the upload
+    if not _column_exists(cursor, 'posts', 'image_variants'):
+        cursor.execute("ALTER TABLE posts ADD COLUMN image_variants TEXT NULL")
+    if not _column_exists(cursor, 'users', 'profile_picture_variants'):
+        cursor.execute("ALTER TABLE users ADD COLUMN profile_picture_variants TEXT NULL")
+
+def _allow_video_only_posts(cursor):
+    # Video posts have no image_url; the original NOT NULL made every video
+    # insert fail
+    cursor.execute("ALTER TABLE posts MODIFY image_url VARCHAR(255) NULL DEFAULT NULL")
+
+# (version, description, list of SQL statements or a callable taking a cursor).
+# Append new steps to the end; never edit or renumber one that has shipped.
+MIGRATIONS = [
+    (1, 'create base tables', [
+        """
+            CREATE TABLE IF NOT EXISTS users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(50) UNIQUE NOT NULL,
+                email VARCHAR(100) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                profile_picture VARCHAR(255) DEFAULT NULL,
+                bio TEXT,
+                is_online BOOLEAN DEFAULT FALSE,
+                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS posts (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT NOT NULL,
+                image_url VARCHAR(255) NOT NULL,
+                video_url VARCHAR(255) DEFAULT NULL,
+                caption TEXT,
+                like_count INT NOT NULL DEFAULT 0,
+                comment_count INT NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS likes (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT NOT NULL,
+                post_id INT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE,
+                UNIQUE KEY unique_like (user_id, post_id)
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS comments (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT NOT NULL,
+                post_id INT NOT NULL,
+                comment_text TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user1_id INT NOT NULL,
+                user2_id INT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                FOREIGN KEY (user1_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (user2_id) REFERENCES users(id) ON DELETE CASCADE,
+                UNIQUE KEY unique_chat_session (user1_id, user2_id)
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                chat_session_id INT NOT NULL,
+                sender_id INT NOT NULL,
+                message_text TEXT NOT NULL,
+                is_read BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (chat_session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE,
+                FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """,
+    ]),
+    (2, 'add like/comment counters to posts', _add_post_counters),
+    (3, 'add indexes for hot queries', _add_hot_query_indexes),
+    (4, 'add last message and unread counters to chat_sessions', _add_chat_session_summary),
+    (5, 'add per-participant read marks to chat_sessions', _add_chat_read_marks),
+    (6, 'add resized image variants to posts and users', _add_image_variants),
+    (7, 'allow posts without an image', _allow_video_only_posts),
+]
+
 class Database:
-    def __init__(self):
+    # on_query(sql, seconds, rows) is called after every statement on any
+    # pool, e.g. Metrics.record_query
+    def __init__(self, on_query=None):
         self.config = {
             'host': Config.DB_HOST,
             'database': Config.DB_NAME,
             'user': Config.DB_USER,
             'password': Config.DB_PASSWORD,
-            'port': Config.DB_PORT
+            'port': Config.DB_PORT,
+            # The C extension blocks inside libmysqlclient where eventlet
+            # can't see it; the pure-Python driver goes through the patched
+            # socket module and yields while waiting on RDS.
+            'use_pure': True
         }
-    
-    def get_connection(self):
+        self.pool = ConnectionPool(
+            self.config,
+            min_size=Config.DB_POOL_MIN_SIZE,
+            max_size=Config.DB_POOL_MAX_SIZE,
+            timeout=Config.DB_POOL_TIMEOUT,
+            max_lifetime=Config.DB_POOL_MAX_LIFETIME,
+            ping_interval=Config.DB_POOL_PING_INTERVAL,
+            on_query=on_query
+        )
+        # Read replicas for read_connection(); none means everything goes to
+        # the primary
+        self.replicas = [
+            _Replica(f"{host}:{port}", ConnectionPool(
+                dict(self.config, host=host, port=port),
+                min_size=Config.DB_POOL_MIN_SIZE,
+                max_size=Config.DB_REPLICA_POOL_MAX_SIZE,
+                timeout=Config.DB_POOL_TIMEOUT,
+                max_lifetime=Config.DB_POOL_MAX_LIFETIME,
+                ping_interval=Config.DB_POOL_PING_INTERVAL,
+                on_query=on_query
+            ))
+            for host, port in _replica_endpoints(Config.DB_REPLICA_HOSTS, Config.DB_PORT)
+        ]
+        self._replica_lock = threading.Lock()
+        self._next_replica = 0
+        # user_id -> monotonic time until which their reads go to the primary
+        self._pinned = {}
+
+    @contextmanager
+    def connection(self):
+        # Usage: with db.connection() as connection: ...
+        # Cursors opened on the connection are closed, any uncommitted work
+        # is rolled back and the connection goes back to the pool on exit.
+        # Checkout failures raise mysql.connector.Error.
+        connection = self.pool.acquire()
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def read_connection(self, pinned=False):
+        # Like connection(), for read-only work: served by a healthy replica
+        # when there is one. pinned sends it to the primary instead, for a
+        # user who wrote in the last DB_READ_YOUR_WRITES_WINDOW seconds, so
+        # they always see their own post, like or message; the app keeps
+        # that mark in the session cookie, or through pin() for writes made
+        # over Socket.IO.
+        replica, connection = self._acquire_replica(pinned)
+        if connection is None:
+            with self.connection() as connection:
+                yield connection
+            return
         try:
-            connection = mysql.connector.connect(**self.config)
-            return connection
+            yield connection
         except Error as e:
-            print(f"Error connecting to MySQL: {e}")
-            return None
-    
-    def create_tables(self):
-        self.create_users_table()
-        self.create_posts_table()
-        self.create_likes_table()
-        self.create_comments_table()
-        self.create_messages_table()
-        self.create_chat_sessions_table()
-    
-    def create_users_table(self):
-        connection = self.get_connection()
-        if connection:
+            if e.errno in CONNECTION_LOST_ERRORS:
+                self._eject(replica, str(e), Config.DB_REPLICA_EJECT_TIME)
+            raise
+        finally:
+            connection.close()
+
+    def _acquire_replica(self, pinned):
+        if not self.replicas or pinned:
+            return None, None
+        now = time.monotonic()
+        with self._replica_lock:
+            self._next_replica += 1
+            start = self._next_replica
+        healthy = [replica for replica in self.replicas if replica.ejected_until <= now]
+        # Fewest connections in use first, taking turns between equals
+        healthy.sort(key=lambda replica: (replica.pool.stats()['in_use'],
+                                          (self.replicas.index(replica) - start) % len(self.replicas)))
+        for replica in healthy:
             try:
-                cursor = connection.cursor()
-                create_table_query = """
-                CREATE TABLE IF NOT EXISTS users (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(50) UNIQUE NOT NULL,
-                    email VARCHAR(100) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    profile_picture VARCHAR(255) DEFAULT NULL,
-                    bio TEXT,
-                    is_online BOOLEAN DEFAULT FALSE,
-                    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-                cursor.execute(create_table_query)
-                connection.commit()
-                print("Users table created successfully")
+                return replica, replica.pool.acquire()
+            except PoolTimeout:
+                # Busy, not broken
+                continue
             except Error as e:
-                print(f"Error creating users table: {e}")
-            finally:
-                cursor.close()
-                connection.close()
-    
-    def create_posts_table(self):
-        connection = self.get_connection()
-        if connection:
+                self._eject(replica, str(e), Config.DB_REPLICA_EJECT_TIME)
+        # Every replica is down or busy; the primary still answers
+        return None, None
+
+    def _eject(self, replica, reason, seconds):
+        if replica.ejected_until <= time.monotonic():
+            print(f"Taking read replica {replica.name} out of rotation for {seconds}s: {reason}")
+        replica.ejected_until = time.monotonic() + seconds
+        replica.reason = reason
+
+    def pin(self, user_id):
+        # Mark user_id as having just written, for is_pinned(). Per process:
+        # only for writes that can't set the session cookie (Socket.IO), whose
+        # connection sticky routing keeps on this worker anyway
+        now = time.monotonic()
+        with self._replica_lock:
+            self._pinned[user_id] = now + Config.DB_READ_YOUR_WRITES_WINDOW
+            if len(self._pinned) > 10000:
+                self._pinned = {key: until for key, until in self._pinned.items() if until > now}
+
+    def is_pinned(self, user_id):
+        with self._replica_lock:
+            until = self._pinned.get(user_id)
+        return until is not None and until > time.monotonic()
+
+    def check_replicas(self):
+        # Measure each replica's lag and take out the ones further behind
+        # than DB_REPLICA_MAX_LAG (or not replicating at all) until the next
+        # check; ones that answer and are current go back into rotation. A
+        # server that isn't a replica, or won't say, counts as current, so
+        # two standalone local servers work for testing.
+        for replica in self.replicas:
             try:
-                cursor = connection.cursor()
-                create_table_query = """
-                CREATE TABLE IF NOT EXISTS posts (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id INT NOT NULL,
-                    image_url VARCHAR(255) NOT NULL,
-                    video_url VARCHAR(255) DEFAULT NULL,
-                    caption TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-                """
-                cursor.execute(create_table_query)
-                connection.commit()
-                print("Posts table created successfully")
+                with replica.pool.acquire() as connection:
+                    cursor = connection.cursor(dictionary=True)
+                    try:
+                        cursor.execute("SHOW REPLICA STATUS")
+                    except Error as e:
+                        if e.errno != errorcode.ER_PARSE_ERROR:
+                            raise
+                        # Before MySQL 8.0.22
+                        cursor.execute("SHOW SLAVE STATUS")
+                    status = cursor.fetchone() or {'Seconds_Behind_Source': 0}
+                    replica.lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+                    stopped = replica.lag is None
             except Error as e:
-                print(f"Error creating posts table: {e}")
-            finally:
-                cursor.close()
-                connection.close()
+                replica.lag = None
+                # Without the REPLICATION CLIENT privilege only connection
+                # failures can be seen
+                if e.errno != errorcode.ER_SPECIFIC_ACCESS_DENIED_ERROR:
+                    self._eject(replica, str(e), Config.DB_REPLICA_EJECT_TIME)
+                    continue
+                stopped = False
+
+            if stopped:
+                self._eject(replica, 'replication is stopped', Config.DB_REPLICA_CHECK_INTERVAL)
+            elif replica.lag is not None and replica.lag > Config.DB_REPLICA_MAX_LAG:
+                self._eject(replica, f"{replica.lag}s behind", Config.DB_REPLICA_CHECK_INTERVAL)
+            else:
+                replica.ejected_until = 0.0
+                replica.reason = None
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def replica_stats(self):
+        now = time.monotonic()
+        return [
+            dict(replica.pool.stats(), name=replica.name, lag=replica.lag,
+                 healthy=replica.ejected_until <= now,
+                 ejected_reason=replica.reason if replica.ejected_until > now else None)
+            for replica in self.replicas
+        ]
     
-    def create_likes_table(self):
-        connection = self.get_connection()
-        if connection:
-            try:
-                cursor = connection.cursor()
-                create_table_query = """
-                CREATE TABLE IF NOT EXISTS likes (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id INT NOT NULL,
-                    post_id INT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE,
-                    UNIQUE KEY unique_like (user_id, post_id)
-                )
-                """
-                cursor.execute(create_table_query)
-                connection.commit()
-                print("Likes table created successfully")
-            except Error as e:
-                print(f"Error creating likes table: {e}")
-            finally:
-                cursor.close()
-                connection.close()
+    def create_tables(self):
+        self.migrate()
     
-    def create_comments_table(self):
-        connection = self.get_connection()
-        if connection:
-            try:
+    def migrate(self):
+        # Apply pending schema migrations over one connection. A restart with
+        # nothing pending costs a single SELECT and no DDL. GET_LOCK keeps
+        # workers starting at the same time from racing each other.
+        try:
+            with self.connection() as connection:
                 cursor = connection.cursor()
-                create_table_query = """
-                CREATE TABLE IF NOT EXISTS comments (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id INT NOT NULL,
-                    post_id INT NOT NULL,
-                    comment_text TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE
-                )
-                """
-                cursor.execute(create_table_query)
-                connection.commit()
-                print("Comments table created successfully")
-            except Error as e:
-                print(f"Error creating comments table: {e}")
-            finally:
-                cursor.close()
-                connection.close()
+                cursor.execute("SELECT GET_LOCK('schema_migrations', 60)")
+                # 1 when held; 0 on timeout and NULL on error, and running
+                # without the lock is what it exists to prevent
+                if cursor.fetchone()[0] != 1:
+                    raise Error(msg="Timed out waiting for the schema migration lock")
+                try:
+                    applied = self._applied_migrations(cursor)
+                    pending = [migration for migration in MIGRATIONS if migration[0] not in applied]
+                    for version, description, step in pending:
+                        if callable(step):
+                            step(cursor)
+                        else:
+                            for statement in step:
+                                cursor.execute(statement)
+                        cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                                       (version, description))
+                        connection.commit()
+                        print(f"Applied migration {version}: {description}")
+                    return len(pending)
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK('schema_migrations')")
+                    cursor.fetchone()
+        except Error as e:
+            print(f"Error running migrations: {e}")
+            return 0
     
-    def create_chat_sessions_table(self):
-        connection = self.get_connection()
-        if connection:
-            try:
-                cursor = connection.cursor()
-                create_table_query = """
-                CREATE TABLE IF NOT EXISTS chat_sessions (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user1_id INT NOT NULL,
-                    user2_id INT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user1_id) REFERENCES users(id) ON DELETE CASCADE,
-                    FOREIGN KEY (user2_id) REFERENCES users(id) ON DELETE CASCADE,
-                    UNIQUE KEY unique_chat_session (user1_id, user2_id)
+    def _applied_migrations(self, cursor):
+        try:
+            cursor.execute("SELECT version FROM schema_migrations")
+        except Error as e:
+            if e.errno != errorcode.ER_NO_SUCH_TABLE:
+                raise
+            cursor.execute("""
+                CREATE TABLE schema_migrations (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
-                """
-                cursor.execute(create_table_query)
-                connection.commit()
-                print("Chat sessions table created successfully")
-            except Error as e:
-                print(f"Error creating chat sessions table: {e}")
-            finally:
-                cursor.close()
-                connection.close()
+            """)
+            return set()
+        return {row[0] for row in cursor.fetchall()}
     
-    def create_messages_table(self):
-        connection = self.get_connection()
-        if connection:
-            try:
-                cursor = connection.cursor()
-                create_table_query = """
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    chat_session_id INT NOT NULL,
-                    sender_id INT NOT NULL,
-                    message_text TEXT NOT NULL,
-                    is_read BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (chat_session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE,
-                    FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-                """
-                cursor.execute(create_table_query)
-                connection.commit()
-                print("Messages table created successfully")
-            except Error as e:
-                print(f"Error creating messages table: {e}")
-            finally:
-                cursor.close()
-                connection.close()
\ No newline at end of file
+    def explain(self, query, params=()):
+        with self.connection() as connection:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("EXPLAIN " + query, params)
+            return cursor.fetchall()
+    
+    def reconcile_post_counters(self, after_id=0, batch_size=500):
+        # Recompute counters for the next batch_size posts after after_id and
+        # fix the ones that drifted. Returns (last post id, rows repaired), or
+        # (None, 0) once past the end of the table.
+        with self.connection() as connection:
+            # READ COMMITTED so the counts below are read after the row locks
+            # are held: a concurrent like either committed first (and is
+            # counted) or is still waiting on the posts row (and will bump the
+            # counter itself afterwards).
+            connection.start_transaction(isolation_level='READ COMMITTED')
+            cursor = connection.cursor()
+            cursor.execute("SELECT id FROM posts WHERE id > %s ORDER BY id LIMIT %s FOR UPDATE",
+                           (after_id, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return None, 0
+            
+            first_id, last_id = ids[0], ids[-1]
+            cursor.execute("""
+                UPDATE posts p
+                LEFT JOIN (
+                    SELECT post_id, COUNT(*) AS n FROM likes
+                    WHERE post_id BETWEEN %s AND %s GROUP BY post_id
+                ) l ON l.post_id = p.id
+                LEFT JOIN (
+                    SELECT post_id, COUNT(*) AS n FROM comments
+                    WHERE post_id BETWEEN %s AND %s GROUP BY post_id
+                ) c ON c.post_id = p.id
+                SET p.like_count = COALESCE(l.n, 0), p.comment_count = COALESCE(c.n, 0)
+                WHERE p.id BETWEEN %s AND %s
+                AND (p.like_count <> COALESCE(l.n, 0) OR p.comment_count <> COALESCE(c.n, 0))
+            """, (first_id, last_id, first_id, last_id, first_id, last_id))
+            repaired = cursor.rowcount
+            connection.commit()
+            return last_id, repaired
@@ -0,0 +1,113 @@
+from collections import OrderedDict
+import threading
+import time
+from message_bus import BusChannel
+
+class FeedCache:
+    # The shared part of feed pages (posts, counters, comment previews), keyed
+    # by (cursor, limit). Nothing viewer-specific is stored: user_liked and
+    # author profiles are layered on per request. A new post drops every
+    # page; a like or comment drops only the pages holding that post. With a
+    # message bus, invalidations reach the other workers too. Pages read in
+    # the settle seconds after an invalidation aren't kept, since a lagging
+    # read replica may not have the change yet.
+    def __init__(self, max_pages=200, ttl=30.0, bus=None, channel='feed', settle=0.0):
+        self.max_pages = max_pages
+        self.ttl = ttl
+        self.settle = settle
+        self.channel = BusChannel(bus, channel)
+        self._lock = threading.Lock()
+        # (before, limit) -> (posts, next_cursor, expires_at)
+        self._pages = OrderedDict()
+        # post_id -> set of page keys it appears on
+        self._post_pages = {}
+        # Bumped by every invalidation so a load that raced one isn't cached
+        self._generation = 0
+        self._invalidated_at = float('-inf')
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def _copy(posts):
+        # Callers overlay per-viewer fields on the rows, so never hand out
+        # or keep the same dicts
+        return [dict(post, comments=[dict(comment) for comment in post['comments']])
+                for post in posts]
+
+    def generation(self):
+        # None while settling, which put() never matches
+        with self._lock:
+            if time.monotonic() - self._invalidated_at < self.settle:
+                return None
+            return self._generation
+
+    def get(self, before, limit, allow_expired=False):
+        # Returns (posts, next_cursor) or None. allow_expired also returns a
+        # page past its ttl (but never an invalidated one), for serving
+        # something when the database can't be asked.
+        key = (before, limit)
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None or (entry[2] <= time.monotonic() and not allow_expired):
+                if entry is not None:
+                    self._drop(key)
+                self._misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self._hits += 1
+            return self._copy(entry[0]), entry[1]
+
+    def put(self, before, limit, posts, next_cursor, generation):
+        # generation is what generation() returned before the page was read
+        key = (before, limit)
+        with self._lock:
+            if generation != self._generation:
+                return
+            if key in self._pages:
+                self._drop(key)
+            self._pages[key] = (self._copy(posts), next_cursor, time.monotonic() + self.ttl)
+            for post in posts:
+                self._post_pages.setdefault(post['id'], set()).add(key)
+            while len(self._pages) > self.max_pages:
+                self._drop(next(iter(self._pages)))
+
+    def _drop(self, key):
+        posts = self._pages.pop(key)[0]
+        for post in posts:
+            keys = self._post_pages.get(post['id'])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._post_pages[post['id']]
+
+    def invalidate_posts(self, post_ids):
+        self._forget(post_ids)
+        self.channel.publish({'post_ids': list(post_ids)})
+
+    def invalidate_all(self):
+        self._forget(None)
+        self.channel.publish({'post_ids': None})
+
+    def _forget(self, post_ids):
+        with self._lock:
+            self._generation += 1
+            self._invalidated_at = time.monotonic()
+            if post_ids is None:
+                self._pages.clear()
+                self._post_pages.clear()
+                return
+            for post_id in post_ids:
+                for key in list(self._post_pages.get(post_id, ())):
+                    self._drop(key)
+
+    def receive(self, message):
+        # Another worker's invalidation, from channel.listen()
+        self._forget(message['post_ids'])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pages': len(self._pages),
+                'hits': self._hits,
+                'misses': self._misses,
+            }
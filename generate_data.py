@@ -0,0 +1,244 @@
+# Fills a local database with synthetic users, posts, likes, comments and
+# chats for benchmark.py and check_query_plans.py. The same seed and sizes
+# always produce the same rows (timestamps end at midnight of the day it runs).
+#
+# Usage: python generate_data.py [--seed 1] [--reset]
+#        python generate_data.py --users 10000 --posts 1000000 --messages 50000000
+#
+# The defaults (10k users, 100k posts, 1M messages) load in minutes; the
+# second line is the scale the hot queries should be judged at.
+#
+# Shapes follow what a social app sees rather than uniform noise:
+# - a few users write most posts (Zipf over users)
+# - likes per post are power-law: most posts get a handful, a few go viral
+# - comments per post are power-law too, so some threads run to thousands
+# - message volume per chat is Zipf too, giving a few very long histories
+# Every user gets the password BENCHMARK_PASSWORD. Rows are bulk inserted
+# with explicit ids into empty tables (--reset empties them first), with
+# foreign key and unique checks off for speed; the counters and chat
+# summaries the app keeps are filled in consistently.
+#
+# Meant for a local or throwaway MySQL: it refuses any other DB_HOST unless
+# --allow-remote is given.
+import argparse
+import random
+import sys
+import time
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+from mysql.connector import Error
+from config import Config
+from database import Database
+from password_hasher import PasswordHasher
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1', 'mysql', 'db')
+TABLES = ('messages', 'chat_sessions', 'comments', 'likes', 'posts', 'users')
+WORDS = ('vibe', 'sunset', 'coffee', 'today', 'love', 'this', 'city', 'night', 'friends', 'weekend',
+         'beach', 'music', 'new', 'look', 'finally', 'so', 'good', 'what', 'a', 'day', 'the', 'best',
+         'trip', 'food', 'lol', 'same', 'yes', 'no', 'tomorrow', 'see', 'you', 'there', 'mood',
+         'again', 'never', 'always', 'here', 'we', 'go', 'wow', 'nice', 'shot', 'where', 'is', 'it',
+         'miss', 'home', 'gym', 'rain', 'snow', 'summer', 'late', 'early', 'party', 'chill')
+
+def text(rng, low, high):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+def power_law(rng, alpha, scale, cap):
+    # 0, 1, 2, ... with a Pareto tail, about scale / (alpha - 1) on average;
+    # smaller alpha means a longer tail
+    return min(cap, int(scale * (rng.paretovariate(alpha) - 1)))
+
+class Picker:
+    # Draws items with fixed weights in O(log n) per draw
+    def __init__(self, items, weights):
+        self.items = items
+        self.cumulative = list(accumulate(weights))
+        self.total = self.cumulative[-1]
+
+    def pick(self, rng):
+        return self.items[bisect(self.cumulative, rng.random() * self.total)]
+
+class Loader:
+    # Buffers rows per statement and inserts them batch_size at a time
+    def __init__(self, connection, batch_size):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.batch_size = batch_size
+        self.pending = {}
+        self.counts = {}
+        self.started = time.monotonic()
+
+    def add(self, table, sql, row):
+        rows = self.pending.setdefault(sql, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(table, sql)
+
+    def flush(self, table, sql):
+        rows = self.pending.pop(sql, [])
+        if not rows:
+            return
+        self.cursor.executemany(sql, rows)
+        self.connection.commit()
+        before = self.counts.get(table, 0)
+        self.counts[table] = before + len(rows)
+        if self.counts[table] // 100000 != before // 100000:
+            print(f"  {table}: {self.counts[table]:,} rows ({time.monotonic() - self.started:.0f}s)")
+
+USERS_SQL = """INSERT INTO users (id, username, email, password_hash, bio, created_at)
+               VALUES (%s, %s, %s, %s, %s, %s)"""
+# image_variants '{}': the bench images are never resized, and a NULL would
+# queue every post for the image pipeline on each start
+POSTS_SQL = """INSERT INTO posts (id, user_id, image_url, image_variants, caption, like_count, comment_count, created_at)
+               VALUES (%s, %s, %s, '{}', %s, %s, %s, %s)"""
+LIKES_SQL = "INSERT INTO likes (user_id, post_id, created_at) VALUES (%s, %s, %s)"
+COMMENTS_SQL = "INSERT INTO comments (user_id, post_id, comment_text, created_at) VALUES (%s, %s, %s, %s)"
+MESSAGES_SQL = """INSERT INTO messages (id, chat_session_id, sender_id, message_text, created_at)
+                  VALUES (%s, %s, %s, %s, %s)"""
+CHAT_SESSIONS_SQL = """INSERT INTO chat_sessions
+    (id, user1_id, user2_id, created_at, updated_at, last_message_id, last_message_preview, last_message_at,
+     user1_unread, user2_unread, user1_last_read_id, user2_last_read_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+
+def between(rng, start, end):
+    return start + timedelta(seconds=rng.random() * (end - start).total_seconds())
+
+def generate(loader, rng, args):
+    end = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=args.days)
+    span = (end - start).total_seconds()
+    user_ids = list(range(1, args.users + 1))
+    # Activity rank, independent of id, so the busiest users aren't all the
+    # oldest accounts
+    ranked = user_ids[:]
+    rng.shuffle(ranked)
+    active = Picker(ranked, [1 / rank ** args.zipf for rank in range(1, args.users + 1)])
+
+    password_hash = PasswordHasher(Config.PASSWORD_HASH_METHOD).hash(BENCHMARK_PASSWORD)
+    print(f"Users: {args.users:,}")
+    for user_id in user_ids:
+        loader.add('users', USERS_SQL, (user_id, f"user{user_id}", f"user{user_id}@example.com", password_hash,
+                                        text(rng, 0, 12), start + timedelta(seconds=span * (user_id - 1) / args.users)))
+    loader.flush('users', USERS_SQL)
+
+    print(f"Posts: {args.posts:,}, with likes and comments")
+    for post_id in range(1, args.posts + 1):
+        created_at = start + timedelta(seconds=span * (post_id - 1) / args.posts)
+        likes = power_law(rng, args.like_alpha, args.like_scale, args.users)
+        comments = power_law(rng, args.comment_alpha, 1, args.max_comments)
+        loader.add('posts', POSTS_SQL, (post_id, active.pick(rng), f"uploads/bench/{post_id % 100}.jpg",
+                                        text(rng, 0, 20), likes, comments, created_at))
+        # Distinct likers: popular users like more, but a post liked by a
+        # large share of everyone is sampled uniformly
+        if likes > args.users // 10:
+            likers = rng.sample(user_ids, likes)
+        else:
+            likers = set()
+            while len(likers) < likes:
+                likers.add(active.pick(rng))
+            likers = sorted(likers)
+        for user_id in likers:
+            loader.add('likes', LIKES_SQL, (user_id, post_id, between(rng, created_at, end)))
+        for _ in range(comments):
+            loader.add('comments', COMMENTS_SQL, (active.pick(rng), post_id, text(rng, 1, 30),
+                                                  between(rng, created_at, end)))
+    for table, sql in (('posts', POSTS_SQL), ('likes', LIKES_SQL), ('comments', COMMENTS_SQL)):
+        loader.flush(table, sql)
+
+    print(f"Chats: {args.chats:,} with {args.messages:,} messages")
+    pairs = set()
+    attempts = 0
+    while len(pairs) < args.chats and attempts < args.chats * 10:
+        attempts += 1
+        user1, user2 = active.pick(rng), rng.randint(1, args.users)
+        if user1 != user2:
+            pairs.add((min(user1, user2), max(user1, user2)))
+    sessions = sorted(pairs)
+    rng.shuffle(sessions)
+    if not sessions:
+        return
+    chats = Picker(range(len(sessions)), [1 / rank ** args.message_zipf for rank in range(1, len(sessions) + 1)])
+    # Per session: [last message id, its sender, text, time, the id before it]
+    last = [None] * len(sessions)
+    for message_id in range(1, args.messages + 1):
+        index = chats.pick(rng)
+        sender = rng.choice(sessions[index])
+        message_text = text(rng, 1, 25)
+        created_at = start + timedelta(seconds=span * (message_id - 1) / args.messages)
+        loader.add('messages', MESSAGES_SQL, (message_id, index + 1, sender, message_text, created_at))
+        last[index] = [message_id, sender, message_text, created_at, last[index][0] if last[index] else None]
+    loader.flush('messages', MESSAGES_SQL)
+
+    for index, (user1, user2) in enumerate(sessions):
+        summary = last[index]
+        if summary is None:
+            created_at = between(rng, start, end)
+            row = (index + 1, user1, user2, created_at, created_at, None, None, None, 0, 0, None, None)
+        else:
+            message_id, sender, message_text, created_at, previous_id = summary
+            # The sender has read everything; most recipients have too, the
+            # rest still have the last message unread
+            unread = previous_id is not None and rng.random() < args.unread_share
+            read_marks = {sender: message_id}
+            read_marks[user2 if sender == user1 else user1] = previous_id if unread else message_id
+            row = (index + 1, user1, user2, created_at, created_at, message_id, message_text[:255], created_at,
+                   int(unread and sender != user1), int(unread and sender != user2),
+                   read_marks[user1], read_marks[user2])
+        loader.add('chat_sessions', CHAT_SESSIONS_SQL, row)
+    loader.flush('chat_sessions', CHAT_SESSIONS_SQL)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load seeded synthetic data for benchmarks')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--chats', type=int, default=30000)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=365, help='history spread over this many days')
+    parser.add_argument('--zipf', type=float, default=1.0, help='exponent of user activity')
+    parser.add_argument('--like-alpha', type=float, default=1.16, help='Pareto shape of likes per post')
+    parser.add_argument('--like-scale', type=float, default=2, help='likes on a typical post')
+    parser.add_argument('--comment-alpha', type=float, default=1.5, help='Pareto shape of comments per post')
+    parser.add_argument('--max-comments', type=int, default=5000)
+    parser.add_argument('--message-zipf', type=float, default=0.8, help='exponent of messages per chat')
+    parser.add_argument('--unread-share', type=float, default=0.3, help='chats whose last message is unread')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--reset', action='store_true', help='empty the tables first')
+    parser.add_argument('--allow-remote', action='store_true', help=f"load into a DB_HOST other than {LOCAL_HOSTS}")
+    args = parser.parse_args()
+
+    if Config.DB_HOST not in LOCAL_HOSTS and not args.allow_remote:
+        print(f"Refusing to load into {Config.DB_HOST}; pass --allow-remote if this is a throwaway database")
+        return 1
+
+    db = Database()
+    db.migrate()
+    try:
+        with db.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+            for table in TABLES:
+                if args.reset:
+                    cursor.execute(f"TRUNCATE TABLE {table}")
+                else:
+                    cursor.execute(f"SELECT 1 FROM {table} LIMIT 1")
+                    if cursor.fetchall():
+                        print(f"Table {table} is not empty; pass --reset to replace its rows")
+                        return 1
+
+            loader = Loader(connection, args.batch_size)
+            generate(loader, random.Random(args.seed), args)
+            cursor.execute("SET SESSION foreign_key_checks = 1, unique_checks = 1")
+    except Error as e:
+        print(f"Error loading data: {e}")
+        return 1
+    finally:
+        db.pool.close_all()
+
+    print(f"Done in {time.monotonic() - loader.started:.0f}s: " +
+          ", ".join(f"{count:,} {table}" for table, count in loader.counts.items()))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
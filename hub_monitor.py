@@ -0,0 +1,113 @@
+from collections import deque
+from eventlet import patcher
+import eventlet
+import greenlet
+import sys
+import time
+import traceback
+
+# Real OS threads and sleeps, untouched by monkey patching
+_threading = patcher.original('threading')
+_time = patcher.original('time')
+
+class HubMonitor:
+    # Watches the eventlet hub that serves every request and socket. Two
+    # measurements, both cheap enough to leave on:
+    # - loop lag: a green thread asks to wake every lag_interval seconds and
+    #   records how late it actually ran
+    # - blocking: a greenlet switch hook notes which green thread is running
+    #   and since when; one that runs threshold seconds without yielding is
+    #   counted against the route or event it serves (label_of(greenlet))
+    #   and its stack, taken by a native watchdog thread while it is still
+    #   stuck, is printed (at most once per label per report_interval)
+    def __init__(self, threshold=0.1, lag_interval=0.5, label_of=None, report_interval=60.0,
+                 stack_limit=40):
+        self.threshold = threshold
+        self.lag_interval = lag_interval
+        self.label_of = label_of or (lambda gr: None)
+        self.report_interval = report_interval
+        self.stack_limit = stack_limit
+        self._hub_greenlet = None
+        self._hub_thread = None
+        self._previous_trace = None
+        # (greenlet running now, when it was switched to); replaced as a
+        # whole by the switch hook so the watchdog thread reads a matching pair
+        self._current = (None, 0.0)
+        # id(greenlet) -> (label, stack) captured while it was blocking; the
+        # label is taken then because a request's scope may have ended by
+        # the time it yields
+        self._stacks = {}
+        # label -> [blocks, seconds blocked, longest]
+        self._blocks = {}
+        self._last_report = {}
+        self._lags = deque(maxlen=max(1, int(60 / lag_interval)))
+
+    def start(self, spawn=eventlet.spawn):
+        # Call from the thread running the hub, after monkey patching
+        self._hub_greenlet = eventlet.hubs.get_hub().greenlet
+        self._hub_thread = _threading.get_ident()
+        self._current = (greenlet.getcurrent(), time.perf_counter())
+        self._previous_trace = greenlet.settrace(self._trace)
+        spawn(self._measure_lag)
+        _threading.Thread(target=self._watch, name='hub-watchdog', daemon=True).start()
+
+    def _trace(self, event, args):
+        # Runs on every greenlet switch, so keep it to a few operations
+        if event in ('switch', 'throw'):
+            now = time.perf_counter()
+            origin, target = args
+            ran = now - self._current[1]
+            self._current = (target, now)
+            if ran >= self.threshold and origin is not self._hub_greenlet:
+                self._blocked(origin, ran)
+        if self._previous_trace is not None:
+            self._previous_trace(event, args)
+
+    def _blocked(self, gr, seconds):
+        label, stack = self._stacks.pop(id(gr), (None, None))
+        label = label or self.label_of(gr) or 'background'
+        totals = self._blocks.setdefault(label, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] = max(totals[2], seconds)
+        now = time.monotonic()
+        if now - self._last_report.get(label, float('-inf')) >= self.report_interval:
+            self._last_report[label] = now
+            print(f"Event loop blocked for {seconds * 1000:.0f} ms by {label}"
+                  + (f" at:\n{stack}" if stack else ""))
+
+    def _watch(self):
+        # Native thread: while the hub is stuck the green threads can't run,
+        # but this one can, so it grabs the culprit's stack mid-block
+        captured = None
+        while True:
+            _time.sleep(self.threshold / 2)
+            current = self._current
+            running, since = current
+            if (running is None or running is self._hub_greenlet or current is captured
+                    or time.perf_counter() - since < self.threshold):
+                continue
+            frame = sys._current_frames().get(self._hub_thread)
+            if frame is not None:
+                self._stacks[id(running)] = (self.label_of(running),
+                                             ''.join(traceback.format_stack(frame, limit=self.stack_limit)))
+                captured = current
+
+    def _measure_lag(self):
+        while True:
+            started = time.perf_counter()
+            eventlet.sleep(self.lag_interval)
+            self._lags.append(max(0.0, time.perf_counter() - started - self.lag_interval))
+
+    def stats(self):
+        lags = list(self._lags)
+        return {
+            'lag_seconds': lags[-1] if lags else 0.0,
+            'lag_max_seconds': max(lags) if lags else 0.0,
+            'blocks': sum(totals[0] for totals in list(self._blocks.values())),
+        }
+
+    def block_stats(self):
+        # Per route/event, for /metrics
+        return [{'name': label, 'blocks': totals[0], 'blocked_seconds': totals[1], 'longest_seconds': totals[2]}
+                for label, totals in list(self._blocks.items())]
@@ -0,0 +1,206 @@
+from PIL import Image, ImageOps
+from media_store import shard
+from offload import inline
+import hashlib
+import json
+import os
+import queue
+import threading
+
+# Widths of the resized copies of post images, and the square avatar sizes.
+# Sized for the 600px feed card and 30-150px avatars at 1x and 2x.
+POST_WIDTHS = (320, 640, 1080)
+AVATAR_SIZES = (64, 128, 256)
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+def _open(source_path, size):
+    try:
+        with Image.open(source_path) as source:
+            if getattr(source, 'is_animated', False):
+                # Resizing would keep only the first frame
+                return None
+            # Let the JPEG decoder scale down while decoding; far cheaper
+            # than decoding all 12 MP and resizing afterwards
+            source.draft('RGB', (size, size))
+            # Apply the EXIF rotation before the metadata is dropped. This
+            # decodes the pixels, so the file can be closed afterwards.
+            image = ImageOps.exif_transpose(source)
+            image.load()
+    except OSError as e:
+        # Missing, unreadable, truncated or not an image at all
+        # (UnidentifiedImageError is an OSError): retrying won't help, so
+        # it's kept as uploaded
+        print(f"Keeping {source_path} as uploaded: {e}")
+        return None
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+def _save(image, output_folder, static_folder, name):
+    # Saving without exif/icc arguments writes no metadata
+    jpeg_path = os.path.join(output_folder, f"{name}.jpg")
+    webp_path = os.path.join(output_folder, f"{name}.webp")
+    flat = image
+    if image.mode == 'RGBA':
+        flat = Image.new('RGB', image.size, (255, 255, 255))
+        flat.paste(image, mask=image.getchannel('A'))
+    _write(flat, os.path.join(static_folder, jpeg_path), 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    _write(image, os.path.join(static_folder, webp_path), 'WEBP', quality=WEBP_QUALITY, method=4)
+    return jpeg_path, webp_path
+
+def _write(image, path, format, **options):
+    # Variants are served as immutable, so a half-written file must never
+    # appear under the final name: write next to it, then rename over
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        image.save(temp_path, format, **options)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def make_post_variants(source_path, static_folder, output_folder, stem):
+    # Returns {'jpeg': {width: path}, 'webp': {width: path}} with paths
+    # relative to static_folder, or {} for images that are kept as uploaded
+    # (output_folder is only created when there is something to write)
+    image = _open(source_path, max(POST_WIDTHS))
+    if image is None:
+        return {}
+    os.makedirs(os.path.join(static_folder, output_folder), exist_ok=True)
+    # Never upscale: the largest copy is at most the source width
+    widths = [width for width in POST_WIDTHS if width < image.width]
+    widths.append(min(image.width, max(POST_WIDTHS)))
+
+    variants = {'jpeg': {}, 'webp': {}}
+    for width in sorted(set(widths), reverse=True):
+        height = max(1, round(image.height * width / image.width))
+        # Each size is made from the previous, larger one
+        image = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+        jpeg_path, webp_path = _save(image, output_folder, static_folder, f"{stem}_{width}")
+        variants['jpeg'][width] = jpeg_path
+        variants['webp'][width] = webp_path
+    return variants
+
+def make_avatar_variants(source_path, static_folder, output_folder, stem):
+    # Center-cropped squares, same shape as make_post_variants
+    image = _open(source_path, max(AVATAR_SIZES))
+    if image is None:
+        return {}
+    os.makedirs(os.path.join(static_folder, output_folder), exist_ok=True)
+    largest = min(image.width, image.height, max(AVATAR_SIZES))
+    sizes = [size for size in AVATAR_SIZES if size < largest] + [largest]
+
+    variants = {'jpeg': {}, 'webp': {}}
+    for size in sorted(set(sizes), reverse=True):
+        image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        jpeg_path, webp_path = _save(image, output_folder, static_folder, f"{stem}_{size}")
+        variants['jpeg'][size] = jpeg_path
+        variants['webp'][size] = webp_path
+    return variants
+
+def parse_variants(value):
+    # Column value -> {'jpeg': {width: path}, ...}; None while unprocessed
+    if not value:
+        return None
+    variants = json.loads(value)
+    return {fmt: {int(width): path for width, path in paths.items()}
+            for fmt, paths in variants.items()}
+
+class ImagePipeline:
+    # Makes resized, metadata-free JPEG/WebP copies of uploaded images off
+    # the request path. Uploads are queued by submit_*; run() is the worker
+    # loop (start several as background tasks). The resizing itself is
+    # handed to offload, e.g. eventlet.tpool.execute, so it runs on a native
+    # thread (Pillow releases the GIL while decoding and encoding) instead
+    # of blocking the event loop. on_done(kind, id) is called after the
+    # variants are recorded.
+    def __init__(self, db, static_folder, output_folder='uploads/variants', offload=None, on_done=None):
+        self.db = db
+        self.static_folder = static_folder
+        self.output_folder = output_folder
+        self.offload = offload or inline
+        self.on_done = on_done
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._processed = 0
+        self._failed = 0
+
+    def submit_post(self, post_id, image_url):
+        self._jobs.put(('post', post_id, image_url))
+
+    def submit_avatar(self, user_id, profile_picture):
+        self._jobs.put(('avatar', user_id, profile_picture))
+
+    def backfill(self, limit=500):
+        # Queue recent uploads that never got their variants, e.g. because
+        # the process stopped with jobs still queued
+        with self.db.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("""
+                SELECT id, image_url FROM posts
+                WHERE image_url IS NOT NULL AND image_variants IS NULL
+                ORDER BY id DESC LIMIT %s
+            """, (limit,))
+            for post_id, image_url in cursor.fetchall():
+                self.submit_post(post_id, image_url)
+            cursor.execute("""
+                SELECT id, profile_picture FROM users
+                WHERE profile_picture IS NOT NULL AND profile_picture_variants IS NULL
+                ORDER BY id DESC LIMIT %s
+            """, (limit,))
+            for user_id, profile_picture in cursor.fetchall():
+                self.submit_avatar(user_id, profile_picture)
+
+    def run(self):
+        while True:
+            kind, object_id, path = self._jobs.get()
+            try:
+                self._process(kind, object_id, path)
+            except Exception as e:
+                # Anything Pillow raises on a bad file included; the worker
+                # must survive it to process the next upload
+                print(f"Error processing {kind} image {path}: {e!r}")
+                with self._lock:
+                    self._failed += 1
+
+    def _process(self, kind, object_id, path):
+        make = make_post_variants if kind == 'post' else make_avatar_variants
+        stem = f"{kind}_{os.path.splitext(os.path.basename(path))[0]}"
+        # Sharded like the uploads so no directory grows without bound
+        output_folder = os.path.join(self.output_folder, shard(hashlib.sha256(path.encode()).hexdigest()))
+        source_path = os.path.join(self.static_folder, path)
+        try:
+            variants = self.offload(make, source_path, self.static_folder, output_folder, stem)
+        except Image.DecompressionBombError as e:
+            # Not something we can resize; record that so it isn't retried
+            print(f"Keeping {path} as uploaded: {e}")
+            variants = {}
+
+        with self.db.connection() as connection:
+            cursor = connection.cursor()
+            # Only if the image is still the one we processed; an avatar may
+            # have been replaced in the meantime
+            if kind == 'post':
+                cursor.execute("UPDATE posts SET image_variants = %s WHERE id = %s AND image_url = %s",
+                               (json.dumps(variants), object_id, path))
+            else:
+                cursor.execute("UPDATE users SET profile_picture_variants = %s WHERE id = %s AND profile_picture = %s",
+                               (json.dumps(variants), object_id, path))
+            connection.commit()
+
+        with self._lock:
+            self._processed += 1
+        if self.on_done:
+            self.on_done(kind, object_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._jobs.qsize(),
+                'processed': self._processed,
+                'failed': self._failed,
+            }
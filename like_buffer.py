@@ -0,0 +1,211 @@
+from mysql.connector import Error
+import threading
+import time
+
+class LikeBuffer:
+    # Write-behind buffer for like/unlike toggles. Clicks only touch memory:
+    # the final liked state per (user_id, post_id) is kept until the next
+    # flush, which writes every pending pair plus the counter deltas in one
+    # transaction. A crash loses at most the pairs of the current window.
+    # on_flush, if given, is called with the post ids of every written batch.
+    def __init__(self, db, flush_interval=1.0, max_pending=500, on_flush=None):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.on_flush = on_flush
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (user_id, post_id) -> liked, for toggles not yet flushed
+        self._pending = {}
+        # post_id -> net like_count change of the pending toggles
+        self._delta = {}
+        # Same two maps for a flush that is being written right now
+        self._inflight = {}
+        self._inflight_delta = {}
+        # post_id -> like_count last read from MySQL, dropped on every flush
+        self._counts = {}
+        self._generation = 0
+        # True from just before a flush commits until its state is cleared;
+        # a count read in that window may or may not include the flush
+        self._committing = False
+        self._flushes = 0
+        self._flushed_pairs = 0
+        self._last_flush = time.monotonic()
+
+    def _buffered_state(self, key):
+        if key in self._pending:
+            return self._pending[key]
+        return self._inflight.get(key)
+
+    def _projected(self, post_id):
+        return (self._counts[post_id] + self._inflight_delta.get(post_id, 0)
+                + self._delta.get(post_id, 0))
+
+    def _read(self, user_id, post_id):
+        with self.db.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("""
+                SELECT p.like_count,
+                EXISTS(SELECT 1 FROM likes l WHERE l.post_id = p.id AND l.user_id = %s)
+                FROM posts p WHERE p.id = %s
+            """, (user_id, post_id))
+            return cursor.fetchone()
+
+    def toggle(self, user_id, post_id):
+        # Returns (action, projected like_count), or None if the post does
+        # not exist. Raises mysql.connector.Error if the lookup fails.
+        key = (user_id, post_id)
+        generation = None
+        liked_in_db = None
+        while True:
+            with self._lock:
+                fresh = (generation is not None and generation == self._generation
+                         and not self._committing)
+                if fresh:
+                    self._counts[post_id] = like_count
+                current = self._buffered_state(key)
+                if current is None and fresh:
+                    current = liked_in_db
+                if current is not None and post_id in self._counts:
+                    liked = not current
+                    self._pending[key] = liked
+                    self._delta[post_id] = self._delta.get(post_id, 0) + (1 if liked else -1)
+                    return ('liked' if liked else 'unliked'), max(self._projected(post_id), 0)
+                generation = self._generation
+                committing = self._committing
+
+            if committing:
+                # Wait for the flush to finish rather than read a count that
+                # might already include the in-flight toggles
+                with self._flush_lock:
+                    pass
+                generation = None
+                continue
+
+            # Not enough in memory; read the base state. If a flush commits
+            # while we read, the row may predate it, so loop and read again.
+            row = self._read(user_id, post_id)
+            if row is None:
+                return None
+            like_count, liked_in_db = row[0], bool(row[1])
+
+    def apply_pending(self, posts, user_id):
+        # Overlay unflushed toggles on rows read from MySQL so a viewer sees
+        # their own likes immediately after a refresh
+        with self._lock:
+            if not self._pending and not self._inflight:
+                return
+            for post in posts:
+                post_id = post['id']
+                post['like_count'] = max(post['like_count'] + self._inflight_delta.get(post_id, 0)
+                                         + self._delta.get(post_id, 0), 0)
+                state = self._buffered_state((user_id, post_id))
+                if state is not None:
+                    post['user_liked'] = int(state)
+
+    def pending_for(self, user_id):
+        # {post_id: liked} of this user's toggles not yet committed
+        with self._lock:
+            state = {post_id: liked for (uid, post_id), liked in self._inflight.items() if uid == user_id}
+            state.update((post_id, liked) for (uid, post_id), liked in self._pending.items() if uid == user_id)
+            return state
+
+    def should_flush(self):
+        with self._lock:
+            return (len(self._pending) >= self.max_pending or
+                    (self._pending and time.monotonic() - self._last_flush >= self.flush_interval))
+
+    def flush(self):
+        # Only one flush at a time; a concurrent caller just returns
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                if not self._pending:
+                    self._last_flush = time.monotonic()
+                    return 0
+                self._inflight, self._pending = self._pending, {}
+                self._inflight_delta, self._delta = self._delta, {}
+                batch = dict(self._inflight)
+
+            try:
+                self._write(batch)
+            except Error:
+                # Put the batch back underneath anything toggled since, and
+                # retry on the next tick
+                with self._lock:
+                    for key, liked in batch.items():
+                        if key not in self._pending:
+                            self._pending[key] = liked
+                    for post_id, delta in self._inflight_delta.items():
+                        self._delta[post_id] = self._delta.get(post_id, 0) + delta
+                    self._inflight, self._inflight_delta = {}, {}
+                    self._committing = False
+                raise
+
+            with self._lock:
+                self._inflight, self._inflight_delta = {}, {}
+                self._counts = {}
+                self._generation += 1
+                self._committing = False
+                self._flushes += 1
+                self._flushed_pairs += len(batch)
+                self._last_flush = time.monotonic()
+            if self.on_flush:
+                self.on_flush({post_id for _, post_id in batch})
+            return len(batch)
+        finally:
+            self._flush_lock.release()
+
+    def _write(self, batch):
+        likes = {}
+        unlikes = {}
+        for (user_id, post_id), liked in batch.items():
+            (likes if liked else unlikes).setdefault(post_id, []).append(user_id)
+
+        with self.db.connection() as connection:
+            cursor = connection.cursor()
+            counters = {}
+
+            # One multi-row statement per post so rowcount is the exact
+            # number of rows that changed, whatever was already in the table
+            for post_id, user_ids in likes.items():
+                values = ", ".join(["(%s, %s)"] * len(user_ids))
+                params = []
+                for user_id in user_ids:
+                    params += [user_id, post_id]
+                cursor.execute(f"INSERT IGNORE INTO likes (user_id, post_id) VALUES {values}", tuple(params))
+                counters[post_id] = counters.get(post_id, 0) + cursor.rowcount
+
+            for post_id, user_ids in unlikes.items():
+                placeholders = ", ".join(["%s"] * len(user_ids))
+                cursor.execute(f"DELETE FROM likes WHERE post_id = %s AND user_id IN ({placeholders})",
+                               (post_id, *user_ids))
+                counters[post_id] = counters.get(post_id, 0) - cursor.rowcount
+
+            counters = {post_id: delta for post_id, delta in counters.items() if delta}
+            if counters:
+                cases = " ".join(["WHEN %s THEN %s"] * len(counters))
+                placeholders = ", ".join(["%s"] * len(counters))
+                params = []
+                for post_id, delta in counters.items():
+                    params += [post_id, delta]
+                params += list(counters)
+                cursor.execute(f"""
+                    UPDATE posts
+                    SET like_count = GREATEST(like_count + CASE id {cases} ELSE 0 END, 0)
+                    WHERE id IN ({placeholders})
+                """, tuple(params))
+
+            with self._lock:
+                self._committing = True
+            connection.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'inflight': len(self._inflight),
+                'flushes': self._flushes,
+                'flushed_pairs': self._flushed_pairs,
+            }
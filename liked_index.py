@@ -0,0 +1,196 @@
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+import threading
+import time
+from message_bus import BusChannel
+import queries
+
+class LikedIndex:
+    # user_id -> sorted array of the post ids they liked (4 bytes a like), so
+    # a page of user_liked flags is one in-memory lookup. A user is loaded on
+    # first use with one range read on unique_like(user_id, post_id) and kept
+    # up to date by set(). Memory is bounded by max_entries ids in total
+    # (least recently used users go first) and users idle for idle_timeout
+    # are dropped. Users with more than max_per_user likes aren't held; their
+    # pages fall back to a query. Every user is reloaded ttl seconds after
+    # loading however busy they are, which bounds how long likes made on
+    # other workers go unseen when there is no message bus.
+    #
+    # pending_of(user_id), if given, returns {post_id: liked} of toggles
+    # buffered but not yet in MySQL (LikeBuffer.pending_for); a load lays
+    # them over the rows it reads.
+    def __init__(self, db, max_entries=2000000, max_per_user=50000, idle_timeout=900.0,
+                 bus=None, channel='likes', ttl=300.0, pending_of=None):
+        self.db = db
+        self.max_entries = max_entries
+        self.max_per_user = max_per_user
+        self.idle_timeout = idle_timeout
+        self.ttl = ttl
+        self.pending_of = pending_of
+        self.channel = BusChannel(bus, channel)
+        self._lock = threading.Lock()
+        # user_id -> (array of post ids, or None if over max_per_user; last
+        # used; reload time)
+        self._users = OrderedDict()
+        self._entries = 0
+        # user_id -> [(post_id, liked)] seen while that user is being loaded
+        self._loading = {}
+        self._hits = 0
+        self._misses = 0
+        self._fallbacks = 0
+
+    def liked(self, user_id, post_ids, cursor=None, cached_only=False):
+        # Returns the subset of post_ids user_id has liked. Reads run on the
+        # caller's cursor if given. With cached_only nothing is read and users
+        # not held in memory get an empty set. Raises mysql.connector.Error
+        # if a read fails.
+        if not post_ids:
+            return set()
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._users.get(user_id)
+            if entry is not None and now >= entry[2]:
+                self._drop(user_id)
+                entry = None
+            if entry is not None:
+                self._users[user_id] = (entry[0], now, entry[2])
+                self._users.move_to_end(user_id)
+                self._hits += 1
+                if entry[0] is not None:
+                    return {post_id for post_id in post_ids if self._contains(entry[0], post_id)}
+            else:
+                self._misses += 1
+
+        if cached_only:
+            return set()
+        if entry is None:
+            liked = self._load(user_id, cursor)
+            if liked is not None:
+                return {post_id for post_id in post_ids if self._contains(liked, post_id)}
+
+        with self._lock:
+            self._fallbacks += 1
+        return self._query(cursor, user_id, post_ids)
+
+    @staticmethod
+    def _contains(liked, post_id):
+        i = bisect_left(liked, post_id)
+        return i < len(liked) and liked[i] == post_id
+
+    def _load(self, user_id, cursor):
+        with self._lock:
+            if user_id in self._loading:
+                # Someone else is loading this user; don't wait for them
+                return None
+            self._loading[user_id] = []
+        try:
+            # Taken before the read: a toggle flushed after this point is in
+            # the rows, one made after it arrives through set()
+            buffered = self.pending_of(user_id) if self.pending_of else {}
+            if cursor is None:
+                with self.db.connection() as connection:
+                    rows = self._read(connection.cursor(), user_id)
+            else:
+                rows = self._read(cursor, user_id)
+        except Exception:
+            with self._lock:
+                del self._loading[user_id]
+            raise
+
+        with self._lock:
+            changes = self._loading.pop(user_id)
+            if rows is None:
+                liked = None
+            else:
+                liked = array('I', rows)
+                for post_id, is_liked in buffered.items():
+                    self._apply(liked, post_id, is_liked)
+                # Writes that raced the read; replaying them in order is
+                # harmless for ones the read already saw
+                for post_id, is_liked in changes:
+                    self._apply(liked, post_id, is_liked)
+                self._entries += len(liked)
+            now = time.monotonic()
+            self._users[user_id] = (liked, now, now + self.ttl)
+            self._users.move_to_end(user_id)
+            self._evict()
+        return liked
+
+    def _read(self, cursor, user_id):
+        # Rows arrive sorted. Returns None if the user has too many likes to
+        # hold.
+        cursor.execute(queries.LIKED_POSTS, (user_id, self.max_per_user + 1))
+        rows = [row['post_id'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()]
+        return rows if len(rows) <= self.max_per_user else None
+
+    def _query(self, cursor, user_id, post_ids):
+        def run(cursor):
+            cursor.execute(queries.liked_among(len(post_ids)), (user_id, *post_ids))
+            return {row['post_id'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()}
+        if cursor is not None:
+            return run(cursor)
+        with self.db.connection() as connection:
+            return run(connection.cursor())
+
+    def set(self, user_id, post_id, liked):
+        # Record a committed (or buffered) like/unlike
+        self._set(user_id, post_id, liked)
+        self.channel.publish({'user_id': user_id, 'post_id': post_id, 'liked': liked})
+
+    def _set(self, user_id, post_id, liked):
+        with self._lock:
+            if user_id in self._loading:
+                self._loading[user_id].append((post_id, liked))
+            entry = self._users.get(user_id)
+            if entry is None or entry[0] is None:
+                return
+            self._entries += self._apply(entry[0], post_id, liked)
+            if len(entry[0]) > self.max_per_user:
+                self._entries -= len(entry[0])
+                self._users[user_id] = (None, entry[1], entry[2])
+            self._evict()
+
+    @staticmethod
+    def _apply(liked, post_id, is_liked):
+        # Returns the change in size
+        i = bisect_left(liked, post_id)
+        present = i < len(liked) and liked[i] == post_id
+        if is_liked and not present:
+            liked.insert(i, post_id)
+            return 1
+        if not is_liked and present:
+            del liked[i]
+            return -1
+        return 0
+
+    def _drop(self, user_id):
+        liked = self._users.pop(user_id)[0]
+        if liked is not None:
+            self._entries -= len(liked)
+
+    def _evict(self):
+        while self._entries > self.max_entries and self._users:
+            self._drop(next(iter(self._users)))
+
+    def _expire(self, now):
+        while self._users:
+            user_id, (_, last_used, _) = next(iter(self._users.items()))
+            if now - last_used < self.idle_timeout:
+                break
+            self._drop(user_id)
+
+    def receive(self, message):
+        # Another worker's like, from channel.listen()
+        self._set(message['user_id'], message['post_id'], message['liked'])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'entries': self._entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'fallbacks': self._fallbacks,
+            }
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import tempfile
+import time
+from offload import inline
+
+def shard(digest):
+    # Two levels of 256 directories from the first four hex digits
+    return os.path.join(digest[:2], digest[2:4])
+
+def sync_file(path):
+    # Make a file's data durable before a rename publishes it
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+def _hash_file(path, chunk_size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest
+
+class MediaStore:
+    # Content-addressed upload storage. A file is hashed while it streams to
+    # a temp file and then renamed to <prefix>/ab/cd/<sha256>.<ext>, so:
+    # - uploads with the same name never overwrite each other
+    # - identical uploads are stored once
+    # - readers never see a half-written file (the rename is atomic)
+    # - no directory holds more than a few hundred entries (two levels of
+    #   256 shards)
+    # Paths returned are relative to static_folder, like the rest of the app.
+    # Files still being written live in work_dir, outside static_folder so
+    # nothing can serve them, but on the same filesystem so the final rename
+    # stays atomic.
+    #
+    # Hashing, copying and fsyncing a file of many megabytes would stall
+    # every green thread if done on the event loop, so that work is handed
+    # to offload, e.g. eventlet.tpool.execute, which runs it on a native
+    # thread.
+    def __init__(self, static_folder, work_dir, prefix='uploads/media', chunk_size=1024 * 1024, offload=None):
+        self.static_folder = static_folder
+        self.work_dir = work_dir
+        self.offload = offload or inline
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.root = os.path.join(static_folder, prefix)
+        self.temp_dir = os.path.join(work_dir, 'tmp')
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def save(self, file, extension):
+        # Store a werkzeug FileStorage (or any object with .stream or .read)
+        # and return its path relative to static_folder
+        stream = getattr(file, 'stream', file)
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        try:
+            # Opened here rather than in _copy, so the file is closed even if
+            # offload fails before _copy runs
+            with os.fdopen(fd, 'wb') as temp:
+                digest = self.offload(self._copy, stream, temp)
+            return self.adopt(temp_path, extension, digest)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def _copy(self, stream, temp):
+        # Stream into the temp file, hashing on the way; returns the digest
+        digest = hashlib.sha256()
+        while True:
+            chunk = stream.read(self.chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            temp.write(chunk)
+        temp.flush()
+        # Make the data durable before the rename publishes it
+        os.fsync(temp.fileno())
+        return digest
+
+    def adopt(self, path, extension, digest=None):
+        # Move a complete file that already sits on the store's filesystem
+        # (e.g. a finished resumable upload) into place and return its path
+        # relative to static_folder. digest is a sha256 object that has
+        # already seen the whole file; without one the file is re-read.
+        if digest is None:
+            digest = self.offload(_hash_file, path, self.chunk_size)
+
+        name = f"{digest.hexdigest()}.{extension.lower()}"
+        relative = os.path.join(self.prefix, shard(name), name)
+        final_path = os.path.join(self.static_folder, relative)
+        if os.path.exists(final_path):
+            # Same bytes already stored
+            os.unlink(path)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            # Temp files are created 0600; uploads are served as static files
+            os.chmod(path, 0o644)
+            os.replace(path, final_path)
+        return relative
+
+    def cleanup_temp(self, max_age=3600):
+        # Remove temp files left behind by a crash mid-upload
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.temp_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
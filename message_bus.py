@@ -0,0 +1,227 @@
+import glob
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+import socketio
+
+# Messages are plain dicts and travel as JSON on every bus, so a payload
+# from another worker is only ever data
+
+def _encode(message):
+    return json.dumps(message, separators=(',', ':')).encode()
+
+def _decode(payload, channel):
+    try:
+        return json.loads(payload)
+    except ValueError as e:
+        print(f"Dropping malformed message on {channel}: {e}")
+        return None
+
+class InProcessBus:
+    # Pub/sub between components living in one process. Lets several
+    # SocketIO servers in a test share a bus without any external service.
+    # Messages go through JSON like on the other buses, so what works here
+    # works across processes too.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        payload = _encode(message)
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(payload)
+
+    def listen(self, channel):
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(subscriber)
+        try:
+            while True:
+                message = _decode(subscriber.get(), channel)
+                if message is not None:
+                    yield message
+        finally:
+            with self._lock:
+                self._subscribers[channel].remove(subscriber)
+
+class UnixSocketBus:
+    # Pub/sub between worker processes on one machine. Every listener binds
+    # a datagram socket in a shared directory; publishing sends one datagram
+    # to each of them. Messages are limited to the kernel's datagram size
+    # (net.core.wmem_default, typically ~200 KB).
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._own = set()
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def publish(self, channel, message):
+        payload = _encode(message)
+        for path in glob.glob(os.path.join(self.directory, f"{channel}.*.sock")):
+            if path in self._own:
+                continue
+            try:
+                self._sender.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that died; nobody is listening
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError as e:
+                print(f"Error publishing to {path}: {e}")
+
+    def listen(self, channel):
+        path = os.path.join(self.directory, f"{channel}.{os.getpid()}.{uuid.uuid4().hex[:8]}.sock")
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(path)
+        self._own.add(path)
+        try:
+            while True:
+                message = _decode(receiver.recv(1 << 20), channel)
+                if message is not None:
+                    yield message
+        finally:
+            self._own.discard(path)
+            receiver.close()
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+class RedisBus:
+    # Pub/sub across machines through Redis. Needs the redis package.
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    def publish(self, channel, message):
+        self._redis.publish(channel, _encode(message))
+
+    def listen(self, channel):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel)
+        try:
+            for item in pubsub.listen():
+                if item.get('type') == 'message':
+                    message = _decode(item['data'], channel)
+                    if message is not None:
+                        yield message
+        finally:
+            pubsub.close()
+
+def create_bus(url):
+    # '' (single process), memory://, unix:///path/to/dir or redis://host:port/db
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return InProcessBus()
+    if url.startswith('unix://'):
+        return UnixSocketBus(url[len('unix://'):])
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBus(url)
+    raise ValueError(f"Unsupported message bus URL: {url}")
+
+class BusChannel:
+    # One component's messages on a bus channel, tagged with the sending
+    # worker so each worker skips its own. bus may be None (one process),
+    # in which case publish() does nothing. When the bus drops the
+    # subscription (Redis restarts, a socket error) listening resubscribes
+    # after retry_delay, doubling up to max_retry_delay while it keeps
+    # failing; stats() counts those failures so a deaf worker shows up in
+    # /metrics.
+    def __init__(self, bus, channel, retry_delay=0.5, max_retry_delay=30.0):
+        self.bus = bus
+        self.channel = channel
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._published = 0
+        self._publish_errors = 0
+        self._received = 0
+        self._listen_errors = 0
+        self._handler_errors = 0
+
+    def publish(self, payload):
+        # Never raises: receivers make up for a lost message through their
+        # ttl or the next snapshot
+        if self.bus is None:
+            return
+        try:
+            self.bus.publish(self.channel, dict(payload, worker=self.worker_id))
+        except Exception as e:
+            print(f"Error publishing to {self.channel}: {e}")
+            with self._lock:
+                self._publish_errors += 1
+            return
+        with self._lock:
+            self._published += 1
+
+    def messages(self):
+        # Every message on the channel, this worker's included, for as long
+        # as the process runs
+        delay = self.retry_delay
+        while True:
+            try:
+                for message in self.bus.listen(self.channel):
+                    delay = self.retry_delay
+                    with self._lock:
+                        self._received += 1
+                    yield message
+                reason = 'subscription ended'
+            except Exception as e:
+                reason = repr(e)
+            with self._lock:
+                self._listen_errors += 1
+            print(f"Lost bus channel {self.channel} ({reason}); resubscribing in {delay:g}s")
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+    def listen(self, handler):
+        # Blocking loop calling handler(message) with every other worker's
+        # messages; run it as a background task. A message the handler
+        # can't apply is logged and skipped.
+        for message in self.messages():
+            if message.get('worker') == self.worker_id:
+                continue
+            try:
+                handler(message)
+            except Exception as e:
+                print(f"Error applying {self.channel} message: {e!r}")
+                with self._lock:
+                    self._handler_errors += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'published': self._published,
+                'publish_errors': self._publish_errors,
+                'received': self._received,
+                'listen_errors': self._listen_errors,
+                'handler_errors': self._handler_errors,
+            }
+
+class BusClientManager(socketio.PubSubManager):
+    # Socket.IO client manager that relays emits, room changes and
+    # disconnects between workers over any of the buses above
+    name = 'bus'
+
+    def __init__(self, bus, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = bus
+        # Only for its reconnecting listen loop; Socket.IO tags and filters
+        # messages by host_id itself
+        self.bus_channel = BusChannel(bus, channel)
+
+    def _publish(self, data):
+        self.bus.publish(self.channel, data)
+
+    def _listen(self):
+        yield from self.bus_channel.messages()
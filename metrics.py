@@ -0,0 +1,215 @@
+from bisect import bisect_left
+from functools import wraps
+import re
+import threading
+import time
+
+# Request latency, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Queries run by one request; a route sitting in the high buckets is an N+1
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+_STRINGS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"%s|%\(\w+\)s")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+def normalize_sql(sql):
+    # Same shape for every call of a statement: literals and placeholders
+    # become ?, IN lists of any length become (...), whitespace collapses
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode(errors='replace')
+    sql = _STRINGS.sub('?', sql)
+    sql = _PLACEHOLDERS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = _LISTS.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    # Per-route and per-Socket.IO-event numbers for /metrics, in the
+    # Prometheus text format. Each request or event is a scope (begin/end,
+    # or the event() decorator); queries reported by the database layer
+    # through record_query() are added to the scope running on the current
+    # green thread, or to 'background' outside any. Statements slower than
+    # slow_query_time are printed in normalized form. Other components
+    # contribute gauges through add_collector(), and can follow scopes
+    # through add_listener().
+    def __init__(self, slow_query_time=0.2, prefix='vibesphere'):
+        self.slow_query_time = slow_query_time
+        self.prefix = prefix
+        self._local = threading.local()
+        # thread (green thread once monkey patched) ident -> 'kind name' of
+        # the scope it is running, for scope_of()
+        self._active = {}
+        self._lock = threading.Lock()
+        # (kind, name, method, status) -> latency histogram
+        self._latency = {}
+        # (kind, name) -> queries-per-scope histogram
+        self._query_counts = {}
+        # (kind, name) -> [queries, seconds, rows, slow queries]
+        self._db = {}
+        # name -> callable returning {field: number} or a list of such dicts
+        # with a 'name' entry
+        self._collectors = {}
+        # objects with scope_started(kind, name) and scope_ended(), called on
+        # the scope's own green thread
+        self._listeners = []
+
+    def begin(self, kind, name):
+        self._local.scope = [kind, name, time.monotonic(), 0, 0.0, 0, 0]
+        self._active[threading.get_ident()] = f"{kind} {name}"
+        for listener in self._listeners:
+            listener.scope_started(kind, name)
+
+    def end(self, method='', status=''):
+        scope = getattr(self._local, 'scope', None)
+        if scope is None:
+            return
+        self._local.scope = None
+        self._active.pop(threading.get_ident(), None)
+        for listener in self._listeners:
+            listener.scope_ended()
+        kind, name, started, queries, seconds, rows, slow = scope
+        key = (kind, name)
+        with self._lock:
+            self._latency.setdefault((kind, name, method, str(status)), _Histogram(LATENCY_BUCKETS)) \
+                .observe(time.monotonic() - started)
+            self._query_counts.setdefault(key, _Histogram(QUERY_COUNT_BUCKETS)).observe(queries)
+            totals = self._db.setdefault(key, [0, 0.0, 0, 0])
+            totals[0] += queries
+            totals[1] += seconds
+            totals[2] += rows
+            totals[3] += slow
+
+    def event(self, name):
+        # Decorator timing a Socket.IO handler as a scope
+        def decorator(handler):
+            @wraps(handler)
+            def wrapper(*args, **kwargs):
+                self.begin('event', name)
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    self.end()
+            return wrapper
+        return decorator
+
+    def scope_of(self, ident):
+        # The route or event the given thread ident is serving, if any
+        return self._active.get(ident)
+
+    def record_query(self, sql, seconds, rows):
+        # Called by the database layer once a statement and its fetches are done
+        slow = seconds >= self.slow_query_time
+        scope = getattr(self._local, 'scope', None)
+        if scope is not None:
+            scope[3] += 1
+            scope[4] += seconds
+            scope[5] += rows
+            scope[6] += slow
+            where = f"{scope[0]} {scope[1]}"
+        else:
+            with self._lock:
+                totals = self._db.setdefault(('background', ''), [0, 0.0, 0, 0])
+                totals[0] += 1
+                totals[1] += seconds
+                totals[2] += rows
+                totals[3] += slow
+            where = 'background'
+        if slow:
+            print(f"Slow query ({seconds * 1000:.0f} ms, {rows} rows, {where}): {normalize_sql(sql)}")
+
+    def summary(self):
+        # (kind, name) -> scopes finished, queries and DB seconds so far; two
+        # snapshots diffed give the numbers for a stretch of time
+        with self._lock:
+            return {key: {'count': self._query_counts[key].count, 'queries': totals[0], 'db_seconds': totals[1]}
+                    for key, totals in self._db.items() if key in self._query_counts}
+
+    def add_collector(self, name, collect):
+        self._collectors[name] = collect
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def render(self):
+        lines = []
+        p = self.prefix
+
+        def labels(**values):
+            return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in values.items()) + '}'
+
+        with self._lock:
+            latency = {key: (list(h.counts), h.sum, h.count) for key, h in self._latency.items()}
+            query_counts = {key: (list(h.counts), h.sum, h.count) for key, h in self._query_counts.items()}
+            db = {key: list(totals) for key, totals in self._db.items()}
+
+        lines.append(f"# HELP {p}_request_duration_seconds Time to handle a request or Socket.IO event")
+        lines.append(f"# TYPE {p}_request_duration_seconds histogram")
+        for (kind, name, method, status), histogram in sorted(latency.items()):
+            _histogram_lines(lines, f"{p}_request_duration_seconds", LATENCY_BUCKETS, histogram,
+                             dict(kind=kind, route=name, method=method, status=status), labels)
+
+        lines.append(f"# HELP {p}_db_queries_per_request Queries run by one request or event")
+        lines.append(f"# TYPE {p}_db_queries_per_request histogram")
+        for (kind, name), histogram in sorted(query_counts.items()):
+            _histogram_lines(lines, f"{p}_db_queries_per_request", QUERY_COUNT_BUCKETS, histogram,
+                             dict(kind=kind, route=name), labels)
+
+        for index, (metric, help_text) in enumerate((
+                ('db_queries_total', 'Statements executed'),
+                ('db_query_seconds_total', 'Time spent executing statements and fetching their rows'),
+                ('db_rows_total', 'Rows fetched'),
+                ('db_slow_queries_total', 'Statements slower than the slow query threshold'))):
+            lines.append(f"# HELP {p}_{metric} {help_text}")
+            lines.append(f"# TYPE {p}_{metric} counter")
+            for (kind, name), totals in sorted(db.items()):
+                lines.append(f"{p}_{metric}{labels(kind=kind, route=name)} {_number(totals[index])}")
+
+        for collector, collect in sorted(self._collectors.items()):
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Error collecting {collector} metrics: {e}")
+                continue
+            for item in values if isinstance(values, list) else [values]:
+                extra = {'name': item['name']} if 'name' in item else {}
+                for field, value in sorted(item.items()):
+                    if isinstance(value, bool):
+                        value = int(value)
+                    if isinstance(value, (int, float)):
+                        lines.append(f"{p}_{collector}_{field}{labels(**extra) if extra else ''} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+def _histogram_lines(lines, metric, buckets, histogram, values, labels):
+    counts, total, count = histogram
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        lines.append(f"{metric}_bucket{labels(**values, le=_number(bound))} {cumulative}")
+    lines.append(f"{metric}_bucket{labels(**values, le='+Inf')} {count}")
+    lines.append(f"{metric}_sum{labels(**values)} {_number(total)}")
+    lines.append(f"{metric}_count{labels(**values)} {count}")
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,5 @@
+def inline(function, *args):
+    # Default offload for the classes that take one (PasswordHasher,
+    # MediaStore, ImagePipeline): run the work on the calling thread. The
+    # app passes eventlet.tpool.execute instead.
+    return function(*args)
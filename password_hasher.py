@@ -0,0 +1,52 @@
+from offload import inline
+from werkzeug.security import generate_password_hash, check_password_hash
+import threading
+import time
+
+class PasswordHasher:
+    # Password hashing kept off the event loop. Hashes are deliberately slow
+    # (hundreds of ms of CPU); run inline they would stall every green
+    # thread in the process, chat sockets included. offload runs the work
+    # on a native thread, e.g. eventlet.tpool.execute (hashlib releases the
+    # GIL, so several hashes really run in parallel), and at most workers
+    # hashes run at once so logins can't take every CPU.
+    #
+    # method is a full werkzeug method string with its work factor, e.g.
+    # 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'. Hashes made with any
+    # other method still verify; needs_rehash() tells login to upgrade them.
+    def __init__(self, method='pbkdf2:sha256:600000', workers=4, offload=None):
+        self.method = method
+        self.offload = offload or inline
+        # Green under monkey patching, so waiting for a slot only parks the
+        # calling request
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._count = 0
+        self._seconds = 0.0
+
+    def _run(self, function, *args):
+        with self._slots:
+            started = time.monotonic()
+            try:
+                return self.offload(function, *args)
+            finally:
+                with self._lock:
+                    self._count += 1
+                    self._seconds += time.monotonic() - started
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # The stored hash is '<method>$<salt>$<hash>'
+        return password_hash.split('$', 1)[0] != self.method
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hashes': self._count,
+                'average_ms': round(1000 * self._seconds / self._count, 1) if self._count else 0.0,
+            }
@@ -0,0 +1,217 @@
+from mysql.connector import Error
+from message_bus import BusChannel
+import threading
+import time
+
+class PresenceManager:
+    # Tracks which users are online from their Socket.IO connections. A user
+    # is online while they have at least one live sid (tab). Going offline
+    # waits out a grace period so reloads and flaky networks don't flap, and
+    # is_online/last_seen changes are written to MySQL in periodic batches.
+    #
+    # With a message bus (see message_bus.py) several workers share one view:
+    # each publishes its users coming and going plus a periodic snapshot, and
+    # a user is only announced/written offline once no worker has them.
+    def __init__(self, db, grace_period=5.0, heartbeat_timeout=90.0,
+                 bus=None, snapshot_interval=10.0, channel='presence'):
+        self.db = db
+        self.grace_period = grace_period
+        self.heartbeat_timeout = heartbeat_timeout
+        self.snapshot_interval = snapshot_interval
+        self.channel = BusChannel(bus, channel)
+        self._lock = threading.Lock()
+        # worker_id -> _RemoteWorker, for the other workers on the bus
+        self._remote = {}
+        self._last_snapshot = 0.0
+        self._snapshot_epoch = 0
+        # user_id -> set of sids
+        self._sids = {}
+        # sid -> user_id
+        self._sid_users = {}
+        # sid -> last connect/heartbeat (monotonic)
+        self._heartbeats = {}
+        # user_id -> when their last sid went away, until the grace expires
+        self._leaving = {}
+        # user_id -> online, final state waiting for the next flush
+        self._dirty = {}
+        self._flushes = 0
+
+    def connect(self, user_id, sid):
+        # Returns True if the user just came online and should be announced
+        now = time.monotonic()
+        with self._lock:
+            if sid in self._sid_users:
+                self._heartbeats[sid] = now
+                return False
+            sids = self._sids.setdefault(user_id, set())
+            was_online = bool(sids) or self._leaving.pop(user_id, None) is not None
+            sids.add(sid)
+            self._sid_users[sid] = user_id
+            self._heartbeats[sid] = now
+            if was_online:
+                return False
+            online_elsewhere = self._online_remotely(user_id)
+            if not online_elsewhere:
+                self._dirty[user_id] = True
+        self.channel.publish({'type': 'delta', 'user_id': user_id, 'online': True})
+        return not online_elsewhere
+
+    def heartbeat(self, user_id, sid):
+        # A heartbeat from a sid we expired re-registers it
+        return self.connect(user_id, sid)
+
+    def disconnect(self, sid):
+        with self._lock:
+            self._drop(sid, time.monotonic())
+
+    def _drop(self, sid, now):
+        user_id = self._sid_users.pop(sid, None)
+        self._heartbeats.pop(sid, None)
+        if user_id is None:
+            return
+        sids = self._sids.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids[user_id]
+                self._leaving[user_id] = now
+
+    def tick(self):
+        # Expire silent sids and finish users whose grace period ran out.
+        # Returns the user ids that went offline everywhere so they can be
+        # announced.
+        now = time.monotonic()
+        with self._lock:
+            for sid, seen in list(self._heartbeats.items()):
+                if now - seen > self.heartbeat_timeout:
+                    self._drop(sid, now)
+
+            left = [user_id for user_id, since in self._leaving.items()
+                    if now - since >= self.grace_period]
+            for user_id in left:
+                del self._leaving[user_id]
+            offline = [user_id for user_id in left if not self._online_remotely(user_id)]
+            offline += self._expire_workers(now)
+            for user_id in offline:
+                self._dirty[user_id] = False
+
+        for user_id in left:
+            self.channel.publish({'type': 'delta', 'user_id': user_id, 'online': False})
+        if self.channel.bus is not None and now - self._last_snapshot >= self.snapshot_interval:
+            self._publish_snapshot(now)
+        return offline
+
+    def flush(self):
+        # Write all pending state changes in at most two statements
+        with self._lock:
+            batch, self._dirty = self._dirty, {}
+        if not batch:
+            return 0
+
+        online = [user_id for user_id, is_online in batch.items() if is_online]
+        offline = [user_id for user_id, is_online in batch.items() if not is_online]
+        try:
+            with self.db.connection() as connection:
+                cursor = connection.cursor()
+                if online:
+                    placeholders = ", ".join(["%s"] * len(online))
+                    cursor.execute(f"UPDATE users SET is_online = TRUE WHERE id IN ({placeholders})",
+                                   tuple(online))
+                if offline:
+                    placeholders = ", ".join(["%s"] * len(offline))
+                    cursor.execute(f"UPDATE users SET is_online = FALSE, last_seen = NOW() WHERE id IN ({placeholders})",
+                                   tuple(offline))
+                connection.commit()
+        except Error:
+            # Keep anything newer that arrived while we were writing
+            with self._lock:
+                for user_id, is_online in batch.items():
+                    self._dirty.setdefault(user_id, is_online)
+            raise
+
+        with self._lock:
+            self._flushes += 1
+        return len(batch)
+
+    def is_online(self, user_id):
+        with self._lock:
+            return (user_id in self._sids or user_id in self._leaving
+                    or self._online_remotely(user_id))
+
+    def _online_remotely(self, user_id):
+        return any(user_id in worker.users for worker in self._remote.values())
+
+    def _expire_workers(self, now):
+        # Forget workers that stopped publishing (crashed or shut down) and
+        # return their users that are not online anywhere else. Only the
+        # lowest worker id does this, so the offline is written once.
+        expired = [worker_id for worker_id, worker in self._remote.items()
+                   if now - worker.seen > 3 * self.snapshot_interval]
+        if not expired:
+            return []
+        orphaned = set()
+        for worker_id in expired:
+            orphaned |= self._remote.pop(worker_id).users
+        if any(worker_id < self.channel.worker_id for worker_id in self._remote):
+            return []
+        return [user_id for user_id in orphaned
+                if user_id not in self._sids and user_id not in self._leaving
+                and not self._online_remotely(user_id)]
+
+    def _publish_snapshot(self, now, chunk_size=5000):
+        # Users still in their grace period count as online; chunked so a
+        # snapshot fits in one message on every bus
+        with self._lock:
+            users = list(self._sids) + list(self._leaving)
+            self._snapshot_epoch += 1
+            epoch = self._snapshot_epoch
+            self._last_snapshot = now
+        chunks = [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)] or [[]]
+        for index, chunk in enumerate(chunks):
+            self.channel.publish({'type': 'snapshot', 'epoch': epoch, 'users': chunk,
+                           'last': index == len(chunks) - 1})
+
+    def receive(self, message):
+        # Another worker's update, from channel.listen()
+        worker_id = message.get('worker')
+        if worker_id is None or worker_id == self.channel.worker_id:
+            return
+        with self._lock:
+            worker = self._remote.get(worker_id)
+            if worker is None:
+                worker = self._remote[worker_id] = _RemoteWorker()
+            worker.seen = time.monotonic()
+            if message['type'] == 'delta':
+                if message['online']:
+                    worker.users.add(message['user_id'])
+                    worker.building.add(message['user_id'])
+                else:
+                    worker.users.discard(message['user_id'])
+                    worker.building.discard(message['user_id'])
+            elif message['type'] == 'snapshot':
+                if message['epoch'] != worker.epoch:
+                    worker.epoch = message['epoch']
+                    worker.building = set()
+                worker.building.update(message['users'])
+                if message['last']:
+                    worker.users, worker.building = worker.building, set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'online_users': len(self._sids) + len(self._leaving),
+                'connections': len(self._sid_users),
+                'pending_writes': len(self._dirty),
+                'flushes': self._flushes,
+                'remote_workers': len(self._remote),
+                'remote_online_users': len(set().union(*(worker.users for worker in self._remote.values()))),
+            }
+
+class _RemoteWorker:
+    # What one other worker last told us about its online users
+    def __init__(self):
+        self.users = set()
+        # Snapshot chunks collected so far for epoch
+        self.building = set()
+        self.epoch = None
+        self.seen = time.monotonic()
@@ -0,0 +1,124 @@
+# The hot read statements, shared by app.py, the caches and
+# check_query_plans.py so the plans checked are the plans production runs.
+# Statements whose shape depends on the request are built by the functions
+# below; the comment on each lists its parameters in order.
+
+# username or email
+LOGIN_BY = {
+    column: f"SELECT id, username, profile_picture, password_hash FROM users WHERE {column} = %s"
+    for column in ('username', 'email')
+}
+
+def feed_page(after):
+    # Keyset pagination on (created_at, id): each page is an index range
+    # scan that stops at the LIMIT, however deep the viewer scrolls.
+    # [created_at, created_at, id if after,] limit
+    query = "SELECT p.* FROM posts p"
+    if after:
+        query += " WHERE (p.created_at < %s OR (p.created_at = %s AND p.id < %s))"
+    return query + " ORDER BY p.created_at DESC, p.id DESC LIMIT %s"
+
+def comment_previews(post_count):
+    # Latest comments of post_count posts in one round-trip. Each branch is
+    # a bounded range read on comments(post_id, ...), so a post with
+    # thousands of comments costs the same as one with three.
+    # (post_id, per_post) for each post
+    branch = """
+        (SELECT c.*
+        FROM comments c
+        WHERE c.post_id = %s
+        ORDER BY c.created_at DESC, c.id DESC
+        LIMIT %s)
+    """
+    return " UNION ALL ".join([branch] * post_count)
+
+def comments_page(after):
+    # post_id, [created_at, created_at, id if after,] limit
+    query = """
+        SELECT c.*
+        FROM comments c
+        WHERE c.post_id = %s
+    """
+    if after:
+        query += " AND (c.created_at < %s OR (c.created_at = %s AND c.id < %s))"
+    return query + " ORDER BY c.created_at DESC, c.id DESC LIMIT %s"
+
+# user_id
+PROFILE_POSTS = """
+    SELECT p.*
+    FROM posts p
+    WHERE p.user_id = %s
+    ORDER BY p.created_at DESC
+"""
+
+# user_id
+PROFILE_USER = """
+    SELECT username, email, profile_picture, profile_picture_variants, bio, created_at
+    FROM users WHERE id = %s
+"""
+
+# Everyone but the viewer, read in username index order: user_id, limit
+CHAT_USERS = """
+    SELECT id, username, profile_picture, is_online, last_seen
+    FROM users
+    WHERE id != %s
+    ORDER BY username
+    LIMIT %s
+"""
+
+# The viewer's chats. Last message and unread count are stored on the
+# session row, so this is one index lookup per side of the session whatever
+# the history length: user_id, user_id, user_id
+CHAT_SESSIONS = """
+    SELECT cs.*, cs.user2_id as other_user_id,
+    cs.last_message_preview as last_message, cs.last_message_at as last_message_time,
+    cs.user1_unread as unread_count
+    FROM chat_sessions cs
+    WHERE cs.user1_id = %s
+    UNION ALL
+    SELECT cs.*, cs.user1_id as other_user_id,
+    cs.last_message_preview as last_message, cs.last_message_at as last_message_time,
+    cs.user2_unread as unread_count
+    FROM chat_sessions cs
+    WHERE cs.user2_id = %s AND cs.user1_id != %s
+    ORDER BY updated_at DESC
+"""
+
+# A chat the viewer takes part in: chat_session_id, user_id, user_id
+CHAT_SESSION_FOR_USER = """
+    SELECT id, user1_id, user2_id, user1_last_read_id, user2_last_read_id
+    FROM chat_sessions
+    WHERE id = %s AND (user1_id = %s OR user2_id = %s)
+"""
+
+def messages_page(before):
+    # Newest first, walking (chat_session_id, id):
+    # chat_session_id, [before_id if before,] limit
+    query = """
+        SELECT m.id, m.chat_session_id, m.sender_id, m.message_text, m.created_at
+        FROM messages m
+        WHERE m.chat_session_id = %s
+    """
+    if before:
+        query += " AND m.id < %s"
+    return query + " ORDER BY m.id DESC LIMIT %s"
+
+# Either order of the pair: user_id, other_id, other_id, user_id
+CHAT_BETWEEN = """
+    SELECT id, user1_id, user2_id FROM chat_sessions
+    WHERE (user1_id = %s AND user2_id = %s) OR (user1_id = %s AND user2_id = %s)
+"""
+
+# Ordered by the unique_like index, so the rows arrive sorted:
+# user_id, limit
+LIKED_POSTS = "SELECT post_id FROM likes WHERE user_id = %s ORDER BY post_id LIMIT %s"
+
+def liked_among(post_count):
+    # user_id, then post_count post ids
+    placeholders = ", ".join(["%s"] * post_count)
+    return f"SELECT post_id FROM likes WHERE user_id = %s AND post_id IN ({placeholders})"
+
+def user_profiles(fields, user_count):
+    # user_count user ids
+    placeholders = ", ".join(["%s"] * user_count)
+    return f"SELECT id, {', '.join(fields)} FROM users WHERE id IN ({placeholders})"
@@ -0,0 +1,193 @@
+from contextlib import contextmanager
+from media_store import sync_file
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+class UploadError(Exception):
+    # status is the HTTP status the route should answer with
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+class ResumableUploads:
+    # Chunked uploads that survive dropped connections. A client creates an
+    # upload (filename + total size), PUTs the bytes in order with the
+    # offset it believes the server has, asks for the current offset after a
+    # failure and continues from there, then finalizes. Each upload is a
+    # .part file plus a small .json record next to it, on the media store's
+    # filesystem, so finalizing is a rename into the store rather than a copy.
+    # Only the current chunk buffer is held in memory, whatever the file size.
+    def __init__(self, media_store, max_size=512 * 1024 * 1024, read_size=64 * 1024):
+        self.store = media_store
+        self.max_size = max_size
+        self.read_size = read_size
+        self.directory = os.path.join(media_store.work_dir, 'incoming')
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # upload_id -> lock, so retried chunks of one upload don't interleave
+        self._upload_locks = {}
+        # upload_id -> (offset, sha256) for uploads received in order by this
+        # process, so finalizing doesn't have to read the file back
+        self._hashers = {}
+
+    def _paths(self, upload_id):
+        # Ids are generated by us; anything else can't name a file
+        if len(upload_id) != 32 or not all(c in '0123456789abcdef' for c in upload_id):
+            raise UploadError('Upload not found', 404)
+        base = os.path.join(self.directory, upload_id)
+        return base + '.json', base + '.part'
+
+    @contextmanager
+    def _locked(self, upload_id, user_id):
+        # Serializes work on one upload and yields its record. The id and
+        # owner are checked before a lock is made, so made-up ids and other
+        # users' uploads leave nothing behind; finalize and _discard drop
+        # the lock again.
+        self._read_record(upload_id, user_id)
+        with self._lock:
+            lock = self._upload_locks.setdefault(upload_id, threading.Lock())
+        with lock:
+            yield self._read_record(upload_id, user_id)
+
+    def _read_record(self, upload_id, user_id):
+        record_path, part_path = self._paths(upload_id)
+        try:
+            with open(record_path) as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            raise UploadError('Upload not found', 404)
+        if record['user_id'] != user_id:
+            raise UploadError('Upload not found', 404)
+        record['offset'] = os.path.getsize(part_path) if record.get('media_path') is None else record['size']
+        return record
+
+    def _write_record(self, upload_id, record):
+        record_path, _ = self._paths(upload_id)
+        temp_path = record_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({key: value for key, value in record.items() if key != 'offset'}, f)
+        os.replace(temp_path, record_path)
+
+    def create(self, user_id, extension, size):
+        if size <= 0 or size > self.max_size:
+            raise UploadError(f"File must be between 1 byte and {self.max_size} bytes", 413)
+        upload_id = uuid.uuid4().hex
+        _, part_path = self._paths(upload_id)
+        open(part_path, 'wb').close()
+        record = {'user_id': user_id, 'extension': extension, 'size': size,
+                  'created_at': time.time(), 'media_path': None}
+        self._write_record(upload_id, record)
+        with self._lock:
+            self._hashers[upload_id] = (0, hashlib.sha256())
+        return upload_id
+
+    def status(self, upload_id, user_id):
+        record = self._read_record(upload_id, user_id)
+        return {'upload_id': upload_id, 'offset': record['offset'], 'size': record['size'],
+                'finalized': record['media_path'] is not None}
+
+    def write(self, upload_id, user_id, offset, stream, length):
+        # Append length bytes from stream at offset, which must be where the
+        # file currently ends. Bytes received before a dropped connection are
+        # kept, so the client resumes from whatever status() reports.
+        with self._locked(upload_id, user_id) as record:
+            if record['media_path'] is not None:
+                raise UploadError('Upload already finalized', 409, record['offset'])
+            if offset != record['offset']:
+                raise UploadError('Offset does not match', 409, record['offset'])
+            if offset + length > record['size']:
+                raise UploadError('Chunk goes past the declared size', 413, record['offset'])
+
+            with self._lock:
+                hasher = self._hashers.get(upload_id)
+            if hasher is not None and hasher[0] != offset:
+                hasher = None
+
+            _, part_path = self._paths(upload_id)
+            received = 0
+            with open(part_path, 'ab') as part:
+                while received < length:
+                    chunk = stream.read(min(self.read_size, length - received))
+                    if not chunk:
+                        break
+                    part.write(chunk)
+                    if hasher is not None:
+                        hasher[1].update(chunk)
+                    received += len(chunk)
+
+            with self._lock:
+                if hasher is not None:
+                    self._hashers[upload_id] = (offset + received, hasher[1])
+                else:
+                    self._hashers.pop(upload_id, None)
+            return offset + received
+
+    def finalize(self, upload_id, user_id):
+        # Move the complete file into the media store; calling it again
+        # returns the same path
+        with self._locked(upload_id, user_id) as record:
+            if record['media_path'] is not None:
+                return record['media_path']
+            if record['offset'] != record['size']:
+                raise UploadError('Upload is incomplete', 409, record['offset'])
+
+            _, part_path = self._paths(upload_id)
+            self.store.offload(sync_file, part_path)
+            with self._lock:
+                hasher = self._hashers.pop(upload_id, None)
+            digest = hasher[1] if hasher is not None and hasher[0] == record['size'] else None
+            record['media_path'] = self.store.adopt(part_path, record['extension'], digest)
+            self._write_record(upload_id, record)
+            # Nothing is written to a finalized upload any more
+            with self._lock:
+                self._upload_locks.pop(upload_id, None)
+            return record['media_path']
+
+    @contextmanager
+    def claim(self, upload_id, user_id):
+        # Hand a finalized upload to a post exactly once:
+        #     with uploads.claim(upload_id, user_id) as (media_path, extension):
+        #         ...insert and commit the post...
+        # The upload is only used up if the block completes, so a failed
+        # insert can be retried with the same upload_id.
+        with self._locked(upload_id, user_id) as record:
+            if record['media_path'] is None:
+                raise UploadError('Upload is not finalized', 409, record['offset'])
+            yield record['media_path'], record['extension']
+            self._discard(upload_id)
+
+    def _discard(self, upload_id):
+        for path in self._paths(upload_id):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+            self._upload_locks.pop(upload_id, None)
+
+    def cleanup(self, max_age=24 * 3600):
+        # Drop uploads abandoned for max_age seconds
+        cutoff = time.time() - max_age
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            upload_id = entry.name[:-len('.json')]
+            try:
+                _, part_path = self._paths(upload_id)
+                last_write = max(entry.stat().st_mtime, os.path.getmtime(part_path))
+            except (OSError, UploadError):
+                last_write = 0
+            if last_write < cutoff:
+                try:
+                    self._discard(upload_id)
+                    removed += 1
+                except UploadError:
+                    pass
+        return removed
@@ -0,0 +1,192 @@
+from collections import deque
+from eventlet import patcher
+import greenlet
+import os
+import random
+import sys
+import time
+
+# Real OS threads and locks, untouched by monkey patching
+_threading = patcher.original('threading')
+_time = patcher.original('time')
+
+class ProfilerError(Exception):
+    # status is the HTTP status the admin route should answer with
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class SamplingProfiler:
+    # Statistical profiler for live traffic, off until an admin switches it
+    # on for a bounded window. While on, each request or Socket.IO event
+    # that starts (scope_started, called by metrics) is picked with the
+    # given probability, optionally only for one route/event or one user.
+    # A native thread wakes every interval seconds and records the stack of
+    # every picked green thread: the frames it is running if it holds the
+    # hub, or the frames it is parked in (a query, a lock) under a
+    # '[waiting]' leaf otherwise, so the result is wall-clock time. Nothing
+    # is traced per call, so the requests being profiled run at full speed.
+    #
+    # When the window ends (or stop()), samples are written to output_dir
+    # in the collapsed-stack format, one 'route feed;frame;frame count' line
+    # per distinct stack, which flamegraph.pl and speedscope both read.
+    def __init__(self, output_dir, interval=0.01, max_duration=300, max_targets=200,
+                 max_stacks=50000, user_of=None):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_duration = max_duration
+        self.max_targets = max_targets
+        self.max_stacks = max_stacks
+        self.user_of = user_of or (lambda: None)
+        self._lock = _threading.Lock()
+        self._hub_thread = None
+        self._session = None
+        # id(greenlet) -> (greenlet, label) being sampled
+        self._targets = {}
+        # code object -> frame name, so samples don't format the same frame twice
+        self._names = {}
+        self._files = deque(maxlen=10)
+        self._sessions = 0
+
+    def start(self, duration, fraction=1.0, route=None, user_id=None):
+        # Call from a request; the hub runs on the calling thread
+        if not 0 < duration <= self.max_duration:
+            raise ProfilerError(f"duration must be between 0 and {self.max_duration} seconds")
+        if not 0 < fraction <= 1:
+            raise ProfilerError('fraction must be between 0 and 1')
+        with self._lock:
+            if self._session is not None:
+                raise ProfilerError('Profiler is already running', 409)
+            self._hub_thread = _threading.get_ident()
+            self._targets = {}
+            self._session = session = {
+                'fraction': fraction,
+                'route': route,
+                'user_id': user_id,
+                'started': time.time(),
+                'deadline': _time.monotonic() + duration,
+                'requests': 0,
+                'samples': 0,
+                'stacks': {},
+            }
+            self._sessions += 1
+        _threading.Thread(target=self._sample, args=(session,), name='sampling-profiler', daemon=True).start()
+        return self.status()
+
+    def stop(self):
+        # End the window early; returns the file written, if any
+        with self._lock:
+            session = self._session
+        if session is None:
+            raise ProfilerError('Profiler is not running', 409)
+        return self._finish(session)
+
+    def scope_started(self, kind, name):
+        session = self._session
+        if session is None or len(self._targets) >= self.max_targets:
+            return
+        route = session['route']
+        if route is not None and route not in (name, f"{kind} {name}"):
+            return
+        if session['user_id'] is not None and self.user_of() != session['user_id']:
+            return
+        if random.random() >= session['fraction']:
+            return
+        current = greenlet.getcurrent()
+        self._targets[id(current)] = (current, f"{kind} {name}")
+        session['requests'] += 1
+
+    def scope_ended(self):
+        if self._targets:
+            self._targets.pop(id(greenlet.getcurrent()), None)
+
+    def _sample(self, session):
+        while self._session is session:
+            _time.sleep(self.interval)
+            if _time.monotonic() >= session['deadline']:
+                self._finish(session)
+                return
+            frame = sys._current_frames().get(self._hub_thread)
+            with self._lock:
+                if self._session is not session:
+                    return
+                stacks = session['stacks']
+                for gr, label in list(self._targets.values()):
+                    if gr.dead:
+                        continue
+                    suspended = gr.gr_frame
+                    stack = self._collapse(label, suspended or frame, suspended is not None)
+                    if stack in stacks:
+                        stacks[stack] += 1
+                    elif len(stacks) < self.max_stacks:
+                        stacks[stack] = 1
+                    else:
+                        continue
+                    session['samples'] += 1
+
+    def _collapse(self, label, frame, waiting):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            name = self._names.get(code)
+            if name is None:
+                name = self._names[code] = (
+                    f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(';', ':'))
+            names.append(name)
+            frame = frame.f_back
+        names.append(label)
+        names.reverse()
+        if waiting:
+            names.append('[waiting]')
+        return ';'.join(names)
+
+    def _finish(self, session):
+        with self._lock:
+            if self._session is not session:
+                return None
+            self._session = None
+            self._targets = {}
+        if not session['stacks']:
+            print('Profiler stopped without samples')
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.folded")
+        try:
+            with open(path, 'w') as f:
+                for stack, count in sorted(session['stacks'].items()):
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            print(f"Error writing profile {path}: {e}")
+            return None
+        self._files.append(path)
+        print(f"Profile of {session['requests']} requests ({session['samples']} samples) written to {path}")
+        return path
+
+    def status(self):
+        session = self._session
+        status = {'running': session is not None, 'files': list(self._files)}
+        if session is not None:
+            status.update({
+                'fraction': session['fraction'],
+                'route': session['route'],
+                'user_id': session['user_id'],
+                'seconds_left': max(0.0, round(session['deadline'] - _time.monotonic(), 1)),
+                'requests': session['requests'],
+                'samples': session['samples'],
+            })
+        return status
+
+    def stats(self):
+        session = self._session
+        return {
+            'running': session is not None,
+            'sessions': self._sessions,
+            'samples': session['samples'] if session is not None else 0,
+        }
+
+def _short_path(filename):
+    # site-packages/flask/app.py -> flask/app.py, our modules by file name
+    marker = filename.rfind('-packages' + os.sep)
+    if marker != -1:
+        return filename[marker + len('-packages' + os.sep):]
+    return os.path.basename(filename)
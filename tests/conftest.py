@@ -0,0 +1,194 @@
+import os
+import sys
+from contextlib import contextmanager
+import pytest
+from mysql.connector import Error, errorcode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class FakeCursor:
+    def __init__(self, db, connection, dictionary=False):
+        self.db = db
+        self.connection = connection
+        self.dictionary = dictionary
+        self.rowcount = 0
+        self.lastrowid = None
+        self.with_rows = False
+        self.closed = False
+        self._rows = None
+
+    def execute(self, sql, params=(), multi=False):
+        sql = ' '.join(sql.split())
+        self.db.statements.append((sql, params))
+        self.db.hosts.append(self.connection.host)
+        self.connection.in_transaction = True
+        self.rowcount = 1
+        self.lastrowid = len(self.db.statements)
+        if self.db.on_execute:
+            self.db.on_execute(sql, params)
+        for pattern, rows in self.db.answers:
+            if pattern in sql:
+                rows = rows(sql, params) if callable(rows) else rows
+                self._rows = [self._shape(row) for row in rows]
+                break
+        else:
+            self._rows = None
+
+    def _shape(self, row):
+        if self.dictionary or not isinstance(row, dict):
+            return row
+        return tuple(row.values())
+
+    def fetchone(self):
+        if self._rows is not None:
+            return self._rows.pop(0) if self._rows else None
+        return self.db.results.pop(0) if self.db.results else None
+
+    def fetchall(self):
+        if self._rows is not None:
+            rows, self._rows = self._rows, []
+            return rows
+        return self.db.results.pop(0) if self.db.results else []
+
+    def close(self):
+        self.closed = True
+
+class FakeConnection:
+    # Stands in for a mysql.connector connection
+    def __init__(self, db, host='primary'):
+        self.db = db
+        self.host = host
+        self.in_transaction = False
+        self.pings = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self, dictionary=False, **kwargs):
+        return FakeCursor(self.db, self, dictionary)
+
+    def commit(self):
+        if self.db.on_commit:
+            self.db.on_commit()
+        if self.db.fail_commits:
+            self.db.fail_commits -= 1
+            raise Error(msg='Lost connection to MySQL server during query', errno=errorcode.CR_SERVER_LOST)
+        self.in_transaction = False
+        self.db.commits += 1
+
+    def rollback(self):
+        self.in_transaction = False
+        self.rollbacks += 1
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.db.fail_pings:
+            self.db.fail_pings -= 1
+            raise Error(msg='MySQL Connection not available', errno=errorcode.CR_SERVER_GONE_ERROR)
+
+    def close(self):
+        self.closed = True
+
+class FakeDatabase:
+    # Stands in for database.Database, or for the MySQL servers behind it
+    # (see the fake_mysql fixture). Every statement is recorded with the
+    # host it ran on. A statement containing a pattern from answers gets
+    # that pattern's rows (a list, or a function of sql and params);
+    # anything else is answered from results in order. The next
+    # fail_commits commits and fail_pings pings fail, as do connects to
+    # hosts in down.
+    def __init__(self):
+        self.statements = []
+        self.hosts = []
+        self.results = []
+        self.answers = []
+        self.commits = 0
+        self.fail_commits = 0
+        self.fail_pings = 0
+        self.down = set()
+        self.connections = []
+        self.on_execute = None
+        self.on_commit = None
+
+    def answer(self, pattern, rows):
+        self.answers.append((pattern, rows))
+
+    def connect(self, host='primary', **config):
+        if host in self.down:
+            raise Error(msg=f"Can't connect to MySQL server on '{host}'", errno=errorcode.CR_CONN_HOST_ERROR)
+        connection = FakeConnection(self, host)
+        self.connections.append(connection)
+        return connection
+
+    def executed(self, pattern):
+        return [(sql, params) for sql, params in self.statements if pattern in sql]
+
+    @contextmanager
+    def connection(self):
+        yield self.connect()
+
+class FakeClock:
+    # Replaces a module's time so tests can move time.monotonic() by hand
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def db():
+    return FakeDatabase()
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def fake_mysql(monkeypatch, db):
+    # Real ConnectionPool/Database code over fake servers: every
+    # mysql.connector.connect() goes to db
+    import database
+    monkeypatch.setattr(database.mysql.connector, 'connect', db.connect)
+    return db
+
+@pytest.fixture
+def app_module(fake_mysql, monkeypatch):
+    # The app with fresh caches over fake_mysql. Importing it monkey patches
+    # the process for eventlet, which the rest of the suite runs fine under.
+    import app as app_module
+    from chat_members import ChatMembershipCache
+    from feed_cache import FeedCache
+    from liked_index import LikedIndex
+    from user_cache import UserProfileCache
+    db = app_module.db
+    # Connections from an earlier test belong to its fake servers
+    db.pool.close_all()
+    monkeypatch.setattr(app_module, 'feed_cache', FeedCache())
+    monkeypatch.setattr(app_module, 'users_cache', UserProfileCache(db))
+    monkeypatch.setattr(app_module, 'liked_index', LikedIndex(db))
+    monkeypatch.setattr(app_module, 'chat_members', ChatMembershipCache(db))
+    yield app_module
+    db.pool.close_all()
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+@pytest.fixture
+def login(client):
+    def log_in(user_id=1, username='ana'):
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+            session['username'] = username
+    return log_in
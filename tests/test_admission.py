@@ -0,0 +1,62 @@
+import pytest
+import admission
+from admission import ConcurrencyLimit, Overloaded, RateLimiter
+
+def test_limit_turns_away_past_the_queue():
+    limit = ConcurrencyLimit('heavy_read', 1, 0, 0.01, 3)
+    with limit.admit():
+        with pytest.raises(Overloaded) as raised:
+            limit.acquire()
+    assert raised.value.retry_after == 3
+    assert limit.stats() == {'active': 0, 'waiting': 0, 'admitted': 1, 'rejected': 1}
+
+def test_queued_request_gives_up_after_the_timeout():
+    limit = ConcurrencyLimit('auth', 1, 5, 0.01, 2)
+    limit.acquire()
+    with pytest.raises(Overloaded):
+        limit.acquire()
+    assert limit.stats()['waiting'] == 0
+    limit.release()
+    with limit.admit():
+        assert limit.stats()['active'] == 1
+
+def test_rate_limiter_allows_a_burst_then_refills(monkeypatch, clock):
+    monkeypatch.setattr(admission, 'time', clock)
+    limiter = RateLimiter('likes', rate=2, burst=3)
+    for _ in range(3):
+        limiter.hit(1)
+    with pytest.raises(Overloaded) as raised:
+        limiter.hit(1)
+    assert raised.value.retry_after == 1
+    # Other users have their own bucket
+    limiter.hit(2)
+    clock.advance(0.5)
+    limiter.hit(1)
+    assert limiter.stats() == {'users': 2, 'limited': 1}
+
+def test_rate_limiter_forgets_the_oldest_users():
+    limiter = RateLimiter('likes', rate=1, burst=1, max_keys=2)
+    for user_id in (1, 2, 3):
+        limiter.hit(user_id)
+    # User 1 was forgotten and starts with a full bucket again
+    limiter.hit(1)
+    with pytest.raises(Overloaded):
+        limiter.hit(3)
+
+def test_full_class_gets_503_with_retry_after(app_module, client, monkeypatch):
+    monkeypatch.setitem(app_module.admission, 'auth', ConcurrencyLimit('auth', 0, 0, 0.01, 7))
+    response = client.post('/login', data={'username': 'ana', 'password': 'secret'},
+                           headers={'Accept': 'application/json'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
+    assert response.get_json() == {'error': 'Too many auth requests', 'retry_after': 7}
+    # Logout takes a connection to mark the user offline, so it waits too
+    assert client.get('/logout').status_code == 503
+
+def test_unclassified_routes_are_not_held_back(app_module, client, monkeypatch):
+    for name in list(app_module.admission):
+        monkeypatch.setitem(app_module.admission, name, ConcurrencyLimit(name, 0, 0, 0.01, 7))
+    assert client.get('/metrics').status_code != 503
+
+def test_default_limits_leave_room_for_background_jobs(app_module):
+    assert app_module.db_admitted + app_module.db_background < app_module.Config.DB_POOL_MAX_SIZE
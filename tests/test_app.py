@@ -0,0 +1,165 @@
+import os
+from datetime import datetime
+import pytest
+import database
+
+def chat_row(user1_last_read_id=None, user2_last_read_id=None):
+    return {'id': 5, 'user1_id': 1, 'user2_id': 2,
+            'user1_last_read_id': user1_last_read_id, 'user2_last_read_id': user2_last_read_id}
+
+def message_rows(*ids):
+    # Newest first, like the query
+    return [{'id': message_id, 'chat_session_id': 5, 'sender_id': 2, 'message_text': f"m{message_id}",
+             'created_at': datetime(2024, 1, 1, 12, 0)} for message_id in sorted(ids, reverse=True)]
+
+def serve_chat(db, chat, messages):
+    db.answer('FROM chat_sessions', [chat])
+    db.answer('FROM messages m', messages)
+    db.answer('FROM users WHERE id IN', [(2, 'bo', None, None)])
+
+def test_get_messages_marks_only_what_it_returned_read(client, login, db):
+    login()
+    # A replica that hasn't seen message 13 yet
+    serve_chat(db, chat_row(user1_last_read_id=10), message_rows(11, 12))
+    response = client.get('/get_messages/5')
+    assert [message['id'] for message in response.get_json()['messages']] == [11, 12]
+
+    (sql, params), = db.executed('UPDATE chat_sessions')
+    assert 'user1_last_read_id = %s' in sql
+    assert 'user1_unread = IF(last_message_id <= %s, 0, user1_unread)' in sql
+    assert 'user1_last_read_id IS NULL OR user1_last_read_id < %s' in sql
+    assert params == (12, 12, 5, 12)
+
+def test_get_messages_skips_the_write_when_already_read(client, login, db):
+    login()
+    serve_chat(db, chat_row(user1_last_read_id=12), message_rows(11, 12))
+    client.get('/get_messages/5')
+    assert db.executed('UPDATE chat_sessions') == []
+
+def test_get_messages_marks_a_never_read_chat(client, login, db):
+    login(2, 'bo')
+    serve_chat(db, chat_row(), message_rows(3))
+    client.get('/get_messages/5')
+    (sql, params), = db.executed('UPDATE chat_sessions')
+    assert 'user2_last_read_id = %s' in sql
+    assert params == (3, 3, 5, 3)
+
+def test_older_pages_and_empty_chats_mark_nothing(client, login, db):
+    login()
+    serve_chat(db, chat_row(), message_rows(1, 2))
+    client.get('/get_messages/5?before_id=3')
+    db.answers.clear()
+    serve_chat(db, chat_row(), [])
+    client.get('/get_messages/5')
+    assert db.executed('UPDATE chat_sessions') == []
+
+def test_writers_read_from_the_primary_for_a_moment(app_module, client, login, db, monkeypatch):
+    monkeypatch.setattr(database.Config, 'DB_REPLICA_HOSTS', 'replica1')
+    monkeypatch.setattr(app_module.db, 'replicas', database.Database().replicas)
+    login()
+    serve_chat(db, chat_row(user1_last_read_id=12), message_rows(11, 12))
+    client.get('/get_messages/5')
+    assert db.hosts[-1] == 'replica1'
+
+    db.answer('SELECT like_count FROM posts', [(3,)])
+    client.post('/like_post/7')
+    with client.session_transaction() as session:
+        assert session['pinned_until'] > 0
+    client.get('/get_messages/5')
+    assert db.hosts[-1] == database.Config.DB_HOST
+
+def test_socket_writers_are_pinned_on_the_worker(app_module, client, login, db, monkeypatch):
+    monkeypatch.setattr(database.Config, 'DB_REPLICA_HOSTS', 'replica1')
+    monkeypatch.setattr(app_module.db, 'replicas', database.Database().replicas)
+    app_module.db.pin(1)
+    login()
+    serve_chat(db, chat_row(user1_last_read_id=12), message_rows(11, 12))
+    client.get('/get_messages/5')
+    assert 'replica1' not in db.hosts
+
+@pytest.fixture
+def media_folder(app_module, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module.app, 'static_folder', str(tmp_path))
+    monkeypatch.setattr(app_module.Config, 'MEDIA_ACCEL_PREFIX', '')
+    monkeypatch.setitem(app_module.app.config, 'USE_X_SENDFILE', False)
+    return tmp_path
+
+def put_file(folder, relative, data):
+    path = folder / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+def test_media_serves_byte_ranges(client, media_folder):
+    put_file(media_folder, 'uploads/media/ab/cd/abcd.mp4', bytes(range(100)))
+    response = client.get('/media/uploads/media/ab/cd/abcd.mp4', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.data == bytes(range(10, 20))
+    assert response.headers['Content-Range'] == 'bytes 10-19/100'
+    assert 'immutable' in response.headers['Cache-Control']
+
+def test_media_never_serves_private_or_outside_paths(client, media_folder):
+    put_file(media_folder, 'uploads/media/tmp/half-written', b'partial')
+    put_file(media_folder, 'uploads/other/avatar.jpg', b'jpeg')
+    for path in ('uploads/media/tmp/half-written', 'uploads/media/ab/../tmp/half-written',
+                 'uploads/media//tmp/half-written', 'uploads/media/./tmp/half-written',
+                 'uploads/../config.py', 'static/uploads/other/avatar.jpg'):
+        assert client.get(f"/media/{path}").status_code == 404, path
+    assert client.get('/media/uploads/other/avatar.jpg').data == b'jpeg'
+
+def test_unfinished_uploads_live_outside_static(app_module):
+    static_folder = os.path.realpath(app_module.app.static_folder)
+    for directory in (app_module.media_store.temp_dir, app_module.uploads.directory):
+        assert not os.path.realpath(directory).startswith(static_folder + os.sep)
+
+@pytest.fixture
+def passwords(app_module, monkeypatch):
+    from password_hasher import PasswordHasher
+    hasher = PasswordHasher('pbkdf2:sha256:1000')
+    monkeypatch.setattr(app_module, 'passwords', hasher)
+    return hasher
+
+def serve_user(db, column, password_hash):
+    # Only the lookup by column finds ana
+    db.answer('FROM users WHERE', lambda sql, params: [
+        {'id': 1, 'username': 'ana', 'profile_picture': None, 'password_hash': password_hash}
+    ] if f"WHERE {column} = %s" in sql else [])
+
+def lookups(db):
+    return [sql.rsplit('WHERE ', 1)[1] for sql, _ in db.executed('FROM users WHERE')]
+
+def test_login_tries_one_column_at_a_time(client, db, passwords):
+    serve_user(db, 'username', passwords.hash('secret'))
+    response = client.post('/login', data={'username': 'ana', 'password': 'secret'})
+    assert response.status_code == 302
+    assert lookups(db) == ['username = %s']
+
+def test_login_with_an_at_sign_tries_email_first(client, db, passwords):
+    serve_user(db, 'username', passwords.hash('secret'))
+    # Usernames may contain an @ too
+    client.post('/login', data={'username': 'ana@home', 'password': 'secret'})
+    assert lookups(db) == ['email = %s', 'username = %s']
+
+def test_login_upgrades_old_hashes(client, db, passwords):
+    from password_hasher import PasswordHasher
+    serve_user(db, 'email', PasswordHasher('pbkdf2:sha256:500').hash('secret'))
+    client.post('/login', data={'username': 'ana@example.com', 'password': 'secret'})
+    (sql, params), = db.executed('UPDATE users SET is_online = TRUE')
+    assert 'password_hash = %s' in sql
+    assert not passwords.needs_rehash(params[0])
+    assert passwords.verify(params[0], 'secret')
+
+def test_login_keeps_current_hashes(client, db, passwords):
+    serve_user(db, 'username', passwords.hash('secret'))
+    client.post('/login', data={'username': 'ana', 'password': 'secret'})
+    (sql, _), = db.executed('UPDATE users SET is_online = TRUE')
+    assert 'password_hash' not in sql
+
+def test_metrics_need_a_configured_token(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module.Config, 'METRICS_TOKEN', '')
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setattr(app_module.Config, 'METRICS_TOKEN', 'scrape-me')
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 404
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-me'})
+    assert response.status_code == 200
+    assert b'vibesphere_' in response.data
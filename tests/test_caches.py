@@ -0,0 +1,112 @@
+import pytest
+import feed_cache
+import user_cache
+from chat_members import ChatMembershipCache
+from feed_cache import FeedCache
+from user_cache import UserProfileCache
+
+def post(post_id):
+    return {'id': post_id, 'like_count': 0, 'comments': [{'id': post_id * 10}]}
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(feed_cache, 'time', clock)
+    monkeypatch.setattr(user_cache, 'time', clock)
+
+def test_feed_page_read_before_invalidation_is_not_kept():
+    cache = FeedCache()
+    generation = cache.generation()
+    cache.invalidate_posts([1])
+    cache.put(None, 10, [post(1)], None, generation)
+    assert cache.get(None, 10) is None
+
+    cache.put(None, 10, [post(1)], None, cache.generation())
+    assert cache.get(None, 10) == ([post(1)], None)
+
+def test_feed_invalidation_drops_only_pages_with_the_post():
+    cache = FeedCache()
+    cache.put(None, 2, [post(3), post(2)], 2, cache.generation())
+    cache.put(2, 2, [post(1)], None, cache.generation())
+    cache.invalidate_posts([1])
+    assert cache.get(None, 2) is not None
+    assert cache.get(2, 2) is None
+    cache.invalidate_all()
+    assert cache.get(None, 2) is None
+
+def test_feed_pages_read_while_settling_are_not_kept(clock):
+    cache = FeedCache(settle=2.0)
+    cache.invalidate_posts([1])
+    assert cache.generation() is None
+    cache.put(None, 10, [post(1)], None, cache.generation())
+    assert cache.get(None, 10) is None
+
+    clock.advance(2)
+    cache.put(None, 10, [post(1)], None, cache.generation())
+    assert cache.get(None, 10) is not None
+
+def test_feed_pages_are_copies():
+    cache = FeedCache()
+    cache.put(None, 10, [post(1)], None, cache.generation())
+    posts, _ = cache.get(None, 10)
+    posts[0]['user_liked'] = 1
+    posts[0]['comments'][0]['text'] = 'changed'
+    assert cache.get(None, 10) == ([post(1)], None)
+
+def test_feed_expired_page_only_when_allowed(clock):
+    cache = FeedCache(ttl=30.0)
+    cache.put(None, 10, [post(1)], None, cache.generation())
+    clock.advance(31)
+    assert cache.get(None, 10, allow_expired=True) is not None
+    assert cache.get(None, 10) is None
+
+def test_profiles_are_cached(db):
+    cache = UserProfileCache(db)
+    db.results = [[(1, 'ana', None, None)]]
+    assert cache.get(1) == {'username': 'ana', 'profile_picture': None, 'profile_picture_variants': None}
+    assert cache.get(1)['username'] == 'ana'
+    assert len(db.statements) == 1
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1}
+
+def test_profile_read_racing_an_invalidation_is_not_kept(db):
+    cache = UserProfileCache(db)
+    db.results = [[(1, 'old', None, None)], [(1, 'new', None, None)]]
+    # edit_profile commits and invalidates while the old row is being read
+    db.on_execute = lambda sql, params: cache.invalidate(1)
+    assert cache.get(1)['username'] == 'old'
+    db.on_execute = None
+    assert cache.get(1)['username'] == 'new'
+    assert len(db.statements) == 2
+
+def test_profiles_read_while_settling_are_not_kept(db, clock):
+    cache = UserProfileCache(db, settle=2.0)
+    cache.invalidate(1)
+    db.results = [[(1, 'ana', None, None)], [(1, 'ana', None, None)]]
+    cache.get(1)
+    cache.get(1)
+    assert len(db.statements) == 2
+
+    clock.advance(2)
+    db.results = [[(1, 'ana', None, None)]]
+    cache.get(1)
+    cache.get(1)
+    assert len(db.statements) == 3
+
+def test_cached_only_skips_the_database(db):
+    cache = UserProfileCache(db)
+    rows = cache.hydrate([{'user_id': 1}], cached_only=True)
+    assert rows == [{'user_id': 1, 'username': None, 'profile_picture': None,
+                     'profile_picture_variants': None}]
+    assert db.statements == []
+
+def test_chat_members_are_cached_but_misses_are_not(db):
+    cache = ChatMembershipCache(db, max_size=1)
+    db.results = [None, (1, 2), (3, 4)]
+    # A chat another worker hasn't created yet
+    assert cache.members(5) is None
+    assert cache.members(5) == (1, 2)
+    assert cache.members(5) == (1, 2)
+    assert len(db.statements) == 2
+    cache.remember(6, 1, 3)
+    # Only the most recent chat fits
+    assert cache.members(5) == (3, 4)
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 3}
@@ -0,0 +1,142 @@
+import pytest
+from mysql.connector import Error, errorcode
+import database
+from database import MIGRATIONS, ConnectionPool, Database, PoolTimeout
+
+def test_migrations_wait_for_the_lock(fake_mysql):
+    fake_mysql.answer('GET_LOCK', [(0,)])
+    assert Database().migrate() == 0
+    assert [sql for sql, _ in fake_mysql.statements] == ["SELECT GET_LOCK('schema_migrations', 60)"]
+
+def test_nothing_pending_runs_no_ddl(fake_mysql):
+    fake_mysql.answer('GET_LOCK', [(1,)])
+    fake_mysql.answer('SELECT version FROM schema_migrations', [(version,) for version, _, _ in MIGRATIONS])
+    fake_mysql.answer('RELEASE_LOCK', [(1,)])
+    assert Database().migrate() == 0
+    assert [sql for sql, _ in fake_mysql.statements] == [
+        "SELECT GET_LOCK('schema_migrations', 60)",
+        'SELECT version FROM schema_migrations',
+        "SELECT RELEASE_LOCK('schema_migrations')",
+    ]
+
+@pytest.fixture
+def pool(fake_mysql, monkeypatch, clock):
+    monkeypatch.setattr(database, 'time', clock)
+    return ConnectionPool({'host': 'primary'}, max_size=2, timeout=0.01, max_lifetime=1800, ping_interval=30)
+
+def test_pool_reuses_the_most_recent_connection(pool, fake_mysql):
+    with pool.acquire():
+        with pool.acquire():
+            pass
+    # The outer connection went back last, so it is the warmest
+    with pool.acquire() as connection:
+        connection.cursor().execute("SELECT 1")
+        assert [raw.in_transaction for raw in fake_mysql.connections] == [True, False]
+    assert pool.stats()['created'] == 2
+    assert pool.stats()['checkouts'] == 3
+
+def test_pool_pings_only_connections_idle_past_the_interval(pool, fake_mysql, clock):
+    with pool.acquire():
+        pass
+    raw = fake_mysql.connections[0]
+    clock.advance(29)
+    with pool.acquire():
+        pass
+    assert raw.pings == 0
+    clock.advance(30)
+    with pool.acquire():
+        pass
+    assert raw.pings == 1
+
+def test_pool_replaces_a_connection_that_fails_its_ping(pool, fake_mysql, clock):
+    with pool.acquire():
+        pass
+    clock.advance(30)
+    fake_mysql.fail_pings = 1
+    with pool.acquire():
+        pass
+    assert fake_mysql.connections[0].closed
+    assert len(fake_mysql.connections) == 2
+    assert pool.stats()['health_check_failures'] == 1
+
+def test_pool_recycles_old_connections(pool, fake_mysql, clock):
+    with pool.acquire():
+        pass
+    clock.advance(1801)
+    with pool.acquire():
+        pass
+    assert fake_mysql.connections[0].closed
+    assert pool.stats()['recycled'] == 1
+    assert pool.stats()['size'] == 1
+
+def test_pool_rolls_back_on_release(pool, fake_mysql):
+    with pool.acquire() as connection:
+        connection.cursor().execute("UPDATE posts SET like_count = 1")
+    raw = fake_mysql.connections[0]
+    assert raw.rollbacks == 1
+    with pool.acquire() as connection:
+        connection.cursor().execute("SELECT 1")
+        connection.commit()
+    assert raw.rollbacks == 1
+
+def test_pool_times_out_when_full(fake_mysql):
+    pool = ConnectionPool({'host': 'primary'}, max_size=1, timeout=0.01)
+    with pool.acquire():
+        with pytest.raises(PoolTimeout):
+            pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+    assert pool.stats()['in_use'] == 0
+
+@pytest.fixture
+def replicated(fake_mysql, monkeypatch, clock):
+    monkeypatch.setattr(database.Config, 'DB_REPLICA_HOSTS', 'replica1, replica2:3307')
+    monkeypatch.setattr(database, 'time', clock)
+    return Database()
+
+def read_host(db, pinned=False):
+    with db.read_connection(pinned) as connection:
+        return connection.host
+
+def test_reads_go_to_replicas_unless_pinned(replicated):
+    assert [replica.name for replica in replicated.replicas] == [
+        f"replica1:{database.Config.DB_PORT}", 'replica2:3307']
+    assert read_host(replicated) in ('replica1', 'replica2')
+    assert read_host(replicated, pinned=True) == database.Config.DB_HOST
+
+def test_reads_spread_over_the_least_busy_replicas(replicated):
+    with replicated.read_connection() as first:
+        with replicated.read_connection() as second:
+            assert {first.host, second.host} == {'replica1', 'replica2'}
+
+def test_unreachable_replicas_are_skipped_for_a_while(replicated, fake_mysql, clock):
+    fake_mysql.down.update({'replica1', 'replica2'})
+    assert read_host(replicated) == database.Config.DB_HOST
+    assert [replica['healthy'] for replica in replicated.replica_stats()] == [False, False]
+
+    # Back up, but not tried again until the ejection runs out
+    fake_mysql.down.clear()
+    connects = len(fake_mysql.connections)
+    assert read_host(replicated) == database.Config.DB_HOST
+    assert all(connection.host == database.Config.DB_HOST for connection in fake_mysql.connections[connects:])
+    clock.advance(database.Config.DB_REPLICA_EJECT_TIME)
+    assert read_host(replicated) in ('replica1', 'replica2')
+
+def test_replica_lost_mid_query_is_ejected(replicated):
+    with pytest.raises(Error):
+        with replicated.read_connection() as connection:
+            host = connection.host
+            raise Error(msg='Lost connection to MySQL server during query', errno=errorcode.CR_SERVER_LOST)
+    ejected, = [replica for replica in replicated.replica_stats() if not replica['healthy']]
+    assert ejected['name'].startswith(host)
+    # A bad query says nothing about the server
+    with pytest.raises(Error):
+        with replicated.read_connection():
+            raise Error(msg='Unknown column', errno=errorcode.ER_BAD_FIELD_ERROR)
+    assert sum(not replica['healthy'] for replica in replicated.replica_stats()) == 1
+
+def test_pin_lasts_the_read_your_writes_window(replicated, clock):
+    replicated.pin(1)
+    assert replicated.is_pinned(1)
+    assert not replicated.is_pinned(2)
+    clock.advance(database.Config.DB_READ_YOUR_WRITES_WINDOW)
+    assert not replicated.is_pinned(1)
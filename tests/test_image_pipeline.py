@@ -0,0 +1,29 @@
+import json
+from PIL import Image
+from image_pipeline import ImagePipeline, make_post_variants, parse_variants
+
+def recorded(db):
+    (sql, params), = db.executed('UPDATE posts SET image_variants')
+    return json.loads(params[0])
+
+def test_missing_source_is_recorded_as_kept(db, tmp_path):
+    pipeline = ImagePipeline(db, str(tmp_path))
+    pipeline._process('post', 7, 'uploads/media/ab/cd/gone.jpg')
+    assert recorded(db) == {}
+    # No empty shard directories left behind
+    assert list(tmp_path.iterdir()) == []
+    assert pipeline.stats()['processed'] == 1
+
+def test_unreadable_source_is_recorded_as_kept(db, tmp_path):
+    image_path = tmp_path / 'broken.jpg'
+    image_path.write_bytes(b'\xff\xd8\xff\xe0 not really a jpeg')
+    ImagePipeline(db, str(tmp_path))._process('post', 7, 'broken.jpg')
+    assert recorded(db) == {}
+
+def test_variants_are_never_upscaled(tmp_path):
+    Image.new('RGB', (800, 600), (200, 30, 30)).save(tmp_path / 'photo.jpg')
+    variants = make_post_variants(str(tmp_path / 'photo.jpg'), str(tmp_path), 'variants', 'post_photo')
+    assert sorted(variants['jpeg']) == [320, 640, 800]
+    with Image.open(tmp_path / variants['webp'][640]) as image:
+        assert image.size == (640, 480)
+    assert parse_variants(json.dumps(variants)) == variants
@@ -0,0 +1,65 @@
+import pytest
+from mysql.connector import Error
+from like_buffer import LikeBuffer
+
+def writes(db):
+    return [(sql.split()[0], params) for sql, params in db.statements if not sql.startswith('SELECT')]
+
+def test_toggles_are_buffered_until_flush(db):
+    buffer = LikeBuffer(db)
+    db.results = [(4, 0), (4, 0)]
+    assert buffer.toggle(1, 10) == ('liked', 5)
+    assert buffer.toggle(2, 10) == ('liked', 6)
+    # Already known: no read
+    assert buffer.toggle(1, 10) == ('unliked', 5)
+    assert len(db.statements) == 2
+    assert writes(db) == []
+
+    assert buffer.flush() == 2
+    assert db.commits == 1
+    assert buffer.flush() == 0
+
+def test_failed_flush_merges_under_newer_toggles(db):
+    buffer = LikeBuffer(db)
+    db.results = [(0, 0), (0, 0)]
+    assert buffer.toggle(1, 10) == ('liked', 1)
+    assert buffer.toggle(2, 10) == ('liked', 2)
+
+    db.fail_commits = 1
+    during = []
+
+    def unlike_while_writing():
+        # user 1 changes their mind while the batch is being written
+        during.append(buffer.toggle(1, 10))
+    db.on_commit = unlike_while_writing
+
+    with pytest.raises(Error):
+        buffer.flush()
+    db.on_commit = None
+    assert during == [('unliked', 1)]
+    assert buffer.stats()['pending'] == 2
+    assert buffer.pending_for(1) == {10: False}
+    assert buffer.pending_for(2) == {10: True}
+    posts = [{'id': 10, 'like_count': 0, 'user_liked': 0}]
+    buffer.apply_pending(posts, 2)
+    assert posts == [{'id': 10, 'like_count': 1, 'user_liked': 1}]
+
+    db.statements = []
+    assert buffer.flush() == 2
+    assert writes(db) == [('INSERT', (2, 10)), ('DELETE', (10, 1))]
+    assert buffer.stats() == {'pending': 0, 'inflight': 0, 'flushes': 1, 'flushed_pairs': 2}
+
+def test_toggle_of_missing_post(db):
+    buffer = LikeBuffer(db)
+    assert buffer.toggle(1, 99) is None
+    assert buffer.stats()['pending'] == 0
+
+def test_flush_reports_written_posts(db):
+    flushed = []
+    buffer = LikeBuffer(db, on_flush=flushed.append)
+    db.results = [(0, 0), (3, 1)]
+    buffer.toggle(1, 10)
+    buffer.toggle(1, 11)
+    buffer.flush()
+    assert flushed == [{10, 11}]
+    assert db.commits == 1
@@ -0,0 +1,48 @@
+import hashlib
+import io
+import os
+import pytest
+from media_store import MediaStore
+
+@pytest.fixture
+def store(tmp_path):
+    return MediaStore(str(tmp_path / 'static'), str(tmp_path / 'work'), chunk_size=4)
+
+def stored_path(data, extension):
+    digest = hashlib.sha256(data).hexdigest()
+    return f"uploads/media/{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+def test_save_names_files_by_content(store):
+    path = store.save(io.BytesIO(b'same bytes'), 'JPG')
+    assert path == stored_path(b'same bytes', 'jpg')
+    assert open(os.path.join(store.static_folder, path), 'rb').read() == b'same bytes'
+    assert oct(os.stat(os.path.join(store.static_folder, path)).st_mode & 0o777) == '0o644'
+    # Identical uploads are kept once
+    assert store.save(io.BytesIO(b'same bytes'), 'jpg') == path
+    assert os.listdir(store.temp_dir) == []
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='counts open files through /proc')
+def test_failed_save_leaves_nothing_behind(store):
+    def fail(function, *args):
+        raise RuntimeError('thread pool is gone')
+    store.offload = fail
+    open_files = len(os.listdir('/proc/self/fd'))
+    with pytest.raises(RuntimeError):
+        store.save(io.BytesIO(b'data'), 'jpg')
+    assert os.listdir(store.temp_dir) == []
+    assert len(os.listdir('/proc/self/fd')) == open_files
+
+def test_adopt_hashes_a_finished_file(store):
+    finished = os.path.join(store.work_dir, 'finished.part')
+    with open(finished, 'wb') as f:
+        f.write(b'uploaded in chunks')
+    path = store.adopt(finished, 'mp4')
+    assert path == stored_path(b'uploaded in chunks', 'mp4')
+    assert not os.path.exists(finished)
+
+    # A second copy of the same bytes is dropped, the stored one kept
+    with open(finished, 'wb') as f:
+        f.write(b'uploaded in chunks')
+    assert store.adopt(finished, 'mp4', hashlib.sha256(b'uploaded in chunks')) == path
+    assert not os.path.exists(finished)
+    assert os.path.exists(os.path.join(store.static_folder, path))
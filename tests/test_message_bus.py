@@ -0,0 +1,130 @@
+import os
+import queue
+import socket
+import threading
+import time
+import pytest
+from feed_cache import FeedCache
+from message_bus import BusChannel, InProcessBus, UnixSocketBus, create_bus
+
+def start_listening(bus, channel, directory=None):
+    # Collect what bus.listen(channel) yields on a background thread; for a
+    # Unix socket bus, wait until its socket is bound
+    received = queue.Queue()
+    before = set(os.listdir(directory)) if directory else set()
+
+    def run():
+        for message in bus.listen(channel):
+            received.put(message)
+
+    threading.Thread(target=run, daemon=True).start()
+    if directory:
+        deadline = time.monotonic() + 5
+        while set(os.listdir(directory)) == before:
+            assert time.monotonic() < deadline, 'listener never bound its socket'
+            time.sleep(0.01)
+    return received
+
+def test_create_bus():
+    assert create_bus('') is None
+    assert isinstance(create_bus('memory://'), InProcessBus)
+    with pytest.raises(ValueError):
+        create_bus('kafka://broker')
+
+def test_unix_bus_delivers_between_instances(tmp_path):
+    first = UnixSocketBus(str(tmp_path))
+    second = UnixSocketBus(str(tmp_path))
+    first_received = start_listening(first, 'feed', str(tmp_path))
+    second_received = start_listening(second, 'feed', str(tmp_path))
+
+    first.publish('feed', {'post_ids': [1, 2]})
+    assert second_received.get(timeout=5) == {'post_ids': [1, 2]}
+    # A bus doesn't deliver to its own listeners
+    with pytest.raises(queue.Empty):
+        first_received.get(timeout=0.2)
+
+    second.publish('feed', {'post_ids': None})
+    assert first_received.get(timeout=5) == {'post_ids': None}
+
+def test_unix_bus_drops_dead_listeners(tmp_path):
+    bus = UnixSocketBus(str(tmp_path))
+    stale = tmp_path / 'feed.1.deadbeef.sock'
+    stale.touch()
+    bus.publish('feed', {'post_ids': [1]})
+    assert not stale.exists()
+
+def test_feed_invalidation_reaches_other_worker():
+    bus = InProcessBus()
+    first = FeedCache(bus=bus)
+    second = FeedCache(bus=bus)
+    threading.Thread(target=second.channel.listen, args=(second.receive,), daemon=True).start()
+    second.put(None, 10, [{'id': 7, 'comments': []}], None, second.generation())
+    deadline = time.monotonic() + 5
+    while second.get(None, 10) is not None:
+        # Until the listener subscribes, publish again
+        assert time.monotonic() < deadline, 'invalidation never arrived'
+        first.invalidate_posts([7])
+        time.sleep(0.01)
+    assert second.stats()['pages'] == 0
+
+class FlakyBus:
+    # listen() yields its scripted messages, then fails; the last script
+    # blocks forever like a healthy subscription
+    def __init__(self, *scripts):
+        self.scripts = list(scripts)
+        self.subscriptions = 0
+        self.published = []
+
+    def publish(self, channel, message):
+        self.published.append(message)
+
+    def listen(self, channel):
+        self.subscriptions += 1
+        script = self.scripts.pop(0)
+        yield from script
+        if self.scripts:
+            raise ConnectionError('connection reset by peer')
+        threading.Event().wait()
+
+def test_channel_resubscribes_after_the_bus_fails():
+    bus = FlakyBus([{'worker': 'other', 'n': 1}], [], [{'worker': 'other', 'n': 2}])
+    channel = BusChannel(bus, 'feed', retry_delay=0.01)
+    received = queue.Queue()
+    threading.Thread(target=channel.listen, args=(received.put,), daemon=True).start()
+    assert received.get(timeout=5)['n'] == 1
+    assert received.get(timeout=5)['n'] == 2
+    assert bus.subscriptions == 3
+    assert channel.stats()['listen_errors'] == 2
+    assert channel.stats()['received'] == 2
+
+def test_channel_skips_own_and_bad_messages():
+    bus = FlakyBus([{'n': 1}, {'n': 2}, {'n': 3}])
+    channel = BusChannel(bus, 'feed')
+    bus.scripts[0][1]['worker'] = channel.worker_id
+    applied = queue.Queue()
+
+    def handler(message):
+        if message['n'] == 1:
+            raise KeyError('post_ids')
+        applied.put(message['n'])
+    threading.Thread(target=channel.listen, args=(handler,), daemon=True).start()
+    assert applied.get(timeout=5) == 3
+    assert channel.stats()['handler_errors'] == 1
+
+def test_channel_publish_never_raises():
+    channel = BusChannel(InProcessBus(), 'feed')
+    channel.publish({'post_ids': [1]})
+    # Only JSON travels on a bus
+    channel.publish({'post_ids': {1, 2}})
+    assert channel.stats()['published'] == 1
+    assert channel.stats()['publish_errors'] == 1
+    BusChannel(None, 'feed').publish({'post_ids': [1]})
+
+def test_unix_bus_drops_malformed_payloads(tmp_path):
+    bus = UnixSocketBus(str(tmp_path))
+    received = start_listening(bus, 'feed', str(tmp_path))
+    path, = [str(path) for path in tmp_path.iterdir()]
+    sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sender.sendto(b'\x80\x04not json', path)
+    sender.sendto(b'{"post_ids": [5]}', path)
+    assert received.get(timeout=5) == {'post_ids': [5]}
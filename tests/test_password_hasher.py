@@ -0,0 +1,24 @@
+from password_hasher import PasswordHasher
+
+def test_hashes_verify_and_are_counted():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+    password_hash = hasher.hash('secret')
+    assert hasher.verify(password_hash, 'secret')
+    assert not hasher.verify(password_hash, 'Secret')
+    assert hasher.stats()['hashes'] == 3
+
+def test_needs_rehash_compares_method_and_work_factor():
+    hasher = PasswordHasher('pbkdf2:sha256:1000')
+    assert not hasher.needs_rehash(hasher.hash('secret'))
+    assert hasher.needs_rehash(PasswordHasher('pbkdf2:sha256:500').hash('secret'))
+    assert hasher.needs_rehash(PasswordHasher('scrypt:16384:8:1').hash('secret'))
+
+def test_hashing_is_offloaded():
+    calls = []
+
+    def offload(function, *args):
+        calls.append(function.__name__)
+        return function(*args)
+    hasher = PasswordHasher('pbkdf2:sha256:1000', offload=offload)
+    hasher.verify(hasher.hash('secret'), 'secret')
+    assert calls == ['generate_password_hash', 'check_password_hash']
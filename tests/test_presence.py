@@ -0,0 +1,118 @@
+import pytest
+import presence
+from presence import PresenceManager
+
+class LinkedBus:
+    # Delivers every publish straight to the other managers, in order
+    def __init__(self):
+        self.managers = []
+
+    def publish(self, channel, message):
+        for manager in self.managers:
+            manager.receive(dict(message))
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(presence, 'time', clock)
+
+def test_grace_period_expiry(db, clock):
+    manager = PresenceManager(db, grace_period=5.0)
+    assert manager.connect(1, 'tab') is True
+    manager.disconnect('tab')
+
+    clock.advance(4.9)
+    assert manager.tick() == []
+    assert manager.is_online(1)
+
+    clock.advance(0.2)
+    assert manager.tick() == [1]
+    assert not manager.is_online(1)
+    assert manager.tick() == []
+
+def test_reconnect_within_grace_is_not_announced(db, clock):
+    manager = PresenceManager(db, grace_period=5.0)
+    manager.connect(1, 'old')
+    manager.disconnect('old')
+    clock.advance(3)
+    assert manager.connect(1, 'new') is False
+    clock.advance(10)
+    assert manager.tick() == []
+    assert manager.is_online(1)
+
+def test_multiple_tabs(db, clock):
+    manager = PresenceManager(db, grace_period=5.0)
+    assert manager.connect(1, 'first') is True
+    assert manager.connect(1, 'second') is False
+    assert manager.stats()['connections'] == 2
+
+    manager.disconnect('first')
+    clock.advance(10)
+    assert manager.tick() == []
+    assert manager.is_online(1)
+
+    manager.disconnect('second')
+    clock.advance(10)
+    assert manager.tick() == [1]
+
+def test_silent_tab_expires_after_heartbeat_timeout(db, clock):
+    manager = PresenceManager(db, grace_period=5.0, heartbeat_timeout=90.0)
+    manager.connect(1, 'tab')
+    clock.advance(60)
+    manager.heartbeat(1, 'tab')
+    clock.advance(60)
+    assert manager.tick() == []
+    clock.advance(31)
+    assert manager.tick() == []
+    assert manager.stats()['connections'] == 0
+    clock.advance(5)
+    assert manager.tick() == [1]
+
+def test_flush_writes_final_state_once(db, clock):
+    manager = PresenceManager(db, grace_period=5.0)
+    manager.connect(1, 'a')
+    manager.connect(2, 'b')
+    manager.disconnect('b')
+    clock.advance(5)
+    manager.tick()
+
+    assert manager.flush() == 2
+    assert [params for _, params in db.statements] == [(1,), (2,)]
+    assert 'is_online = TRUE' in db.statements[0][0]
+    assert 'is_online = FALSE' in db.statements[1][0]
+    assert manager.flush() == 0
+
+def test_failed_flush_keeps_newer_state(db, clock):
+    manager = PresenceManager(db, grace_period=5.0)
+    manager.connect(1, 'a')
+    db.fail_commits = 1
+
+    def go_offline():
+        # Arrives while the first write is in progress
+        manager.disconnect('a')
+        clock.advance(5)
+        manager.tick()
+    db.on_commit = go_offline
+
+    with pytest.raises(presence.Error):
+        manager.flush()
+    db.on_commit = None
+    assert manager.flush() == 1
+    assert 'is_online = FALSE' in db.statements[-1][0]
+
+def test_user_online_on_another_worker_stays_online(db, clock):
+    bus = LinkedBus()
+    first = PresenceManager(db, grace_period=5.0, bus=bus)
+    second = PresenceManager(db, grace_period=5.0, bus=bus)
+    bus.managers = [first, second]
+
+    assert first.connect(1, 'a') is True
+    assert second.connect(1, 'b') is False
+    first.disconnect('a')
+    clock.advance(5)
+    assert first.tick() == []
+    assert first.is_online(1)
+
+    second.disconnect('b')
+    clock.advance(5)
+    assert second.tick() == [1]
+    assert not first.is_online(1)
@@ -0,0 +1,39 @@
+from datetime import datetime
+import check_query_plans
+
+def normalize(sql):
+    return ' '.join(sql.split())
+
+def post_row(post_id):
+    return {'id': post_id, 'user_id': 1, 'image_url': None, 'video_url': None, 'caption': '',
+            'image_variants': None, 'like_count': 0, 'comment_count': 0,
+            'created_at': datetime(2024, 1, 1, 12, 0)}
+
+def test_checked_statements_are_the_ones_the_app_runs(app_module, client, login, db):
+    checked = {normalize(query) for _, query, _ in check_query_plans.HOT_QUERIES}
+    db.answer('FROM posts p', [post_row(3), post_row(2), post_row(1)])
+    db.answer('FROM chat_sessions', [])
+    login()
+    client.get('/posts/1/comments')
+    client.get('/posts/1/comments?cursor=' + app_module.encode_cursor({'created_at': datetime(2024, 1, 1), 'id': 9}))
+    client.get('/get_messages/1')
+    client.get('/chat')
+    client.get('/start_chat/2')
+    with app_module.db.connection() as connection:
+        app_module.load_feed_page(connection.cursor(dictionary=True), None, 3)
+        app_module.load_feed_page(connection.cursor(dictionary=True), (datetime(2024, 1, 1), 9), 3)
+    client.post('/login', data={'username': 'nobody', 'password': 'x'})
+    client.post('/login', data={'username': 'nobody@example.com', 'password': 'x'})
+
+    reads = {sql for sql, _ in db.statements if sql.startswith(('SELECT', '('))}
+    assert reads
+    assert reads - checked == set()
+
+def test_full_scans_fail_the_check(fake_mysql, capsys):
+    fake_mysql.answer('EXPLAIN SELECT p.* FROM posts p WHERE p.user_id',
+                      [{'table': 'posts', 'type': 'ALL'}])
+    fake_mysql.answer('EXPLAIN', [{'table': 'x', 'type': 'ref'}])
+    assert check_query_plans.main() == 1
+    output = capsys.readouterr().out
+    assert 'FAIL  profile: posts: full scan on posts' in output
+    assert output.count('FAIL') == 1
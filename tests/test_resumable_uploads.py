@@ -0,0 +1,83 @@
+import hashlib
+import io
+import os
+import pytest
+from media_store import MediaStore
+from resumable_uploads import ResumableUploads, UploadError
+
+DATA = b'0123456789' * 3
+
+@pytest.fixture
+def uploads(tmp_path):
+    store = MediaStore(str(tmp_path / 'static'), str(tmp_path / 'work'))
+    return ResumableUploads(store, max_size=100, read_size=4)
+
+def upload(uploads, user_id=1, data=DATA, chunk=8):
+    upload_id = uploads.create(user_id, 'mp4', len(data))
+    for offset in range(0, len(data), chunk):
+        piece = data[offset:offset + chunk]
+        uploads.write(upload_id, user_id, offset, io.BytesIO(piece), len(piece))
+    return upload_id
+
+def test_resumes_from_what_was_stored(uploads):
+    upload_id = uploads.create(1, 'mp4', len(DATA))
+    # The connection dropped after 5 of 10 bytes
+    assert uploads.write(upload_id, 1, 0, io.BytesIO(DATA[:5]), 10) == 5
+    with pytest.raises(UploadError) as raised:
+        uploads.write(upload_id, 1, 10, io.BytesIO(DATA[10:20]), 10)
+    assert (raised.value.status, raised.value.offset) == (409, 5)
+    assert uploads.write(upload_id, 1, 5, io.BytesIO(DATA[5:]), len(DATA) - 5) == len(DATA)
+    assert uploads.status(upload_id, 1)['offset'] == len(DATA)
+
+def test_finalize_is_idempotent(uploads):
+    upload_id = upload(uploads)
+    path = uploads.finalize(upload_id, 1)
+    digest = hashlib.sha256(DATA).hexdigest()
+    assert path.endswith(f"{digest}.mp4")
+    assert uploads.finalize(upload_id, 1) == path
+    assert uploads.status(upload_id, 1)['finalized']
+    with open(os.path.join(uploads.store.static_folder, path), 'rb') as f:
+        assert f.read() == DATA
+
+def test_finalize_rehashes_after_a_restart(uploads):
+    upload_id = upload(uploads)
+    # Another process took over; this one never saw the bytes
+    uploads._hashers.clear()
+    assert uploads.finalize(upload_id, 1).endswith(f"{hashlib.sha256(DATA).hexdigest()}.mp4")
+
+def test_incomplete_and_foreign_uploads_are_refused(uploads):
+    upload_id = upload(uploads)
+    partial = uploads.create(1, 'mp4', len(DATA))
+    with pytest.raises(UploadError) as raised:
+        uploads.finalize(partial, 1)
+    assert raised.value.status == 409
+    with pytest.raises(UploadError) as raised:
+        uploads.status(upload_id, 2)
+    assert raised.value.status == 404
+    with pytest.raises(UploadError):
+        uploads.status('../../etc/passwd', 1)
+
+def test_claim_uses_the_upload_only_if_the_post_is_saved(uploads):
+    upload_id = upload(uploads)
+    with pytest.raises(UploadError):
+        with uploads.claim(upload_id, 1):
+            pass
+    path = uploads.finalize(upload_id, 1)
+
+    with pytest.raises(RuntimeError):
+        with uploads.claim(upload_id, 1) as (media_path, extension):
+            raise RuntimeError('insert failed')
+    # Still there for a retry
+    with uploads.claim(upload_id, 1) as (media_path, extension):
+        assert (media_path, extension) == (path, 'mp4')
+    with pytest.raises(UploadError) as raised:
+        with uploads.claim(upload_id, 1):
+            pass
+    assert raised.value.status == 404
+    assert os.listdir(uploads.directory) == []
+
+def test_abandoned_uploads_are_cleaned_up(uploads):
+    upload(uploads)
+    assert uploads.cleanup(max_age=3600) == 0
+    assert uploads.cleanup(max_age=-1) == 1
+    assert os.listdir(uploads.directory) == []
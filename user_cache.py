@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from image_pipeline import parse_variants
+from message_bus import BusChannel
+import queries
+import threading
+import time
+
+class UserProfileCache:
+    # user_id -> {'username', 'profile_picture', 'profile_picture_variants'}
+    # so reads can hydrate authors from memory instead of joining users on
+    # every row. Entries live for ttl seconds in a bounded LRU. edit_profile
+    # calls invalidate(), which also tells the other workers over the message
+    # bus when there is one; without a bus other workers may serve the old
+    # name for up to ttl. Profiles read in the settle seconds after an
+    # invalidation aren't kept, as a lagging read replica may return the old
+    # row.
+    FIELDS = ('username', 'profile_picture', 'profile_picture_variants')
+
+    def __init__(self, db, max_size=10000, ttl=300.0, bus=None, channel='user_profiles', settle=0.0):
+        self.db = db
+        self.max_size = max_size
+        self.ttl = ttl
+        self.settle = settle
+        self.channel = BusChannel(bus, channel)
+        self._lock = threading.Lock()
+        # user_id -> (profile, expires_at)
+        self._profiles = OrderedDict()
+        # Bumped by every invalidation so a load that raced one isn't cached
+        self._generation = 0
+        self._invalidated_at = float('-inf')
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, user_id, cursor=None):
+        return self.get_many([user_id], cursor).get(user_id)
+
+    def get_many(self, user_ids, cursor=None, cached_only=False):
+        # Returns {user_id: profile} for the ids that exist. Misses are read
+        # in one query, on the caller's cursor if given so a request holding
+        # a pooled connection doesn't check out a second one, or left out
+        # with cached_only. Raises mysql.connector.Error if that read fails.
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for user_id in set(user_ids):
+                entry = self._profiles.get(user_id)
+                if entry is not None and entry[1] > now:
+                    self._profiles.move_to_end(user_id)
+                    found[user_id] = entry[0]
+                else:
+                    missing.append(user_id)
+            self._hits += len(found)
+            self._misses += len(missing)
+            generation = self._generation if now - self._invalidated_at >= self.settle else None
+
+        if missing and not cached_only:
+            if cursor is None:
+                with self.db.connection() as connection:
+                    loaded = self._load(connection.cursor(), missing)
+            else:
+                loaded = self._load(cursor, missing)
+            found.update(loaded)
+
+            with self._lock:
+                if generation == self._generation:
+                    expires_at = time.monotonic() + self.ttl
+                    for user_id, profile in loaded.items():
+                        self._profiles[user_id] = (profile, expires_at)
+                        self._profiles.move_to_end(user_id)
+                    while len(self._profiles) > self.max_size:
+                        self._profiles.popitem(last=False)
+        return found
+
+    def _load(self, cursor, user_ids):
+        cursor.execute(queries.user_profiles(self.FIELDS, len(user_ids)), tuple(user_ids))
+        profiles = {}
+        for row in cursor.fetchall():
+            if not isinstance(row, dict):
+                row = dict(zip(('id',) + self.FIELDS, row))
+            profile = {field: row[field] for field in self.FIELDS}
+            profile['profile_picture_variants'] = parse_variants(profile['profile_picture_variants'])
+            profiles[row['id']] = profile
+        return profiles
+
+    def hydrate(self, rows, key='user_id', prefix='', cursor=None, cached_only=False):
+        # Set the FIELDS (with prefix) on each row from the user id in row[key]
+        profiles = self.get_many([row[key] for row in rows], cursor, cached_only)
+        for row in rows:
+            profile = profiles.get(row[key], {})
+            for field in self.FIELDS:
+                row[prefix + field] = profile.get(field)
+        return rows
+
+    def invalidate(self, user_id):
+        self._forget(user_id)
+        self.channel.publish({'user_id': user_id})
+
+    def _forget(self, user_id):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+            self._generation += 1
+            self._invalidated_at = time.monotonic()
+
+    def receive(self, message):
+        # Another worker's invalidation, from channel.listen()
+        self._forget(message['user_id'])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._profiles),
+                'hits': self._hits,
+                'misses': self._misses,
+            }